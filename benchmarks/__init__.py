@@ -0,0 +1,66 @@
+"""
+Performance benchmarks for the locallibrary site.
+
+Each benchmark is a script run from the project root, e.g.
+
+    python -m benchmarks.index_stats --sizes 10000 100000
+    python -m benchmarks.load --instances 100000 --output after.json
+    python -m benchmarks.concurrency --latency-ms 20 --clients 64
+    python -m benchmarks.facets --books 1000000 --instances 2000000
+    python -m benchmarks.connections --requests 2000 --threads 8
+
+They build a throwaway SQLite database (or use $DATABASE_URL when set)
+so they never touch the development database.
+"""
+import os
+import tempfile
+import time
+
+
+def setup_django(database_url=None):
+    """
+    Point the project settings at a scratch database, set Django up and
+    create the schema. Returns the database url in use.
+    """
+    if database_url is None:
+        database_url = os.environ.get('DATABASE_URL')
+    if database_url is None:
+        handle, path = tempfile.mkstemp(prefix='locallibrary-bench-',
+                                        suffix='.sqlite3')
+        os.close(handle)
+        database_url = 'sqlite:///' + path
+    # settings.py reads the database configuration from $DATABASE_URL
+    os.environ['DATABASE_URL'] = database_url
+    # Measure without DEBUG, which logs every query in memory
+    os.environ.setdefault('DJANGO_DEBUG', '')
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'locallibrary.settings')
+
+    import django
+    django.setup()
+
+    from django.core.management import call_command
+    call_command('migrate', verbosity=0, interactive=False)
+    return database_url
+
+
+def time_call(func, repeat=50):
+    """
+    Call func repeat times and return the median duration in milliseconds.
+    """
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        timings.append((time.perf_counter() - start) * 1000)
+    timings.sort()
+    return timings[len(timings) // 2]
+
+
+def percentile(timings, percent):
+    """
+    Nearest-rank percentile of a sorted list of timings.
+    """
+    if not timings:
+        return None
+    rank = max(int(round(percent / 100.0 * len(timings))), 1)
+    return timings[min(rank, len(timings)) - 1]
@@ -0,0 +1,90 @@
+"""
+Compare two benchmarks.load result files and flag regressions.
+
+    python -m benchmarks.compare before.json after.json --threshold 10
+
+An endpoint regresses when its p95 latency grows by more than threshold
+percent, or when it runs more queries per request than before. Exits
+with status 1 if any endpoint regressed, so it can gate a CI job.
+"""
+import argparse
+import json
+import sys
+
+METRICS = ('p50_ms', 'p95_ms', 'p99_ms', 'queries', 'throughput_rps')
+
+
+def change(before, after):
+    if not before:
+        return None
+    return (after - before) * 100.0 / before
+
+
+def compare(before, after, threshold):
+    """
+    Return (rows, regressions): a row per endpoint and metric with the
+    values before and after and the change in percent, and the list of
+    regression messages.
+    """
+    rows = []
+    regressions = []
+    for name in sorted(set(before['endpoints']) | set(after['endpoints'])):
+        old = before['endpoints'].get(name)
+        new = after['endpoints'].get(name)
+        if old is None or new is None:
+            rows.append((name, 'missing before' if old is None else
+                         'missing after', None, None, None))
+            continue
+        for metric in METRICS:
+            rows.append((name, metric, old[metric], new[metric],
+                         change(old[metric], new[metric])))
+        slower = change(old['p95_ms'], new['p95_ms'])
+        if slower is not None and slower > threshold:
+            regressions.append('%s: p95 %.2fms -> %.2fms (+%.0f%%)' % (
+                name, old['p95_ms'], new['p95_ms'], slower))
+        # Query counts are deterministic: any increase is a regression
+        if new['queries'] > old['queries'] + 0.05:
+            regressions.append('%s: %.1f -> %.1f queries per request' % (
+                name, old['queries'], new['queries']))
+        if new['errors'] > old['errors']:
+            regressions.append('%s: %d -> %d errors' % (
+                name, old['errors'], new['errors']))
+    return rows, regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip())
+    parser.add_argument('before', help='Baseline results (JSON)')
+    parser.add_argument('after', help='New results (JSON)')
+    parser.add_argument('--threshold', type=float, default=10.0,
+                        help='Allowed p95 slowdown in percent (default: 10)')
+    args = parser.parse_args()
+
+    with open(args.before) as handle:
+        before = json.load(handle)
+    with open(args.after) as handle:
+        after = json.load(handle)
+    if before['meta'].get('sizes') != after['meta'].get('sizes'):
+        print('Warning: the runs measured catalogs of different sizes')
+
+    rows, regressions = compare(before, after, args.threshold)
+    print('%-14s %-15s %10s %10s %9s' % ('endpoint', 'metric', 'before',
+                                         'after', 'change'))
+    for name, metric, old, new, percent in rows:
+        if old is None:
+            print('%-14s %-15s' % (name, metric))
+            continue
+        print('%-14s %-15s %10.2f %10.2f %8s' % (
+            name, metric, old, new,
+            '' if percent is None else '%+.0f%%' % percent))
+
+    if regressions:
+        print('\nRegressions:')
+        for message in regressions:
+            print('  ' + message)
+        sys.exit(1)
+    print('\nNo regressions.')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,192 @@
+"""
+Throughput of sync workers against threaded workers when the database
+is slow.
+
+    python -m benchmarks.concurrency --latency-ms 20 --clients 64 \\
+        --requests 2000 --threads 8
+
+Django 1.10 has no ASGI support and no async views, so the way to keep a
+slow query from blocking a whole worker is gunicorn's threaded (gthread)
+workers (see locallibrary/gunicorn_conf.py). This benchmark serves the
+catalog from this process twice: first handling one request at a time,
+like a sync worker, then handling up to --threads at once, like a
+gthread worker. Each time --clients concurrent clients send the same
+random mix of public pages over HTTP. Every query is delayed by
+--latency-ms, as with a database across the network, and the page cache
+is disabled so every request reaches the database. For each worker
+model it reports the throughput and the latency percentiles.
+"""
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+import os
+import random
+import threading
+import time
+from urllib.error import HTTPError
+from urllib.request import urlopen
+from wsgiref.simple_server import WSGIRequestHandler, WSGIServer
+
+from benchmarks import percentile, setup_django
+from benchmarks.datagen import add_size_arguments, generate_catalog
+
+
+class QuietHandler(WSGIRequestHandler):
+
+    def log_message(self, format, *args):
+        pass
+
+
+class SyncServer(WSGIServer):
+    """
+    Handles one request at a time, like a gunicorn sync worker.
+    """
+    # Let the clients queue up rather than be refused
+    request_queue_size = 1024
+
+
+class ThreadedServer(SyncServer):
+    """
+    Handles up to `threads` requests at once, like a gthread worker.
+    """
+
+    def __init__(self, address, handler, threads):
+        SyncServer.__init__(self, address, handler)
+        self.pool = ThreadPoolExecutor(threads)
+
+    def process_request(self, request, client_address):
+        self.pool.submit(self.process_request_thread, request,
+                         client_address)
+
+    def process_request_thread(self, request, client_address):
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+
+    def server_close(self):
+        SyncServer.server_close(self)
+        self.pool.shutdown()
+
+
+def add_latency(seconds):
+    """
+    Delay every query by seconds.
+    """
+    from django.db.backends.utils import CursorWrapper
+
+    execute = CursorWrapper.execute
+    executemany = CursorWrapper.executemany
+
+    def slow_execute(self, sql, params=None):
+        time.sleep(seconds)
+        return execute(self, sql, params)
+
+    def slow_executemany(self, sql, param_list):
+        time.sleep(seconds)
+        return executemany(self, sql, param_list)
+
+    CursorWrapper.execute = slow_execute
+    CursorWrapper.executemany = slow_executemany
+
+
+def build_paths(rng, count):
+    """
+    A random mix of the public catalog pages.
+    """
+    from django.core.urlresolvers import reverse
+    from catalog.models import Author, Book
+
+    book_pks = list(Book.objects.values_list('pk', flat=True))
+    author_pks = list(Author.objects.values_list('pk', flat=True))
+    choices = [
+        lambda: reverse('index'),
+        lambda: reverse('books'),
+        lambda: reverse('book-detail', args=[rng.choice(book_pks)]),
+        lambda: reverse('author-detail', args=[rng.choice(author_pks)]),
+    ]
+    return [rng.choice(choices)() for _ in range(count)]
+
+
+def measure(server, paths, clients):
+    """
+    Send the requests to server from `clients` threads; returns the
+    sorted latencies in milliseconds, the errors and the elapsed time.
+    """
+    base_url = 'http://%s:%d' % server.server_address
+    serving = threading.Thread(target=server.serve_forever)
+    serving.daemon = True
+    serving.start()
+
+    def fetch(path):
+        start = time.perf_counter()
+        try:
+            with urlopen(base_url + path) as response:
+                response.read()
+            ok = True
+        except (HTTPError, OSError):
+            ok = False
+        return (time.perf_counter() - start) * 1000, ok
+
+    start = time.perf_counter()
+    try:
+        with ThreadPoolExecutor(clients) as pool:
+            results = list(pool.map(fetch, paths))
+    finally:
+        server.shutdown()
+        server.server_close()
+    elapsed = time.perf_counter() - start
+    timings = sorted(timing for timing, ok in results)
+    errors = sum(1 for timing, ok in results if not ok)
+    return timings, errors, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__.strip(),
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    add_size_arguments(parser)
+    parser.add_argument('--requests', type=int, default=1000,
+                        help='Requests per worker model (default: 1000)')
+    parser.add_argument('--clients', type=int, default=64,
+                        help='Concurrent clients (default: 64)')
+    parser.add_argument('--threads', type=int, default=8,
+                        help='Threads of the threaded worker (default: 8)')
+    parser.add_argument('--latency-ms', type=float, default=20,
+                        help='Delay added to each query (default: 20)')
+    args = parser.parse_args()
+
+    # Every request must reach the (slow) database
+    os.environ.setdefault('DJANGO_CACHE_BACKEND',
+                          'django.core.cache.backends.dummy.DummyCache')
+    setup_django()
+    from django.core.wsgi import get_wsgi_application
+    from catalog.models import Book
+
+    if not Book.objects.exists():
+        start = time.time()
+        generate_catalog(args.authors, args.books, args.genres,
+                         args.instances, args.users, seed=args.seed)
+        print('Generated the catalog in %.1fs' % (time.time() - start))
+    paths = build_paths(random.Random(args.seed), args.requests)
+    add_latency(args.latency_ms / 1000.0)
+    application = get_wsgi_application()
+
+    print('%d requests from %d clients, %.0f ms per query' % (
+        args.requests, args.clients, args.latency_ms))
+    print('%-22s %9s %7s %9s %9s %9s' % (
+        'worker', 'req/sec', 'errors', 'p50 (ms)', 'p95 (ms)', 'p99 (ms)'))
+    for name, server in (
+            ('sync', SyncServer(('127.0.0.1', 0), QuietHandler)),
+            ('gthread (%d threads)' % args.threads,
+             ThreadedServer(('127.0.0.1', 0), QuietHandler, args.threads))):
+        server.set_app(application)
+        timings, errors, elapsed = measure(server, paths, args.clients)
+        print('%-22s %9.1f %7d %9.1f %9.1f %9.1f' % (
+            name, len(paths) / elapsed, errors, percentile(timings, 50),
+            percentile(timings, 95), percentile(timings, 99)))
+
+
+if __name__ == '__main__':
+    main()
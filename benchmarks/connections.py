@@ -0,0 +1,154 @@
+"""
+Connection setup cost per request, with and without the pool.
+
+    python -m benchmarks.connections --requests 2000 --threads 8
+    DATABASE_URL=postgres://... python -m benchmarks.connections
+
+Django connects at the first query of a request and, with CONN_MAX_AGE
+at 0, disconnects when it ends. Each simulated request here does the
+same: borrow the connection, look up one book by primary key (like the
+book page) and close the connection. It runs them first with the stock
+backend, which connects every time, then with the pooled backend of
+catalog.dbbackends, one thread at a time and then from --threads
+threads at once. For each it reports the request latency, how much of it
+went to connecting and how many connections were opened.
+"""
+import argparse
+import random
+import threading
+import time
+
+from benchmarks import percentile, setup_django
+from benchmarks.datagen import insert
+
+STOCK_ENGINES = {
+    'sqlite': 'django.db.backends.sqlite3',
+    'postgresql': 'django.db.backends.postgresql',
+}
+
+
+def make_wrapper(settings_dict, engine, pooled, alias):
+    from django.db.utils import load_backend
+
+    settings_dict = dict(settings_dict, ENGINE=engine)
+    if not pooled:
+        settings_dict.pop('POOL', None)
+    wrapper = load_backend(engine).DatabaseWrapper(settings_dict, alias)
+    # The wrappers are shared by the threads, one request at a time each
+    wrapper.allow_thread_sharing = True
+    return wrapper
+
+
+def run_requests(wrapper, pks):
+    """
+    One request per primary key; returns the latencies and the connect
+    times, in milliseconds.
+    """
+    timings = []
+    connecting = []
+    for pk in pks:
+        start = time.perf_counter()
+        wrapper.ensure_connection()
+        connected = time.perf_counter()
+        with wrapper.cursor() as cursor:
+            cursor.execute('SELECT id, title FROM catalog_book WHERE id = %s',
+                           [pk])
+            cursor.fetchone()
+        wrapper.close()
+        timings.append((time.perf_counter() - start) * 1000)
+        connecting.append((connected - start) * 1000)
+    return timings, connecting
+
+
+def measure(settings_dict, engine, pooled, pks, threads):
+    from catalog.dbbackends.pool import close_pools, pool_stats
+    from django.db.backends.signals import connection_created
+
+    alias = 'bench_%s' % ('pooled' if pooled else 'stock')
+    opened = []
+
+    def count(sender, connection, **kwargs):
+        if connection.alias == alias:
+            opened.append(1)
+    connection_created.connect(count)
+
+    chunks = [pks[start::threads] for start in range(threads)]
+    results = []
+
+    def worker(chunk):
+        wrapper = make_wrapper(settings_dict, engine, pooled, alias)
+        results.append(run_requests(wrapper, chunk))
+
+    workers = [threading.Thread(target=worker, args=(chunk,))
+               for chunk in chunks]
+    start = time.perf_counter()
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    connection_created.disconnect(count)
+
+    if pooled:
+        # connection_created fires on every checkout; the pool knows
+        # which of them were new
+        connections = sum(stats['opened'] for stats in pool_stats()
+                          if stats['alias'] == alias)
+        close_pools(alias)
+    else:
+        connections = len(opened)
+    timings = sorted(timing for result in results for timing in result[0])
+    connecting = sorted(timing for result in results
+                        for timing in result[1])
+    return timings, connecting, connections, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__.strip(),
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--books', type=int, default=1000,
+                        help='Books to look up (default: 1000)')
+    parser.add_argument('--requests', type=int, default=2000,
+                        help='Requests per run (default: 2000)')
+    parser.add_argument('--threads', type=int, default=8,
+                        help='Threads of the concurrent runs (default: 8)')
+    parser.add_argument('--seed', type=int, default=0,
+                        help='Random seed (default: 0)')
+    args = parser.parse_args()
+
+    setup_django()
+    from django.db import connection
+    from catalog.models import Book
+
+    if not Book.objects.exists():
+        insert(Book, (Book(title='Book %d' % n, summary='Summary',
+                           isbn='%013d' % n) for n in range(args.books)))
+    rng = random.Random(args.seed)
+    book_pks = list(Book.objects.values_list('pk', flat=True))
+    pks = [rng.choice(book_pks) for _ in range(args.requests)]
+
+    settings_dict = connection.settings_dict
+    stock = STOCK_ENGINES[connection.vendor]
+    connection.close()
+    print('%d requests to %s, pool of %d connections' % (
+        args.requests, connection.vendor, settings_dict['POOL']['MAX_SIZE']))
+    print('%-24s %9s %9s %9s %12s %12s' % (
+        'backend', 'req/sec', 'p50 (ms)', 'p95 (ms)', 'connect p50',
+        'connections'))
+    for name, engine, pooled, threads in (
+            ('stock', stock, False, 1),
+            ('pooled', settings_dict['ENGINE'], True, 1),
+            ('stock (%d threads)' % args.threads, stock, False, args.threads),
+            ('pooled (%d threads)' % args.threads, settings_dict['ENGINE'],
+             True, args.threads)):
+        timings, connecting, connections, elapsed = measure(
+            settings_dict, engine, pooled, pks, threads)
+        print('%-24s %9.0f %9.3f %9.3f %12.3f %12d' % (
+            name, len(pks) / elapsed, percentile(timings, 50),
+            percentile(timings, 95), percentile(connecting, 50),
+            connections))
+
+
+if __name__ == '__main__':
+    main()
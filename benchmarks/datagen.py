@@ -0,0 +1,173 @@
+"""
+Synthetic catalog generator for the benchmarks.
+
+    python -m benchmarks.datagen --authors 1000 --books 10000 --instances 100000
+
+Creates authors, genres, languages, books (with genres), copies and
+borrowers with bulk inserts, then rebuilds what bulk_create skipped: the
+catalog statistics, the search index and the per-book copy counters.
+The same seed always produces the same catalog.
+
+Every user's password is PASSWORD; the librarian is LIBRARIAN_USERNAME.
+"""
+import argparse
+import datetime
+import random
+
+from benchmarks import setup_django
+
+PASSWORD = 'benchmark'
+LIBRARIAN_USERNAME = 'librarian'
+BORROWER_PREFIX = 'reader'
+
+DEFAULT_SIZES = {
+    'authors': 500,
+    'books': 5000,
+    'genres': 20,
+    'instances': 50000,
+    'users': 500,
+}
+
+LANGUAGES = ('English', 'French', 'German', 'Spanish', 'Swahili')
+
+WORDS = (
+    'python', 'django', 'river', 'empire', 'garden', 'night', 'silver',
+    'history', 'science', 'stone', 'ocean', 'winter', 'machine', 'city',
+    'secret', 'journey', 'kingdom', 'forest', 'letters', 'theory', 'war',
+    'peace', 'data', 'language', 'music', 'island', 'dream', 'fire',
+)
+
+FIRST_NAMES = ('Ada', 'Chinua', 'Grace', 'Ngugi', 'Mary', 'Isaac', 'Jane',
+               'Leo', 'Wangari', 'Alan', 'Toni', 'Gabriel')
+
+# Share of copies in each status; loans are spread around today so about
+# half of them are overdue
+STATUSES = (('a', 0.55), ('o', 0.30), ('r', 0.10), ('d', 0.05))
+
+BATCH_SIZE = 10000
+
+
+def phrase(rng, words):
+    return ' '.join(rng.choice(WORDS) for _ in range(words)).capitalize()
+
+
+def pick_status(rng):
+    draw = rng.random()
+    for status, share in STATUSES:
+        if draw < share:
+            return status
+        draw -= share
+    return STATUSES[0][0]
+
+
+def insert(model, objects):
+    """
+    Bulk insert a (lazy) sequence of objects, BATCH_SIZE at a time.
+    """
+    batch = []
+    for obj in objects:
+        batch.append(obj)
+        if len(batch) >= BATCH_SIZE:
+            model.objects.bulk_create(batch)
+            batch = []
+    model.objects.bulk_create(batch)
+
+
+def generate_catalog(authors, books, genres, instances, users, seed=0):
+    """
+    Fill an empty database with a synthetic catalog of the given sizes.
+    """
+    from django.contrib.auth.hashers import make_password
+    from django.contrib.auth.models import Permission, User
+    from catalog.caching import bump_versions
+    from catalog.facets import rebuild_facets
+    from catalog.models import Author, Book, BookInstance, Genre, Language
+    from catalog.search import rebuild_search_index
+    from catalog.stats import rebuild_catalog_stats, reconcile_book_counters
+
+    rng = random.Random(seed)
+    today = datetime.date.today()
+
+    librarian = User.objects.create_user(LIBRARIAN_USERNAME,
+                                         'librarian@example.com', PASSWORD)
+    librarian.user_permissions.add(*Permission.objects.filter(
+        content_type__app_label='catalog',
+        codename__in=('can_mark_returned', 'change_bookinstance')))
+    # Hashing is deliberately slow: hash once and share it
+    password = make_password(PASSWORD)
+    insert(User, (User(username='%s%d' % (BORROWER_PREFIX, n),
+                       email='%s%d@example.com' % (BORROWER_PREFIX, n),
+                       password=password)
+                  for n in range(users)))
+    user_pks = list(User.objects.filter(
+        username__startswith=BORROWER_PREFIX).values_list('pk', flat=True))
+
+    insert(Genre, (Genre(name='%s %d' % (phrase(rng, 1), n))
+                   for n in range(genres)))
+    insert(Language, (Language(name=name) for name in LANGUAGES))
+    insert(Author, (Author(first_name=rng.choice(FIRST_NAMES),
+                           last_name='%s%d' % (phrase(rng, 1), n))
+                    for n in range(authors)))
+    genre_pks = list(Genre.objects.values_list('pk', flat=True))
+    language_pks = list(Language.objects.values_list('pk', flat=True))
+    author_pks = list(Author.objects.values_list('pk', flat=True))
+
+    insert(Book, (Book(title=phrase(rng, rng.randint(1, 5)),
+                       summary=phrase(rng, 30),
+                       isbn='%013d' % n,
+                       author_id=rng.choice(author_pks) if author_pks else None)
+                  for n in range(books)))
+    book_pks = list(Book.objects.values_list('pk', flat=True))
+    if genre_pks:
+        insert(Book.genre.through, (
+            Book.genre.through(book_id=book_pk, genre_id=genre_pk)
+            for book_pk in book_pks
+            for genre_pk in rng.sample(genre_pks,
+                                       min(len(genre_pks), rng.randint(1, 3)))))
+
+    def copy(n):
+        status = pick_status(rng)
+        if status == 'o' and not user_pks:
+            status = 'a'
+        on_loan = status == 'o'
+        return BookInstance(
+            book_id=rng.choice(book_pks),
+            language_id=rng.choice(language_pks),
+            imprint='Imprint %d' % (n % 100),
+            status=status,
+            borrower_id=rng.choice(user_pks) if on_loan else None,
+            due_back=(today + datetime.timedelta(days=rng.randint(-21, 21))
+                      if on_loan else None))
+
+    if book_pks:
+        insert(BookInstance, (copy(n) for n in range(instances)))
+
+    # bulk_create skipped the signal handlers
+    rebuild_catalog_stats()
+    rebuild_search_index()
+    reconcile_book_counters()
+    # Availability is read from the book counters
+    rebuild_facets()
+    bump_versions('catalog', 'genre', 'language')
+
+
+def add_size_arguments(parser):
+    for name, default in sorted(DEFAULT_SIZES.items()):
+        parser.add_argument('--' + name, type=int, default=default,
+                            help='Number of %s (default: %d)' % (name, default))
+    parser.add_argument('--seed', type=int, default=0,
+                        help='Random seed (default: 0)')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip())
+    add_size_arguments(parser)
+    args = parser.parse_args()
+    database_url = setup_django()
+    generate_catalog(args.authors, args.books, args.genres, args.instances,
+                     args.users, seed=args.seed)
+    print('Catalog generated in %s' % database_url)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,83 @@
+"""
+Response time of facet counts under filters.
+
+    python -m benchmarks.facets --books 1000000 --instances 2000000 \\
+        --queries 200
+
+Generates a catalog, then asks for the facet counts (see catalog.facets)
+of --queries random combinations of one to three filters on a genre,
+language, author and availability, with the counts cache disabled so
+combinations not answered by the stored counts group the index every
+time. Reports the latency percentiles per number of filters, and the
+median of the unfiltered counts.
+"""
+import argparse
+import os
+import random
+import time
+
+from benchmarks import percentile, setup_django, time_call
+from benchmarks.datagen import add_size_arguments, generate_catalog
+
+
+def facet_values():
+    from catalog.facets import AVAILABLE
+    from catalog.models import Author, Genre, Language
+
+    return {
+        'g': list(Genre.objects.values_list('pk', flat=True)),
+        'l': list(Language.objects.values_list('pk', flat=True)),
+        'a': list(Author.objects.values_list('pk', flat=True)),
+        'v': [AVAILABLE],
+    }
+
+
+def random_filters(rng, values, count):
+    facets = [facet for facet in sorted(values) if values[facet]]
+    return sorted((facet, rng.choice(values[facet]))
+                  for facet in rng.sample(facets, min(count, len(facets))))
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__.strip(),
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    add_size_arguments(parser)
+    parser.add_argument('--queries', type=int, default=200,
+                        help='Filter combinations per number of filters '
+                             '(default: 200)')
+    args = parser.parse_args()
+
+    # Measure the grouping, not the cache
+    os.environ.setdefault('DJANGO_CACHE_BACKEND',
+                          'django.core.cache.backends.dummy.DummyCache')
+    setup_django()
+    from catalog.facets import facet_counts
+
+    start = time.time()
+    generate_catalog(args.authors, args.books, args.genres, args.instances,
+                     args.users, seed=args.seed)
+    print('Generated and indexed the catalog in %.1fs' % (
+        time.time() - start))
+
+    print('%-10s %9s %9s %9s' % ('filters', 'p50 (ms)', 'p95 (ms)',
+                                 'p99 (ms)'))
+    unfiltered = time_call(lambda: facet_counts([]))
+    print('%-10s %9.2f' % ('none', unfiltered))
+    rng = random.Random(args.seed)
+    values = facet_values()
+    for count in (1, 2, 3):
+        timings = []
+        for _ in range(args.queries):
+            filters = random_filters(rng, values, count)
+            start = time.perf_counter()
+            facet_counts(filters)
+            timings.append((time.perf_counter() - start) * 1000)
+        timings.sort()
+        print('%-10d %9.2f %9.2f %9.2f' % (
+            count, percentile(timings, 50), percentile(timings, 95),
+            percentile(timings, 99)))
+
+
+if __name__ == '__main__':
+    main()
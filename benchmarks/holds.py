@@ -0,0 +1,100 @@
+"""
+Throughput of the hold allocator.
+
+    python -m benchmarks.holds --holds 1000000 --returns 100000
+
+Queues --holds holds from --users patrons on --books books (oldest first,
+spread at random over the books), makes --returns copies of those books
+available, and times allocate_holds() matching all of them to their
+queues in one pass. Then it times --single returns of copies on loan,
+each reserving the copy for the next hold in the same transaction as the
+return, as at the library desk.
+"""
+import argparse
+import datetime
+import random
+import time
+
+from benchmarks import percentile, setup_django
+from benchmarks.datagen import insert
+
+
+def fill(rng, books, users, holds, returns, single):
+    from django.contrib.auth.models import User
+    from django.utils import timezone
+    from catalog.models import Book, BookInstance, Hold
+    from catalog.stats import rebuild_catalog_stats, reconcile_book_counters
+
+    insert(Book, (Book(title='Book %d' % n, summary='Summary',
+                       isbn='%013d' % n) for n in range(books)))
+    insert(User, (User(username='patron%d' % n) for n in range(users)))
+    book_pks = list(Book.objects.values_list('pk', flat=True))
+    user_pks = list(User.objects.values_list('pk', flat=True))
+
+    start = timezone.now() - datetime.timedelta(seconds=holds)
+    insert(Hold, (Hold(book_id=rng.choice(book_pks),
+                       borrower_id=rng.choice(user_pks),
+                       placed=start + datetime.timedelta(seconds=n))
+                  for n in range(holds)))
+    insert(BookInstance, (BookInstance(book_id=rng.choice(book_pks),
+                                       imprint='Imprint', status='a')
+                          for _ in range(returns)))
+    insert(BookInstance, (BookInstance(
+        book_id=rng.choice(book_pks), imprint='Imprint', status='o',
+        borrower_id=rng.choice(user_pks),
+        due_back=datetime.date.today()) for _ in range(single)))
+    # bulk_create skips the signal handlers keeping these
+    reconcile_book_counters()
+    rebuild_catalog_stats()
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__.strip(),
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--books', type=int, default=10000,
+                        help='Books (default: 10000)')
+    parser.add_argument('--users', type=int, default=10000,
+                        help='Patrons placing holds (default: 10000)')
+    parser.add_argument('--holds', type=int, default=1000000,
+                        help='Holds queued (default: 1000000)')
+    parser.add_argument('--returns', type=int, default=100000,
+                        help='Copies allocated in one pass '
+                             '(default: 100000)')
+    parser.add_argument('--single', type=int, default=200,
+                        help='Copies returned one at a time (default: 200)')
+    parser.add_argument('--seed', type=int, default=0,
+                        help='Random seed (default: 0)')
+    args = parser.parse_args()
+
+    setup_django()
+    from catalog.loans import allocate_holds, return_copy
+    from catalog.models import BookInstance
+
+    rng = random.Random(args.seed)
+    start = time.time()
+    fill(rng, args.books, args.users, args.holds, args.returns, args.single)
+    print('Queued %d holds and returned %d copies in %.1fs' % (
+        args.holds, args.returns, time.time() - start))
+
+    start = time.perf_counter()
+    fulfilled = allocate_holds()
+    elapsed = time.perf_counter() - start
+    print('Batch: %d holds fulfilled in %.2fs (%.0f copies/sec)' % (
+        len(fulfilled), elapsed, args.returns / elapsed))
+
+    timings = []
+    for pk in BookInstance.objects.filter(status__exact='o').values_list(
+            'pk', flat=True):
+        start = time.perf_counter()
+        return_copy(pk)
+        timings.append((time.perf_counter() - start) * 1000)
+    timings.sort()
+    if timings:
+        print('Single returns: p50 %.2f ms, p95 %.2f ms, p99 %.2f ms' % (
+            percentile(timings, 50), percentile(timings, 95),
+            percentile(timings, 99)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,79 @@
+"""
+Home page latency with and without the materialized catalog statistics.
+
+    python -m benchmarks.index_stats --sizes 10000 100000 1000000
+
+For each catalog size it reports the median time of the six COUNT queries
+the index view used to run ("before"), of the single statistics read that
+replaced them ("after"), and of a full request to the index page.
+"""
+import argparse
+
+from benchmarks import setup_django, time_call
+
+BATCH_SIZE = 10000
+
+
+def grow_catalog(target):
+    """
+    Bulk insert book copies until there are target of them.
+    """
+    from catalog.models import Author, Book, BookInstance, Genre, Language
+    from catalog.search import rebuild_search_index
+
+    author, _ = Author.objects.get_or_create(first_name='Bench',
+                                             last_name='Author')
+    language, _ = Language.objects.get_or_create(name='English')
+    Genre.objects.get_or_create(name='Benchmarks')
+    books = list(Book.objects.all()[:100])
+    if not books:
+        Book.objects.bulk_create(
+            Book(title='Python volume %d' % n if n % 10 == 0 else
+                 'Volume %d' % n,
+                 summary='Summary', isbn='%013d' % n, author=author)
+            for n in range(100))
+        books = list(Book.objects.all())
+        # bulk_create skips the signal handlers indexing new books
+        rebuild_search_index()
+
+    existing = BookInstance.objects.count()
+    while existing < target:
+        batch = min(BATCH_SIZE, target - existing)
+        BookInstance.objects.bulk_create(
+            BookInstance(book=books[n % len(books)], language=language,
+                         imprint='Bench imprint', status='aor'[n % 3])
+            for n in range(existing, existing + batch))
+        existing += batch
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip())
+    parser.add_argument('--sizes', type=int, nargs='+',
+                        default=[10000, 100000, 1000000],
+                        help='Numbers of BookInstance rows to measure at')
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+
+    setup_django()
+    from django.test import Client
+    from django.test.utils import setup_test_environment
+    from catalog.stats import (count_catalog, get_catalog_stats,
+                               rebuild_catalog_stats)
+
+    setup_test_environment()
+    client = Client()
+
+    print('%12s %14s %14s %14s' % ('instances', 'before (ms)', 'after (ms)',
+                                   'index (ms)'))
+    for size in sorted(args.sizes):
+        grow_catalog(size)
+        # bulk_create skips the signal handlers, so recount once
+        rebuild_catalog_stats()
+        before = time_call(count_catalog, args.repeat)
+        after = time_call(get_catalog_stats, args.repeat)
+        page = time_call(lambda: client.get('/catalog/'), args.repeat)
+        print('%12d %14.3f %14.3f %14.3f' % (size, before, after, page))
+
+
+if __name__ == '__main__':
+    main()
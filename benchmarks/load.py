@@ -0,0 +1,257 @@
+"""
+Load test replaying the catalog's URL mix.
+
+    python -m benchmarks.load --instances 100000 --requests 5000 \\
+        --output results.json
+    python -m benchmarks.compare before.json results.json
+
+Generates a synthetic catalog (see benchmarks.datagen) unless the
+database already has books, then sends a weighted random mix of requests
+to the catalog pages through Django's test client: anonymous visitors on
+the public pages, borrowers on "My books" and a librarian on "All
+borrowed" and the renewal form. For each endpoint it reports the p50,
+p95 and p99 latency, the mean number of queries per request and the
+throughput, and it can save them as JSON for benchmarks.compare.
+
+Requests are sent one at a time in this process, so the throughput is
+that of a single worker; multiply by the number of workers for a rough
+site capacity, as long as the database is not the bottleneck.
+"""
+import argparse
+import datetime
+import json
+import platform
+import random
+import time
+
+from benchmarks import percentile, setup_django
+from benchmarks.datagen import (BORROWER_PREFIX, LIBRARIAN_USERNAME,
+                                add_size_arguments, generate_catalog)
+
+# Relative frequency of each endpoint in the mix
+MIX = (
+    ('index', 15),
+    ('book-list', 20),
+    ('book-detail', 25),
+    ('author-detail', 15),
+    ('my-borrowed', 10),
+    ('all-borrowed', 10),
+    ('renew', 5),
+)
+
+# Responses counted as successful
+OK_STATUSES = (200, 302, 304)
+
+
+class Scenario(object):
+    """
+    Builds the requests of the mix against the data in the database.
+    """
+
+    def __init__(self, rng, borrowers=20):
+        from django.contrib.auth.models import User
+        from django.test import Client
+        from catalog.models import Author, Book, BookInstance
+
+        self.rng = rng
+        self.book_pks = list(Book.objects.values_list('pk', flat=True))
+        self.author_pks = list(Author.objects.values_list('pk', flat=True))
+        self.loan_pks = list(BookInstance.objects.filter(
+            status__exact='o').values_list('pk', flat=True)[:1000])
+
+        self.anonymous = Client()
+        self.librarian = Client()
+        self.librarian.force_login(
+            User.objects.get(username=LIBRARIAN_USERNAME))
+        self.borrowers = []
+        for user in User.objects.filter(
+                username__startswith=BORROWER_PREFIX)[:borrowers]:
+            client = Client()
+            client.force_login(user)
+            self.borrowers.append(client)
+
+    def request(self, name):
+        """
+        Send one request for the named endpoint and return the response.
+        """
+        from django.core.urlresolvers import reverse
+
+        rng = self.rng
+        if name == 'index':
+            return self.anonymous.get(reverse('index'))
+        if name == 'book-list':
+            return self.anonymous.get(reverse('books'))
+        if name == 'book-detail':
+            return self.anonymous.get(
+                reverse('book-detail', args=[rng.choice(self.book_pks)]))
+        if name == 'author-detail':
+            return self.anonymous.get(
+                reverse('author-detail', args=[rng.choice(self.author_pks)]))
+        if name == 'my-borrowed':
+            return rng.choice(self.borrowers).get(reverse('my-borrowed'))
+        if name == 'all-borrowed':
+            return self.librarian.get(reverse('all-borrowed'))
+        if name == 'renew':
+            renewal_date = datetime.date.today() + datetime.timedelta(
+                days=rng.randint(1, 28))
+            return self.librarian.post(
+                reverse('renew-book-librarian',
+                        args=[rng.choice(self.loan_pks)]),
+                {'renewal_date': renewal_date.isoformat()})
+        raise ValueError('Unknown endpoint %r' % name)
+
+    def endpoints(self):
+        """
+        The endpoints of the mix there is data for.
+        """
+        missing = set()
+        if not self.book_pks:
+            missing.add('book-detail')
+        if not self.author_pks:
+            missing.add('author-detail')
+        if not self.borrowers:
+            missing.add('my-borrowed')
+        if not self.loan_pks:
+            missing.add('renew')
+        return [(name, weight) for name, weight in MIX
+                if name not in missing]
+
+
+def run(scenario, requests, warmup=0):
+    """
+    Send a random mix of requests and return the measurements per
+    endpoint: {name: {'timings': [ms], 'queries': [n], 'errors': n}}.
+    """
+    from django.db import connection
+    from django.test.utils import CaptureQueriesContext
+
+    endpoints = scenario.endpoints()
+    names = [name for name, weight in endpoints]
+    weights = [weight for name, weight in endpoints]
+    total = float(sum(weights))
+
+    def pick():
+        draw = scenario.rng.random() * total
+        for name, weight in zip(names, weights):
+            if draw < weight:
+                return name
+            draw -= weight
+        return names[-1]
+
+    for _ in range(warmup):
+        scenario.request(pick())
+
+    results = dict((name, {'timings': [], 'queries': [], 'errors': 0})
+                   for name in names)
+    for _ in range(requests):
+        name = pick()
+        with CaptureQueriesContext(connection) as queries:
+            start = time.perf_counter()
+            response = scenario.request(name)
+            elapsed = (time.perf_counter() - start) * 1000
+        result = results[name]
+        result['timings'].append(elapsed)
+        result['queries'].append(len(queries))
+        if response.status_code not in OK_STATUSES:
+            result['errors'] += 1
+    return results
+
+
+def summarize(results):
+    """
+    Reduce the raw measurements to the figures reported per endpoint.
+    """
+    summary = {}
+    for name, result in results.items():
+        timings = sorted(result['timings'])
+        if not timings:
+            continue
+        seconds = sum(timings) / 1000.0
+        summary[name] = {
+            'requests': len(timings),
+            'errors': result['errors'],
+            'p50_ms': percentile(timings, 50),
+            'p95_ms': percentile(timings, 95),
+            'p99_ms': percentile(timings, 99),
+            'queries': sum(result['queries']) / float(len(timings)),
+            'throughput_rps': len(timings) / seconds if seconds else None,
+        }
+    return summary
+
+
+def print_summary(summary):
+    print('%-14s %8s %7s %9s %9s %9s %8s %9s' % (
+        'endpoint', 'requests', 'errors', 'p50 (ms)', 'p95 (ms)', 'p99 (ms)',
+        'queries', 'req/sec'))
+    for name, weight in MIX:
+        if name in summary:
+            row = summary[name]
+            print('%-14s %8d %7d %9.2f %9.2f %9.2f %8.1f %9.1f' % (
+                name, row['requests'], row['errors'], row['p50_ms'],
+                row['p95_ms'], row['p99_ms'], row['queries'],
+                row['throughput_rps']))
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__.strip(),
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    add_size_arguments(parser)
+    parser.add_argument('--requests', type=int, default=2000,
+                        help='Requests measured (default: 2000)')
+    parser.add_argument('--warmup', type=int, default=200,
+                        help='Requests sent before measuring (default: 200)')
+    parser.add_argument('--output', help='Save the results to this JSON file')
+    args = parser.parse_args()
+
+    setup_django()
+    import django
+    from django.contrib.auth.models import User
+    from django.db import connection
+    from django.test.utils import setup_test_environment
+    from catalog.models import Author, Book, BookInstance, Genre
+
+    # Allows the test client's host name and keeps email in memory
+    setup_test_environment()
+    sizes = dict((name, getattr(args, name)) for name in
+                 ('authors', 'books', 'genres', 'instances', 'users'))
+    if not Book.objects.exists():
+        start = time.time()
+        generate_catalog(seed=args.seed, **sizes)
+        print('Generated the catalog in %.1fs' % (time.time() - start))
+
+    scenario = Scenario(random.Random(args.seed))
+    start = time.time()
+    results = run(scenario, args.requests, warmup=args.warmup)
+    elapsed = time.time() - start
+    summary = summarize(results)
+    print_summary(summary)
+    print('%d requests in %.1fs (%.1f req/sec)' % (
+        args.requests, elapsed, args.requests / elapsed))
+
+    if args.output:
+        with open(args.output, 'w') as handle:
+            json.dump({
+                'meta': {
+                    'date': datetime.datetime.now().isoformat(),
+                    # The catalog measured, which may predate this run
+                    'sizes': {
+                        'authors': Author.objects.count(),
+                        'books': Book.objects.count(),
+                        'genres': Genre.objects.count(),
+                        'instances': BookInstance.objects.count(),
+                        'users': User.objects.count(),
+                    },
+                    'seed': args.seed,
+                    'requests': args.requests,
+                    'database': connection.vendor,
+                    'python': platform.python_version(),
+                    'django': django.get_version(),
+                },
+                'endpoints': summary,
+            }, handle, indent=2, sort_keys=True)
+        print('Results saved to %s' % args.output)
+
+
+if __name__ == '__main__':
+    main()
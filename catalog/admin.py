@@ -1,13 +1,41 @@
-from django.contrib import admin
+import datetime
 
-from .models import Author, Book, BookInstance, Genre, Language
+from django.contrib import admin, messages
+from django.contrib.admin.views.main import ChangeList
+
+from .dimensions import DIMENSIONS, attach_genre_ids
+from .forms import DimensionChoiceField, DimensionMultipleChoiceField
+from .loans import (LOAN_PERIOD, LoanError, cancel_hold, renew_copies,
+                    return_copies)
+from .models import Author, Book, BookInstance, Genre, Hold, Language
+from .pagination import EstimatedCountPaginator
 
 # Register your models here.
 # Defining ModelAdmin class
 # This is to change how a model is displayed in the admin interface.
 
 
-class BookInline(admin.TabularInline):
+class DimensionFieldsMixin(object):
+    """
+    Genre and language fields choosing from the names cached by
+    catalog.dimensions, rather than querying them for every form (and
+    every inline form).
+    """
+
+    def formfield_for_foreignkey(self, db_field, request=None, **kwargs):
+        if db_field.remote_field.model in DIMENSIONS:
+            kwargs.setdefault('form_class', DimensionChoiceField)
+        return super(DimensionFieldsMixin, self).formfield_for_foreignkey(
+            db_field, request, **kwargs)
+
+    def formfield_for_manytomany(self, db_field, request=None, **kwargs):
+        if db_field.remote_field.model in DIMENSIONS:
+            kwargs.setdefault('form_class', DimensionMultipleChoiceField)
+        return super(DimensionFieldsMixin, self).formfield_for_manytomany(
+            db_field, request, **kwargs)
+
+
+class BookInline(DimensionFieldsMixin, admin.TabularInline):
     model = Book
 
 
@@ -20,7 +48,7 @@ class AuthorAdmin(admin.ModelAdmin):
     inlines = [BookInline]
 
 
-class BookInstanceInline(admin.TabularInline):
+class BookInstanceInline(DimensionFieldsMixin, admin.TabularInline):
     """
     Adding associated records at the same time
     i.e. have book information and information about specific copies
@@ -29,31 +57,123 @@ class BookInstanceInline(admin.TabularInline):
     model = BookInstance
 
 
+class BookChangeList(ChangeList):
+
+    def get_results(self, request):
+        super(BookChangeList, self).get_results(request)
+        # The genre names are cached; only the page's links are queried
+        attach_genre_ids(self.result_list)
+
+
 @admin.register(Book)
-class BookAdmin(admin.ModelAdmin):
+class BookAdmin(DimensionFieldsMixin, admin.ModelAdmin):
     """
     Getting the genere may not be a good idea
     because of the 'cost' of the database operation.
-    We will use a function in our (Book) model to get this
+    We will use a function in our (Book) model to get this,
+    from the genre ids of the whole page, loaded in one query, and the
+    cached genre names.
     """
-    list_display = ('title', 'author', 'display_genre')
+    list_display = ('title', 'author', 'display_genre', 'copies_available',
+                    'copies_total')
+    list_select_related = ('author',)
     inlines = [BookInstanceInline]
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+
+    def get_changelist(self, request, **kwargs):
+        return BookChangeList
 
 
 @admin.register(BookInstance)
 class BookInstanceAdmin(admin.ModelAdmin):
     list_display = ('book', 'status', 'borrower', 'due_back', 'id')
+    # Both filters are served by indexes (see BookInstance.Meta)
     list_filter = ('status', 'due_back')
+    list_select_related = ('book', 'borrower')
+    actions = ['renew_selected', 'return_selected']
+    # Millions of copies: do not count them all on every page
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
 
     fieldsets = (
         (None, {
             'fields': ('book', 'imprint', 'id')
         }),
         ('Availability', {
-            'fields': ('status', 'due_back', 'borrower')
+            'fields': ('status', 'due_back', 'borrower', 'fine')
         }),
     )
 
+    def renew_selected(self, request, queryset):
+        """
+        Renew the selected loans for the standard loan period,
+        all in one batched UPDATE.
+        """
+        due_back = datetime.date.today() + LOAN_PERIOD
+        try:
+            renewed, failed = renew_copies(
+                queryset.values_list('pk', flat=True), due_back)
+        except LoanError:
+            return self.report_changed(request)
+        self.report(request, 'renewed until %s' % due_back, renewed, failed)
+    renew_selected.short_description = 'Renew selected loans'
+
+    def return_selected(self, request, queryset):
+        """
+        Check the selected copies in, all in one batched UPDATE.
+        """
+        try:
+            returned, failed = return_copies(
+                queryset.values_list('pk', flat=True))
+        except LoanError:
+            return self.report_changed(request)
+        self.report(request, 'returned', returned, failed)
+    return_selected.short_description = 'Return selected copies'
+
+    def report_changed(self, request):
+        # As the bulk loans page does
+        self.message_user(
+            request, 'Some of the copies changed in the meantime, nothing '
+                     'was done. Please try again.', level=messages.ERROR)
+
+    def report(self, request, done_message, done, failed):
+        self.message_user(request, '%d copies %s.' % (len(done),
+                                                      done_message))
+        if failed:
+            self.message_user(
+                request, '%d copies were not on loan.' % len(failed),
+                level=messages.WARNING)
+
+
+@admin.register(Hold)
+class HoldAdmin(admin.ModelAdmin):
+    list_display = ('book', 'borrower', 'placed', 'status', 'copy')
+    list_filter = ('status',)
+    list_select_related = ('book', 'borrower')
+    raw_id_fields = ('book', 'borrower', 'copy')
+    actions = ['cancel_selected']
+
+    def cancel_selected(self, request, queryset):
+        """
+        Cancel the selected holds, passing any copy reserved for them on
+        to the next patron in the queue.
+        """
+        failed = 0
+        for pk in queryset.filter(status__in=('w', 'f')).values_list(
+                'pk', flat=True):
+            try:
+                cancel_hold(pk)
+            except LoanError:
+                # Cancelled or fulfilled in the meantime
+                failed += 1
+        self.message_user(request, 'Holds cancelled.')
+        if failed:
+            self.message_user(
+                request, '%d holds changed in the meantime and were not '
+                         'cancelled.' % failed, level=messages.ERROR)
+    cancel_selected.short_description = 'Cancel selected holds'
+
 
 # Register admin with the assosiated model
 admin.site.register(Author, AuthorAdmin)
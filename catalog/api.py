@@ -0,0 +1,369 @@
+"""
+A JSON API over the catalog, for the kiosks and the mobile app.
+
+    GET    api/<type>/       a page of objects
+    GET    api/<type>/<id>   one object
+    POST   api/<type>/       create an object
+    PUT    api/<type>/<id>   replace an object
+    PATCH  api/<type>/<id>   change some fields of an object
+    DELETE api/<type>/<id>   delete an object
+
+where <type> is books, authors, copies, genres or languages. Reads take:
+
+    fields=title,author        only these fields (the id always comes too)
+    include=author,genres      related objects, returned under "included"
+    fields[authors]=last_name  only these fields of included authors
+    cursor=...                 the page a "next" or "previous" link points to
+    page_size=100              objects per page, up to MAX_PAGE_SIZE
+
+Objects are serialized straight from .values() rows, without building
+model instances, and each many-to-many field or included relation costs
+one query however long the page is. Listings are paged with cursors (see
+catalog.pagination). Responses carry an ETag built from the catalog
+versions (see catalog.caching), so conditional GETs are answered with a
+304 without touching the database.
+
+Writes need the model's add, change or delete permission and go through
+a ModelForm and save(), so the signal handlers keep the derived data
+current. They are checked for CSRF like any other form.
+"""
+from collections import OrderedDict, defaultdict
+
+from django.core.exceptions import ValidationError
+from django.forms.models import model_to_dict, modelform_factory
+
+from .loans import chunked
+from .models import Author, Book, BookInstance, Genre, Language
+from .pagination import InvalidCursor, KeysetPaginator
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 500
+
+
+class ApiError(Exception):
+    """
+    A request the API cannot serve; status is the HTTP status to answer
+    with and errors what to tell the client.
+    """
+
+    def __init__(self, errors, status=400):
+        super(ApiError, self).__init__(errors)
+        self.errors = errors
+        self.status = status
+
+
+class Resource(object):
+    """
+    How a model is exposed by the API.
+
+    name -- the type name, in URLs and under "included"
+    fields -- the fields served, the primary key first
+    many -- many-to-many fields among them, served as lists of ids
+            {field: model field}
+    forward -- fields holding the ids of objects that can be included
+               {field: resource name}
+    reverse -- objects pointing at this one that can be included
+               {include name: (resource name, their field pointing here)}
+    writable -- the fields clients may set
+    ordering -- the unique order pages are cut in, ending with the key
+    versions -- the catalog versions the served fields depend on
+    """
+    model = None
+    name = None
+    fields = ()
+    many = {}
+    forward = {}
+    reverse = {}
+    writable = ()
+    ordering = ('id',)
+    versions = ()
+
+    def lookup(self, name):
+        """
+        The .values() lookup fetching a (non many-to-many) field.
+        """
+        return self.model._meta.get_field(name).attname
+
+    def includes(self):
+        return sorted(list(self.forward) + list(self.reverse))
+
+    def parse_fields(self, value):
+        if not value:
+            return list(self.fields)
+        names = [name for name in value.split(',') if name]
+        unknown = sorted(set(names) - set(self.fields))
+        if unknown:
+            raise ApiError({'fields': 'Unknown %s fields: %s.' % (
+                self.name, ', '.join(unknown))})
+        return [self.fields[0]] + [name for name in names
+                                   if name != self.fields[0]]
+
+    def values(self, queryset, names, extra=()):
+        """
+        queryset as .values() rows holding the named fields and the
+        extra model fields (the many-to-many ones come later, from
+        add_many()).
+        """
+        lookups = [self.lookup(name) for name in names
+                   if name not in self.many]
+        lookups.extend(self.lookup(name) for name in extra
+                       if self.lookup(name) not in lookups)
+        return queryset.values(*lookups)
+
+    def add_many(self, rows, names):
+        """
+        Set the ids of the named many-to-many fields on rows, with one
+        query (per 500 rows) per field.
+        """
+        for name in names:
+            if name not in self.many:
+                continue
+            field = self.model._meta.get_field(self.many[name])
+            source = '%s_id' % field.m2m_field_name()
+            target = '%s_id' % field.m2m_reverse_field_name()
+            links = field.remote_field.through.objects.order_by(target)
+            related = defaultdict(list)
+            for chunk in chunked(row['id'] for row in rows):
+                for pk, related_pk in links.filter(**{
+                        source + '__in': chunk}).values_list(source, target):
+                    related[pk].append(related_pk)
+            for row in rows:
+                row[name] = related[row['id']]
+
+    def serialize(self, row, names):
+        return OrderedDict(
+            (name, row[name if name in self.many else self.lookup(name)])
+            for name in names)
+
+    def form_class(self):
+        return modelform_factory(self.model, fields=[
+            self.many.get(name, name) for name in self.writable])
+
+
+class BookResource(Resource):
+    model = Book
+    name = 'books'
+    fields = ('id', 'title', 'summary', 'isbn', 'author',
+              'genres') + Book.COPY_COUNTERS
+    many = {'genres': 'genre'}
+    forward = {'author': 'authors', 'genres': 'genres'}
+    reverse = {'copies': ('copies', 'book')}
+    writable = ('title', 'summary', 'isbn', 'author', 'genres')
+    ordering = ('title', 'id')
+    # Deleting an author or genre unlinks their books without a signal
+    versions = ('book', 'author', 'genre')
+
+
+class AuthorResource(Resource):
+    model = Author
+    name = 'authors'
+    fields = ('id', 'first_name', 'last_name', 'date_of_birth',
+              'date_of_death')
+    reverse = {'books': ('books', 'author')}
+    writable = fields[1:]
+    ordering = ('last_name', 'first_name', 'id')
+    versions = ('author',)
+
+
+class CopyResource(Resource):
+    model = BookInstance
+    name = 'copies'
+    # Borrowers are not for everyone's eyes
+    fields = ('id', 'book', 'language', 'imprint', 'status', 'due_back')
+    forward = {'book': 'books', 'language': 'languages'}
+    writable = fields[1:]
+    versions = ('book', 'language')
+
+
+class GenreResource(Resource):
+    model = Genre
+    name = 'genres'
+    fields = ('id', 'name')
+    writable = ('name',)
+    ordering = ('name', 'id')
+    versions = ('genre',)
+
+
+class LanguageResource(Resource):
+    model = Language
+    name = 'languages'
+    fields = ('id', 'name')
+    writable = ('name',)
+    ordering = ('name', 'id')
+    versions = ('language',)
+
+
+RESOURCES = dict((resource.name, resource) for resource in (
+    BookResource(), AuthorResource(), CopyResource(), GenreResource(),
+    LanguageResource()))
+
+
+class Query(object):
+    """
+    A read of one resource: the fields and included objects asked for.
+    """
+
+    def __init__(self, resource, params):
+        self.resource = resource
+        self.names = resource.parse_fields(params.get('fields'))
+        self.include = [name for name in params.get('include', '').split(',')
+                        if name]
+        unknown = sorted(set(self.include) - set(resource.includes()))
+        if unknown:
+            raise ApiError({'include': 'Cannot include %s with %s.' % (
+                ', '.join(unknown), resource.name)})
+        self.included_names = {}
+        for name in self.include:
+            related = self.related(name)
+            self.included_names[related.name] = related.parse_fields(
+                params.get('fields[%s]' % related.name))
+
+    def related(self, include):
+        if include in self.resource.forward:
+            return RESOURCES[self.resource.forward[include]]
+        return RESOURCES[self.resource.reverse[include][0]]
+
+    def version_names(self):
+        names = set(self.resource.versions)
+        for name in self.include:
+            names.update(self.related(name).versions)
+        return sorted(names)
+
+    def values(self, queryset):
+        # The forward relations to include need their ids, and pages
+        # are cut on the ordering
+        extra = [name for name in self.include
+                 if name in self.resource.forward and
+                 name not in self.resource.many]
+        return self.resource.values(
+            queryset, self.names, extra + list(self.resource.ordering))
+
+    def serialize(self, rows):
+        """
+        Serialize rows (from values()) and the objects they include;
+        returns (objects, included objects by resource name).
+        """
+        resource = self.resource
+        resource.add_many(rows, set(self.names) | set(
+            name for name in self.include if name in resource.many))
+        included = OrderedDict()
+        for name in self.include:
+            related = self.related(name)
+            names = self.included_names[related.name]
+            if name in resource.forward:
+                key = (name if name in resource.many
+                       else resource.lookup(name))
+                ids = set()
+                for row in rows:
+                    value = row[key]
+                    ids.update(value if name in resource.many else [value])
+                ids.discard(None)
+                related_rows = self.fetch(related, names, 'pk', ids)
+            else:
+                field = resource.reverse[name][1]
+                related_rows = self.fetch(
+                    related, names, field, [row['id'] for row in rows],
+                    extra=[field])
+            objects = included.setdefault(related.name, OrderedDict())
+            for row in related_rows:
+                objects[row['id']] = related.serialize(row, names)
+        return ([resource.serialize(row, self.names) for row in rows],
+                OrderedDict((name, list(objects.values()))
+                            for name, objects in included.items()))
+
+    def fetch(self, resource, names, field, ids, extra=()):
+        rows = []
+        queryset = resource.model.objects.order_by(*resource.ordering)
+        for chunk in chunked(sorted(ids, key=str)):
+            rows.extend(resource.values(
+                queryset.filter(**{field + '__in': chunk}), names, extra))
+        resource.add_many(rows, names)
+        return rows
+
+
+def get_object_queryset(resource, pk):
+    try:
+        pk = resource.model._meta.pk.to_python(pk)
+    except ValidationError:
+        raise ApiError({'id': 'Not found.'}, status=404)
+    return resource.model.objects.filter(pk=pk)
+
+
+def read_list(query, params):
+    """
+    Serve a page of the query's resource; returns (objects, included,
+    next cursor, previous cursor).
+    """
+    resource = query.resource
+    try:
+        page_size = min(int(params.get('page_size', DEFAULT_PAGE_SIZE)),
+                        MAX_PAGE_SIZE)
+        if page_size < 1:
+            raise ValueError
+    except ValueError:
+        raise ApiError({'page_size': 'Enter a positive number.'})
+    paginator = KeysetPaginator(query.values(resource.model.objects.all()),
+                                page_size, resource.ordering)
+    try:
+        page = paginator.page(params.get('cursor'))
+    except InvalidCursor:
+        raise ApiError({'cursor': 'Invalid cursor.'})
+    objects, included = query.serialize(list(page.object_list))
+    return objects, included, page.next_cursor, page.previous_cursor
+
+
+def read_object(query, pk):
+    """
+    Serve one object; returns (object, included).
+    """
+    rows = list(query.values(get_object_queryset(query.resource, pk)))
+    if not rows:
+        raise ApiError({'id': 'Not found.'}, status=404)
+    objects, included = query.serialize(rows)
+    return objects[0], included
+
+
+def check_permission(user, resource, action):
+    opts = resource.model._meta
+    if not user.has_perm('%s.%s_%s' % (opts.app_label, action,
+                                       opts.model_name)):
+        raise ApiError({'permission': 'You cannot %s %s.' % (
+            action, resource.name)}, status=403)
+
+
+def write_object(resource, user, data, pk=None, partial=False):
+    """
+    Create (pk None) or change an object from the fields in data;
+    returns its primary key.
+    """
+    check_permission(user, resource, 'change' if pk else 'add')
+    if not isinstance(data, dict):
+        raise ApiError({'data': 'Send a JSON object.'})
+    unknown = sorted(set(data) - set(resource.writable))
+    if unknown:
+        raise ApiError({'fields': 'Cannot set %s.' % ', '.join(unknown)})
+
+    instance = None
+    if pk is not None:
+        instance = get_object_queryset(resource, pk).first()
+        if instance is None:
+            raise ApiError({'id': 'Not found.'}, status=404)
+    form_data = {}
+    if partial:
+        form_data.update(model_to_dict(instance, fields=[
+            resource.many.get(name, name) for name in resource.writable]))
+    for name, value in data.items():
+        form_data[resource.many.get(name, name)] = value
+    form = resource.form_class()(data=form_data, instance=instance)
+    if not form.is_valid():
+        raise ApiError(dict((name, [str(error) for error in errors])
+                            for name, errors in form.errors.items()))
+    return form.save().pk
+
+
+def delete_object(resource, user, pk):
+    check_permission(user, resource, 'delete')
+    instance = get_object_queryset(resource, pk).first()
+    if instance is None:
+        raise ApiError({'id': 'Not found.'}, status=404)
+    instance.delete()
@@ -5,3 +5,7 @@ from django.apps import AppConfig
 
 class CatalogConfig(AppConfig):
     name = 'catalog'
+
+    def ready(self):
+        # Connect the signal handlers maintaining derived catalog data
+        from . import signals  # noqa
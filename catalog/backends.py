@@ -0,0 +1,53 @@
+"""
+Authentication backend caching each user's permission set.
+
+ModelBackend loads a user's permissions (two queries) the first time a
+request checks one, which the sidebar does on every page. This backend
+keeps the set in the cache under the 'perms' and 'perms:<user pk>'
+versions, which catalog.signals bumps when a user, their groups or the
+groups' permissions change.
+
+A cache local to each process (LocMemCache) never sees the versions
+bumped by the other workers, so a revoked permission would live on in
+them; there the sets are only kept for LOCAL_PERMISSIONS_TIMEOUT seconds.
+"""
+from django.contrib.auth.backends import ModelBackend
+
+from .caching import PAGE_TIMEOUT, get_cache, get_versions, is_shared_cache
+
+# Seconds a permission set is kept by a cache local to the process
+LOCAL_PERMISSIONS_TIMEOUT = 5
+
+
+def permissions_timeout():
+    """
+    How long permission sets, and what is built from them, are cached.
+    """
+    return PAGE_TIMEOUT if is_shared_cache() else LOCAL_PERMISSIONS_TIMEOUT
+
+
+def permissions_key(user_obj):
+    names = ['perms', 'perms:%s' % user_obj.pk]
+    versions, last_modified = get_versions(names)
+    return 'catalog:perms:%s:%s' % (
+        user_obj.pk, ':'.join(str(versions[name]) for name in names))
+
+
+class CachedPermissionsBackend(ModelBackend):
+    """
+    ModelBackend reading the permission sets from the cache.
+    """
+
+    def get_all_permissions(self, user_obj, obj=None):
+        if not user_obj.is_active or user_obj.is_anonymous or obj is not None:
+            return set()
+        if not hasattr(user_obj, '_perm_cache'):
+            cache = get_cache()
+            key = permissions_key(user_obj)
+            perms = cache.get(key)
+            if perms is None:
+                perms = super(CachedPermissionsBackend,
+                              self).get_all_permissions(user_obj)
+                cache.set(key, perms, permissions_timeout())
+            user_obj._perm_cache = perms
+        return user_obj._perm_cache
@@ -0,0 +1,210 @@
+"""
+Response caching for catalog pages, with model-aware invalidation.
+
+Every cached page depends on a few version numbers kept in the cache:
+model-wide ones (e.g. 'author', bumped when any author changes) and
+per-object ones (e.g. 'book:3', bumped when book 3, its copies or its
+genres change). The versions are part of the page's cache key and ETag,
+so bumping one (see catalog.signals) invalidates exactly the pages built
+from it; stale entries are never read again and simply expire.
+
+Every page also depends on the 'catalog' version, which bulk operations
+changing too many objects to expire page by page bump instead.
+
+The versions must be shared by all worker processes, so use a shared
+cache backend (file based, memcached or Redis) when running several of
+them; the local-memory backend is only right for a single process.
+"""
+from functools import partial
+import hashlib
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.backends.locmem import LocMemCache
+from django.db import transaction
+from django.http import HttpResponse
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, quote_etag, urlencode
+
+from .instrumentation import record_cache
+from .routers import use_primary
+
+# How long a rendered page is kept (stale pages are never served, so
+# this only bounds memory use)
+PAGE_TIMEOUT = 60 * 60 * 24
+
+
+def get_cache():
+    return caches[getattr(settings, 'CATALOG_CACHE', 'default')]
+
+
+def is_shared_cache():
+    """
+    Whether the cache is shared by the worker processes, so a version
+    bumped by one is seen by all of them.
+    """
+    return not isinstance(get_cache(), LocMemCache)
+
+
+def version_key(name):
+    return 'catalog:version:%s' % name
+
+
+def modified_key(name):
+    return 'catalog:modified:%s' % name
+
+
+def new_version():
+    # Versions start from the current time in milliseconds, so a version
+    # recreated after being evicted cannot repeat an earlier one.
+    return int(time.time() * 1000)
+
+
+def bump_versions(*names):
+    """
+    Invalidate every page depending on the named versions.
+
+    Inside a transaction the versions are bumped at once, for the
+    transaction's own requests, and again once it commits: a page
+    rendered meanwhile from the rows before the commit would otherwise
+    be cached under the new versions and served until it expires.
+    """
+    _bump(names)
+    connection = transaction.get_connection()
+    if connection.in_atomic_block:
+        transaction.on_commit(partial(_bump, names))
+
+
+def _bump(names):
+    cache = get_cache()
+    for name in names:
+        try:
+            cache.incr(version_key(name))
+        except ValueError:
+            cache.add(version_key(name), new_version(), None)
+    now = time.time()
+    cache.set_many(dict((modified_key(name), now) for name in names), None)
+
+
+def get_versions(names):
+    """
+    Return the current versions of names (a dict) and the time the last
+    of them changed.
+    """
+    versions, modified = get_versions_modified(names)
+    return versions, max(modified.values()) if modified else 0
+
+
+def get_modified(names):
+    """
+    Return {name: the time it last changed} for names.
+    """
+    return get_versions_modified(names)[1]
+
+
+def get_versions_modified(names):
+    """
+    Return the current versions of names and the times they last changed
+    (two dicts). A version never used (or evicted) is created, and
+    counts as changed now.
+    """
+    cache = get_cache()
+    keys = [version_key(name) for name in names]
+    keys.extend(modified_key(name) for name in names)
+    values = cache.get_many(keys)
+
+    versions = {}
+    modified = {}
+    now = time.time()
+    for name in names:
+        version = values.get(version_key(name))
+        if version is None:
+            version = new_version()
+            if not cache.add(version_key(name), version, None):
+                version = cache.get(version_key(name), version)
+            cache.set(modified_key(name), now, None)
+        versions[name] = version
+        modified[name] = values.get(modified_key(name), now)
+    return versions, modified
+
+
+class CachedResponseMixin(object):
+    """
+    Mixin for catalog views serving their pages from the cache.
+
+    cache_models -- versions every page of the view depends on
+    get_cache_objects() -- per-object versions a given page depends on
+    cache_params -- the query parameters the view reads; the others do
+                    not change the page, so they do not make a new one
+
+    Only anonymous visitors are served from the cache, since the sidebar
+    shows the logged in user. They also get ETag and Last-Modified
+    headers, and conditional GETs are answered with a 304 when nothing
+    the page depends on has changed, without touching the database.
+    """
+    cache_models = ()
+    cache_params = ()
+
+    def get_cache_objects(self):
+        return []
+
+    def get_cache_names(self):
+        """
+        All the versions the page depends on.
+        """
+        return (['catalog'] + list(self.cache_models) +
+                list(self.get_cache_objects()))
+
+    def get_cache_path(self):
+        """
+        The path and the cache_params of the request, in a fixed order.
+        """
+        params = sorted(
+            (name, value) for name in set(self.cache_params)
+            for value in self.request.GET.getlist(name))
+        if not params:
+            return self.request.path
+        return '%s?%s' % (self.request.path, urlencode(params))
+
+    def dispatch(self, request, *args, **kwargs):
+        if (request.method not in ('GET', 'HEAD') or
+                request.user.is_authenticated):
+            return super(CachedResponseMixin, self).dispatch(
+                request, *args, **kwargs)
+
+        versions, last_modified = get_versions(self.get_cache_names())
+        etag = hashlib.md5(('%s|%s|%s' % (
+            type(self).__name__, self.get_cache_path(),
+            sorted(versions.items()),
+        )).encode('utf-8')).hexdigest()
+        last_modified = int(last_modified)
+
+        response = get_conditional_response(
+            request, etag=etag, last_modified=last_modified)
+        if response is None:
+            response = self.cached_response(etag, request, *args, **kwargs)
+        if response.status_code in (200, 304):
+            response['ETag'] = quote_etag(etag)
+            response['Last-Modified'] = http_date(last_modified)
+        return response
+
+    def cached_response(self, etag, request, *args, **kwargs):
+        cache = get_cache()
+        key = 'catalog:page:%s' % etag
+        cached = cache.get(key)
+        record_cache(cached is not None)
+        if cached is not None:
+            content, content_type = cached
+            return HttpResponse(content, content_type=content_type)
+
+        # Replicas may not have the change that bumped the version yet
+        with use_primary():
+            response = super(CachedResponseMixin, self).dispatch(
+                request, *args, **kwargs)
+            if hasattr(response, 'render'):
+                response.render()
+        if response.status_code == 200:
+            cache.set(key, (response.content, response['Content-Type']),
+                      PAGE_TIMEOUT)
+        return response
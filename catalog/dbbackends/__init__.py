@@ -0,0 +1,19 @@
+"""
+Database backends managing the site's connections.
+
+settings.py swaps the stock engines for these:
+
+    catalog.dbbackends.postgresql -- PostgreSQL, with a pool of connections
+                                     per worker process
+    catalog.dbbackends.sqlite3    -- SQLite tuned for a web site (WAL
+                                     journal, mmap, busy timeout), pooled
+                                     the same way
+
+Each is the stock Django backend with PooledDatabaseWrapperMixin (see
+catalog.dbbackends.pool): opening a connection borrows one from the
+pool, and closing it, as Django does at the end of each request, gives
+it back. So requests skip connecting (and, for PostgreSQL, the
+authentication round trips), while the threads of a gunicorn worker
+share at most POOL['MAX_SIZE'] connections between them instead of
+holding one each.
+"""
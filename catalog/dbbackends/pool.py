@@ -0,0 +1,316 @@
+"""
+A pool of database connections per worker process.
+
+A database configured with a POOL key, e.g.
+
+    'POOL': {
+        'MAX_SIZE': 4,       # connections open at once, per process
+        'TIMEOUT': 10,       # seconds to wait for one before failing
+        'CHECK_AFTER': 30,   # seconds idle after which one is checked
+        'MAX_AGE': 1800,     # seconds after which one is replaced
+    },
+
+keeps the raw connections its requests close, and hands them to the
+next requests of the same process (whatever their thread). A connection
+is rolled back when given back, checked with a trivial query when it
+sat idle for more than CHECK_AFTER seconds, and replaced when older than
+MAX_AGE or broken. Set CONN_MAX_AGE to 0 with a pool, so connections go
+back to the pool at the end of each request rather than staying with
+their thread.
+
+A forked process (e.g. by `prerender_catalog`) starts with no pools:
+the connections of its parent are not its to use.
+"""
+from collections import namedtuple
+import os
+import threading
+import time
+
+from django.db.backends.base.base import NO_DB_ALIAS
+from django.db.utils import OperationalError
+
+DEFAULT_POOL = {
+    'MAX_SIZE': 4,
+    'TIMEOUT': 10,
+    'CHECK_AFTER': 30,
+    'MAX_AGE': 1800,
+}
+
+# An idle connection, with when it was opened and last given back
+Idle = namedtuple('Idle', 'connection created released')
+
+# The pools of this process, by database alias and connection parameters
+_pools = {}
+_pools_lock = threading.Lock()
+_pools_pid = os.getpid()
+
+
+class PoolTimeout(OperationalError):
+    """
+    Every connection of the pool stayed in use for TIMEOUT seconds.
+    """
+
+
+class ConnectionPool(object):
+    """
+    The connections of one database, shared by the threads of a process.
+    """
+
+    def __init__(self, alias, max_size=DEFAULT_POOL['MAX_SIZE'],
+                 timeout=DEFAULT_POOL['TIMEOUT'],
+                 check_after=DEFAULT_POOL['CHECK_AFTER'],
+                 max_age=DEFAULT_POOL['MAX_AGE']):
+        self.alias = alias
+        self.max_size = max_size
+        self.timeout = timeout
+        self.check_after = check_after
+        self.max_age = max_age
+        self.condition = threading.Condition()
+        # Most recently given back last, so the busiest connections stay
+        # warm and the others age out
+        self.idle = []
+        # When each connection in use was opened, by id()
+        self.in_use = {}
+        # Connections being opened, counted against max_size
+        self.opening = 0
+        self.closed = False
+        # Counters, for the metrics (see catalog.instrumentation)
+        self.opened = 0
+        self.reused = 0
+        self.discarded = 0
+        self.failed_checks = 0
+        self.waits = 0
+        self.timeouts = 0
+        self.wait_time = 0.0
+
+    @property
+    def size(self):
+        return len(self.idle) + len(self.in_use) + self.opening
+
+    def acquire(self, connect, check):
+        """
+        Return an idle connection that passes check(connection) when it
+        needs checking, or a new one from connect(); waits for one to be
+        given back when the pool is full.
+        """
+        while True:
+            idle = self.take()
+            if idle is None:
+                return self.open(connect)
+            now = time.monotonic()
+            if now - idle.created > self.max_age:
+                self.discard(idle.connection)
+                continue
+            if now - idle.released > self.check_after and not check(
+                    idle.connection):
+                with self.condition:
+                    self.failed_checks += 1
+                self.discard(idle.connection)
+                continue
+            with self.condition:
+                self.in_use[id(idle.connection)] = idle.created
+                self.reused += 1
+            return idle.connection
+
+    def take(self):
+        """
+        Pop an idle connection, or return None after reserving room for
+        a new one.
+        """
+        with self.condition:
+            deadline = None
+            while not self.idle and self.size >= self.max_size:
+                now = time.monotonic()
+                if deadline is None:
+                    self.waits += 1
+                    start, deadline = now, now + self.timeout
+                elif now >= deadline:
+                    self.timeouts += 1
+                    self.wait_time += now - start
+                    raise PoolTimeout(
+                        'All %d connections to database "%s" stayed in use '
+                        'for %ss.' % (self.max_size, self.alias,
+                                      self.timeout))
+                self.condition.wait(deadline - now)
+            if deadline is not None:
+                self.wait_time += time.monotonic() - start
+            if self.idle:
+                return self.idle.pop()
+            self.opening += 1
+            return None
+
+    def open(self, connect):
+        try:
+            connection = connect()
+        except Exception:
+            with self.condition:
+                self.opening -= 1
+                self.condition.notify()
+            raise
+        with self.condition:
+            self.opening -= 1
+            self.in_use[id(connection)] = time.monotonic()
+            self.opened += 1
+        return connection
+
+    def release(self, connection, reset):
+        """
+        Give back a connection, unless reset(connection) finds it
+        unusable or it is too old.
+        """
+        with self.condition:
+            created = self.in_use.get(id(connection))
+        usable = False
+        if created is not None and not self.closed:
+            try:
+                usable = reset(connection)
+            except Exception:
+                usable = False
+        now = time.monotonic()
+        if usable and now - created <= self.max_age:
+            with self.condition:
+                del self.in_use[id(connection)]
+                self.idle.append(Idle(connection, created, now))
+                self.condition.notify()
+        else:
+            self.discard(connection)
+
+    def discard(self, connection):
+        with self.condition:
+            self.in_use.pop(id(connection), None)
+            self.discarded += 1
+            self.condition.notify()
+        try:
+            connection.close()
+        except Exception:
+            pass
+
+    def close(self):
+        """
+        Close the idle connections; those in use are closed when given
+        back.
+        """
+        with self.condition:
+            self.closed = True
+            idle, self.idle = self.idle, []
+        for entry in idle:
+            self.discard(entry.connection)
+
+    def stats(self):
+        with self.condition:
+            return {
+                'alias': self.alias,
+                'max_size': self.max_size,
+                'idle': len(self.idle),
+                'in_use': len(self.in_use),
+                'opened': self.opened,
+                'reused': self.reused,
+                'discarded': self.discarded,
+                'failed_checks': self.failed_checks,
+                'waits': self.waits,
+                'timeouts': self.timeouts,
+                'wait_time': self.wait_time,
+            }
+
+
+def get_pool(alias, conn_params, options):
+    """
+    The pool of this process for the database alias, connected with
+    conn_params (the test database, say, gets its own).
+    """
+    global _pools_pid
+    key = (alias, repr(sorted(conn_params.items())))
+    with _pools_lock:
+        if _pools_pid != os.getpid():
+            # Forked: leave the parent's connections alone
+            _pools.clear()
+            _pools_pid = os.getpid()
+        pool = _pools.get(key)
+        if pool is None:
+            settings = dict(DEFAULT_POOL, **options)
+            pool = _pools[key] = ConnectionPool(
+                alias, max_size=settings['MAX_SIZE'],
+                timeout=settings['TIMEOUT'],
+                check_after=settings['CHECK_AFTER'],
+                max_age=settings['MAX_AGE'])
+        return pool
+
+
+def close_pools(alias=None):
+    """
+    Close the pools of this process (of the database alias only, when
+    given), e.g. before forking or dropping a database.
+    """
+    with _pools_lock:
+        if _pools_pid != os.getpid():
+            _pools.clear()
+            return
+        keys = [key for key in _pools if alias is None or key[0] == alias]
+        pools = [_pools.pop(key) for key in keys]
+    for pool in pools:
+        pool.close()
+
+
+def pool_stats():
+    """
+    The counters of each pool of this process.
+    """
+    with _pools_lock:
+        pools = list(_pools.values()) if _pools_pid == os.getpid() else []
+    return [pool.stats() for pool in pools]
+
+
+class PooledDatabaseWrapperMixin(object):
+    """
+    DatabaseWrapper mixin borrowing connections from the pool of the
+    database's POOL settings (see the module docstring). Without POOL it
+    connects and closes as usual.
+
+    Backends implement check_connection(connection), a cheap query, and
+    reset_connection(connection), ending any transaction left open; both
+    return whether the connection is usable.
+    """
+    pool = None
+
+    def open_connection(self, conn_params):
+        """
+        Open a new connection; backends extend this to set it up.
+        """
+        return super(PooledDatabaseWrapperMixin, self).get_new_connection(
+            conn_params)
+
+    def get_pool_options(self):
+        """
+        The POOL settings, or None to connect without a pool.
+        """
+        # The connection the test runner opens to create and drop test
+        # databases must not linger
+        if self.alias == NO_DB_ALIAS:
+            return None
+        return self.settings_dict.get('POOL')
+
+    def get_new_connection(self, conn_params):
+        options = self.get_pool_options()
+        if options is None:
+            return self.open_connection(conn_params)
+        pool = get_pool(self.alias, conn_params, options)
+        connection = pool.acquire(lambda: self.open_connection(conn_params),
+                                  self.check_connection)
+        self.pool = pool
+        return connection
+
+    def _close(self):
+        pool, self.pool = self.pool, None
+        if pool is None or self.connection is None:
+            return super(PooledDatabaseWrapperMixin, self)._close()
+        if self.in_atomic_block:
+            # Django keeps using it until the block exits (and fails)
+            pool.discard(self.connection)
+        else:
+            pool.release(self.connection, self.reset_connection)
+
+    def check_connection(self, connection):
+        raise NotImplementedError
+
+    def reset_connection(self, connection):
+        raise NotImplementedError
@@ -0,0 +1,55 @@
+"""
+SQLite, tuned for serving the site and pooled (see catalog.dbbackends).
+"""
+from django.db.backends.sqlite3 import base
+
+from ..pool import PooledDatabaseWrapperMixin
+
+# Set on each new connection; a database's PRAGMAS setting overrides them
+DEFAULT_PRAGMAS = (
+    # Readers no longer wait for the writer, nor the writer for them
+    ('journal_mode', 'WAL'),
+    # In WAL mode this only syncs at checkpoints: a power cut may lose
+    # the last transactions, but cannot corrupt the database
+    ('synchronous', 'NORMAL'),
+    # Read the pages through a memory map instead of read() calls
+    ('mmap_size', 256 * 1024 * 1024),
+    # Wait up to 5s for the write lock rather than failing at once
+    ('busy_timeout', 5000),
+)
+
+
+class DatabaseWrapper(PooledDatabaseWrapperMixin, base.DatabaseWrapper):
+
+    def get_pragmas(self):
+        pragmas = dict(DEFAULT_PRAGMAS)
+        pragmas.update(self.settings_dict.get('PRAGMAS', {}))
+        # journal_mode first: the others may depend on it
+        return sorted(pragmas.items(), key=lambda item: (
+            item[0] != 'journal_mode', item[0]))
+
+    def get_pool_options(self):
+        # Django never really closes the connections to an in-memory
+        # database (e.g. the test database), so none would come back
+        if self.is_in_memory_db(self.settings_dict['NAME']):
+            return None
+        return super(DatabaseWrapper, self).get_pool_options()
+
+    def open_connection(self, conn_params):
+        connection = super(DatabaseWrapper, self).open_connection(
+            conn_params)
+        for name, value in self.get_pragmas():
+            connection.execute('PRAGMA %s = %s' % (name, value))
+        return connection
+
+    def check_connection(self, connection):
+        try:
+            connection.execute('SELECT 1')
+        except base.Database.Error:
+            return False
+        return True
+
+    def reset_connection(self, connection):
+        if connection.in_transaction:
+            connection.rollback()
+        return True
@@ -0,0 +1,176 @@
+"""
+Process-local copies of the small, nearly static catalog tables.
+
+Genres and languages are a few dozen rows that hardly ever change, yet
+every copy on a book page, every genre list and every book form used to
+query or join them. Each worker process instead loads a table once, as
+an id -> name snapshot, and serves the names from memory:
+
+    from catalog.dimensions import genres, languages
+    languages.name(copy.language_id)
+    genres.choices()
+
+A snapshot is stamped with the table's version from the page cache (see
+catalog.caching), which the signal handlers bump on every save and
+delete. A process checks that version once per request (and on every
+lookup outside requests), so a change made by another worker is seen
+from that worker's next request on; the process making the change drops
+its snapshot at once.
+
+A snapshot is two flat sequences, the sorted ids in an array and the
+names in a tuple, replaced as a whole: lookups need no lock, and it
+costs a few bytes per row rather than a model instance each.
+"""
+from array import array
+from bisect import bisect_left
+import threading
+import time
+
+from django.db import DEFAULT_DB_ALIAS
+
+from .caching import get_versions
+from .models import Book, Genre, Language
+from .routers import use_primary
+
+# Seconds after which a snapshot is reloaded whatever its version
+MAX_AGE = 300
+
+# The dimensions checked against their version in the current request,
+# or None outside requests
+_local = threading.local()
+
+
+def start_request():
+    _local.checked = set()
+
+
+def end_request():
+    _local.checked = None
+
+
+class Snapshot(object):
+    """
+    The id -> name rows of a table, as of one version.
+    """
+    __slots__ = ('version', 'loaded', 'ids', 'names')
+
+    def __init__(self, version, rows):
+        self.version = version
+        self.loaded = time.monotonic()
+        self.ids = array('q', (pk for pk, name in rows))
+        self.names = tuple(name for pk, name in rows)
+
+    def get(self, pk):
+        index = bisect_left(self.ids, pk)
+        if index < len(self.ids) and self.ids[index] == pk:
+            return self.names[index]
+        return None
+
+
+class Dimension(object):
+    """
+    The cached names of a model with a `name` field, invalidated through
+    the version `version_name`.
+    """
+
+    def __init__(self, model, version_name):
+        self.model = model
+        self.version_name = version_name
+        self.snapshot = None
+
+    def current(self):
+        snapshot = self.snapshot
+        checked = getattr(_local, 'checked', None)
+        if snapshot is not None and checked is not None and (
+                self.version_name in checked):
+            return snapshot
+        version = get_versions([self.version_name])[0][self.version_name]
+        if (snapshot is None or snapshot.version != version or
+                time.monotonic() - snapshot.loaded > MAX_AGE):
+            snapshot = self.load(version)
+        if checked is not None:
+            checked.add(self.version_name)
+        return snapshot
+
+    def load(self, version):
+        # The version was read first: rows changing meanwhile bump it
+        # again, so a snapshot is never newer than its stamp says. Read
+        # from the primary, as a replica may lag behind the version.
+        with use_primary():
+            rows = list(self.model.objects.order_by('pk').values_list(
+                'pk', 'name'))
+        self.snapshot = snapshot = Snapshot(version, rows)
+        return snapshot
+
+    def clear(self):
+        self.snapshot = None
+
+    def name(self, pk):
+        """
+        The name of the row pk, or None if there is no such row.
+        """
+        if pk is None:
+            return None
+        snapshot = self.current()
+        name = snapshot.get(pk)
+        if name is None:
+            # Maybe added since, by another process within this request
+            name = self.load(snapshot.version).get(pk)
+        return name
+
+    def names(self, pks):
+        """
+        {pk: name} for the rows among pks.
+        """
+        pks = list(pks)
+        snapshot = self.current()
+        names = dict((pk, snapshot.get(pk)) for pk in pks)
+        if None in names.values():
+            # Maybe added since, as in name()
+            snapshot = self.load(snapshot.version)
+            names = dict((pk, snapshot.get(pk)) for pk in pks)
+        return dict((pk, name) for pk, name in names.items()
+                    if name is not None)
+
+    def choices(self):
+        """
+        (pk, name) of every row, in pk order.
+
+        With no id to miss, rows added by a write that did not bump the
+        version show once the snapshot is MAX_AGE seconds old.
+        """
+        snapshot = self.current()
+        return list(zip(snapshot.ids, snapshot.names))
+
+    def instance(self, pk):
+        """
+        A model instance for the row pk, built without a query, or None
+        if there is no such row.
+        """
+        name = self.name(pk)
+        if name is None:
+            return None
+        instance = self.model(pk=pk, name=name)
+        instance._state.adding = False
+        instance._state.db = DEFAULT_DB_ALIAS
+        return instance
+
+
+genres = Dimension(Genre, 'genre')
+languages = Dimension(Language, 'language')
+
+DIMENSIONS = {Genre: genres, Language: languages}
+
+
+def attach_genre_ids(books):
+    """
+    Load the genre ids of books in one query, for Book.genre_names().
+    """
+    books = [book for book in books
+             if 'genre' not in getattr(book, '_prefetched_objects_cache', {})]
+    genre_ids = dict((book.pk, []) for book in books)
+    for book_id, genre_id in Book.genre.through.objects.filter(
+            book_id__in=list(genre_ids)).values_list('book_id', 'genre_id'):
+        genre_ids[book_id].append(genre_id)
+    for book in books:
+        book._genre_ids = sorted(genre_ids[book.pk])
@@ -0,0 +1,90 @@
+"""
+Streaming export of every book copy with its book, author, language,
+borrower and due date, as CSV or JSON Lines.
+
+Rows are read in chunks ordered by primary key, each chunk starting after
+the last key of the previous one, so memory use stays flat however many
+copies there are and the first rows are sent before the whole table has
+been read. (Django 1.10's .iterator() still fetches the whole result into
+memory on PostgreSQL, as it does not use server-side cursors.)
+"""
+import csv
+import json
+
+from .models import BookInstance
+
+FORMATS = ('csv', 'jsonl')
+
+CONTENT_TYPES = {
+    'csv': 'text/csv',
+    'jsonl': 'application/x-ndjson',
+}
+
+DEFAULT_CHUNK_SIZE = 2000
+
+COLUMNS = ('id', 'title', 'author', 'language', 'imprint', 'status',
+           'borrower', 'due_back')
+
+# Values fetched for each copy; the related names come from joins in the
+# same query.
+FIELDS = ('id', 'book__title', 'book__author__first_name',
+          'book__author__last_name', 'language__name', 'imprint', 'status',
+          'borrower__username', 'due_back')
+
+
+def export_rows(chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    Yield a dict per book copy, in primary key order.
+    """
+    queryset = BookInstance.objects.order_by('pk').values_list(*FIELDS)
+    last_pk = None
+    while True:
+        chunk = queryset
+        if last_pk is not None:
+            chunk = chunk.filter(pk__gt=last_pk)
+        chunk = list(chunk[:chunk_size])
+        if not chunk:
+            return
+        for (pk, title, first_name, last_name, language, imprint, status,
+             borrower, due_back) in chunk:
+            author = None
+            if first_name is not None:
+                author = '%s, %s' % (last_name, first_name)
+            yield {
+                'id': str(pk),
+                'title': title,
+                'author': author,
+                'language': language,
+                'imprint': imprint,
+                'status': status,
+                'borrower': borrower,
+                'due_back': due_back.isoformat() if due_back else None,
+            }
+        last_pk = chunk[-1][0]
+
+
+class Echo(object):
+    """
+    File-like object handing back what is written to it, so csv.writer
+    can produce lines for a generator.
+    """
+
+    def write(self, value):
+        return value
+
+
+def export_lines(file_format, chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    Yield the export as lines of text in the given format.
+    """
+    rows = export_rows(chunk_size)
+    if file_format == 'csv':
+        writer = csv.writer(Echo())
+        yield writer.writerow(COLUMNS)
+        for row in rows:
+            yield writer.writerow(
+                ['' if row[column] is None else row[column]
+                 for column in COLUMNS])
+    else:
+        for row in rows:
+            yield json.dumps(row) + '\n'
@@ -0,0 +1,452 @@
+"""
+Faceted browsing of the catalog.
+
+Books are indexed into the BookFacet table: one row per book and value of
+each facet it has (its genres, the languages of its copies, its author,
+and whether a copy is available). Filtering on a facet value looks up
+one range of the (facet, value, book) index, and filters combine by
+intersecting those ranges, so no request groups Book.genre or the copies
+of every book.
+
+The number of books having each value is kept in the FacetCount table,
+and the number having both a genre, language or availability value and
+any other value in the FacetPairCount table. Both are adjusted by the
+same code that updates the index, so the browse page reads its counts
+instead of counting, unfiltered or filtered on one of those values.
+Counts under other filters (an author, or several values) group the
+index entries of the books matching them once, and are then cached
+until the index changes again (the 'facets' version, see
+catalog.caching).
+
+The index is kept current by the signal handlers in catalog.signals and
+by the loan operations in catalog.loans; `manage.py rebuild_facets`
+rebuilds it, e.g. once after migrating an existing catalog.
+"""
+from collections import Counter, OrderedDict, defaultdict
+import hashlib
+
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F, Q
+from django.utils.http import urlencode
+
+from .caching import bump_versions, get_cache, get_versions
+from .dimensions import genres, languages
+from .models import (Author, Book, BookFacet, BookInstance, FacetCount,
+                     FacetPairCount)
+
+# The facets in the order they are shown, with their query parameter
+FACETS = OrderedDict((
+    ('g', 'genre'),
+    ('l', 'language'),
+    ('a', 'author'),
+    ('v', 'available'),
+))
+ALL_FACETS = ''.join(FACETS)
+
+# Facets with few values, whose pairs with every other value are counted
+PAIRED_FACETS = 'glv'
+
+# Value of the availability facet for books with a copy available
+AVAILABLE = 1
+
+# Authors offered as filters, those with the most books first
+TOP_AUTHORS = 10
+
+# How long counts under filters are kept (stale counts are never read,
+# so this only bounds memory use)
+COUNTS_TIMEOUT = 60 * 60 * 24
+
+# Keys per IN (...) lookup, below SQLite's limit on query parameters
+LOOKUP_CHUNK_SIZE = 500
+
+# Largest value a filter may have, that of a primary key (beyond it
+# databases reject the parameter rather than match nothing)
+MAX_VALUE = 2 ** 31 - 1
+
+# Number of books indexed per transaction when rebuilding
+BATCH_SIZE = 500
+
+
+def chunked(items, size=LOOKUP_CHUNK_SIZE):
+    items = list(items)
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+def book_facets(book_pks, facets=ALL_FACETS):
+    """
+    The values of the given facets the books have now, as a set of
+    (facet, value, book id).
+    """
+    rows = set()
+    for chunk in chunked(book_pks):
+        if 'g' in facets:
+            rows.update(
+                ('g', genre_id, book_id) for book_id, genre_id in
+                Book.genre.through.objects.filter(
+                    book_id__in=chunk).values_list('book_id', 'genre_id'))
+        if 'l' in facets:
+            rows.update(
+                ('l', language_id, book_id) for book_id, language_id in
+                BookInstance.objects.filter(book_id__in=chunk).exclude(
+                    language=None).order_by().values_list(
+                    'book_id', 'language_id').distinct())
+        if 'a' in facets or 'v' in facets:
+            for pk, author_id, available in Book.objects.filter(
+                    pk__in=chunk).values_list('pk', 'author_id',
+                                              'copies_available'):
+                if 'a' in facets and author_id is not None:
+                    rows.add(('a', author_id, pk))
+                if 'v' in facets and available:
+                    rows.add(('v', AVAILABLE, pk))
+    return rows
+
+
+def value_pairs(values):
+    """
+    The stored pairs among a book's (facet, value)s, as (facet, value,
+    other facet, other value).
+    """
+    return set((facet, value) + other for facet, value in values
+               if facet in PAIRED_FACETS
+               for other in values if other != (facet, value))
+
+
+def update_index(book_pks, facets=ALL_FACETS, wanted=None):
+    """
+    Bring the index entries of the books for the given facets up to
+    date (to the (facet, value, book id) set wanted, if given), without
+    touching the counts. Returns the change in the number of books
+    having each (facet, value) and each pair of them; both are empty if
+    nothing changed.
+    """
+    book_pks = set(book_pks)
+    book_pks.discard(None)
+    if wanted is None:
+        wanted = book_facets(book_pks, facets)
+    after = defaultdict(set)
+    for facet, value, book_id in wanted:
+        after[book_id].add((facet, value))
+    # The pairs depend on all of a book's values, not only those updated
+    before = defaultdict(dict)
+    for chunk in chunked(book_pks):
+        for pk, facet, value, book_id in BookFacet.objects.filter(
+                book_id__in=chunk).values_list(
+                'pk', 'facet', 'value', 'book_id'):
+            before[book_id][facet, value] = pk
+
+    counts = Counter()
+    pairs = Counter()
+    stale = []
+    new = []
+    for book_id in book_pks:
+        old = before[book_id]
+        values = after[book_id].union(key for key in old
+                                      if key[0] not in facets)
+        if values == set(old):
+            continue
+        for key, pk in old.items():
+            if key not in values:
+                stale.append(pk)
+                counts[key] -= 1
+        for facet, value in values.difference(old):
+            new.append(BookFacet(facet=facet, value=value, book_id=book_id))
+            counts[facet, value] += 1
+        old_pairs = value_pairs(old)
+        new_pairs = value_pairs(values)
+        for pair in old_pairs.difference(new_pairs):
+            pairs[pair] -= 1
+        for pair in new_pairs.difference(old_pairs):
+            pairs[pair] += 1
+
+    for chunk in chunked(stale):
+        BookFacet.objects.filter(pk__in=chunk).delete()
+    BookFacet.objects.bulk_create(new)
+    return counts, pairs
+
+
+def key_conditions(fields, keys, size=LOOKUP_CHUNK_SIZE):
+    """
+    Q objects matching the rows whose fields have the values of one of
+    keys, each with about size parameters at most.
+    """
+    groups = defaultdict(list)
+    for key in keys:
+        groups[key[:-1]].append(key[-1])
+    condition = None
+    used = 0
+    for prefix in sorted(groups):
+        for chunk in chunked(sorted(groups[prefix]), size):
+            if condition is not None and (
+                    used + len(prefix) + len(chunk) > size):
+                yield condition
+                condition = None
+                used = 0
+            lookups = dict(zip(fields[:-1], prefix))
+            lookups[fields[-1] + '__in'] = chunk
+            condition = (Q(**lookups) if condition is None
+                         else condition | Q(**lookups))
+            used += len(prefix) + len(chunk)
+    if condition is not None:
+        yield condition
+
+
+def adjust_counts(model, deltas):
+    """
+    Add {key: delta} to the counts stored in model (FacetCount or
+    FacetPairCount, whose key is their unique_together fields), creating
+    missing ones, with one UPDATE per delta (per chunk of keys).
+    """
+    fields = model._meta.unique_together[0]
+    deltas = dict((key, delta) for key, delta in deltas.items() if delta)
+    existing = set()
+    for condition in key_conditions(fields, deltas):
+        existing.update(model.objects.filter(condition).values_list(*fields))
+
+    missing = [(key, delta) for key, delta in sorted(deltas.items())
+               if key not in existing]
+    if missing:
+        try:
+            with transaction.atomic():
+                model.objects.bulk_create(
+                    model(count=delta, **dict(zip(fields, key)))
+                    for key, delta in missing)
+        except IntegrityError:
+            # Another transaction created some of them since they were
+            # read: create the others one by one and add to those
+            for key, delta in missing:
+                try:
+                    with transaction.atomic():
+                        model.objects.create(count=delta,
+                                             **dict(zip(fields, key)))
+                except IntegrityError:
+                    existing.add(key)
+    # Most deltas are +1 or -1, so few UPDATEs cover many keys
+    keys = defaultdict(list)
+    for key, delta in deltas.items():
+        if key in existing:
+            keys[delta].append(key)
+    for delta in sorted(keys):
+        for condition in key_conditions(fields, keys[delta]):
+            model.objects.filter(condition).update(count=F('count') + delta)
+
+
+def index_books(book_pks, facets=ALL_FACETS, wanted=None):
+    """
+    (Re)index the given facets of the books and adjust the counts.
+    """
+    book_pks = set(book_pks)
+    book_pks.discard(None)
+    if not book_pks:
+        return
+    with transaction.atomic():
+        counts, pairs = update_index(book_pks, facets, wanted)
+        adjust_counts(FacetCount, counts)
+        adjust_counts(FacetPairCount, pairs)
+    if counts:
+        bump_versions('facets')
+
+
+def remove_books(book_pks):
+    """
+    Drop the books from the index, e.g. before they are deleted.
+    """
+    index_books(book_pks, wanted=set())
+
+
+def recount_facets():
+    """
+    Count the books having each facet value, and each pair of them,
+    from the index and overwrite the stored counts.
+    """
+    counts = BookFacet.objects.values('facet', 'value').annotate(
+        count=Count('book')).order_by()
+    # Each entry joined to the other entries of its book
+    pairs = BookFacet.objects.filter(
+        facet__in=list(PAIRED_FACETS)).values(
+        'facet', 'value', 'book__bookfacet__facet',
+        'book__bookfacet__value').annotate(count=Count('book')).order_by()
+    with transaction.atomic():
+        FacetCount.objects.all().delete()
+        FacetCount.objects.bulk_create(FacetCount(**row)
+                                       for row in counts.iterator())
+        FacetPairCount.objects.all().delete()
+        FacetPairCount.objects.bulk_create(
+            FacetPairCount(facet=row['facet'], value=row['value'],
+                           other_facet=row['book__bookfacet__facet'],
+                           other_value=row['book__bookfacet__value'],
+                           count=row['count'])
+            for row in pairs.iterator()
+            if (row['facet'], row['value']) != (
+                row['book__bookfacet__facet'], row['book__bookfacet__value']))
+    bump_versions('facets')
+
+
+def rebuild_facets(batch_size=BATCH_SIZE):
+    """
+    Index every book from scratch, then count the index once rather
+    than adjusting the counts batch by batch. Returns the number of
+    books indexed.
+    """
+    BookFacet.objects.all().delete()
+    indexed = 0
+    last_pk = 0
+    while True:
+        pks = list(Book.objects.filter(pk__gt=last_pk).order_by(
+            'pk').values_list('pk', flat=True)[:batch_size])
+        if not pks:
+            break
+        with transaction.atomic():
+            update_index(pks)
+        indexed += len(pks)
+        last_pk = pks[-1]
+    recount_facets()
+    return indexed
+
+
+def parse_filters(params):
+    """
+    The facet values to filter on, from a request's GET parameters, as
+    a sorted list of (facet, value). Values that cannot be ids are
+    ignored.
+    """
+    filters = set()
+    for facet, param in FACETS.items():
+        for value in params.getlist(param):
+            try:
+                value = int(value)
+            except ValueError:
+                continue
+            if 0 < value <= MAX_VALUE:
+                filters.add((facet, value))
+    return sorted(filters)
+
+
+def filter_query(filters):
+    """
+    The query string selecting filters.
+    """
+    return urlencode([(FACETS[facet], value)
+                      for facet, value in sorted(filters)])
+
+
+def filter_books(queryset, filters, field='pk'):
+    """
+    Narrow a queryset down to the books having every filtered value;
+    field is the one holding the book id.
+    """
+    for facet, value in filters:
+        queryset = queryset.filter(**{
+            field + '__in': BookFacet.objects.filter(
+                facet=facet, value=value).values('book_id')})
+    return queryset
+
+
+def group_counts(rows):
+    """
+    {facet: {value: count}} from (facet, value, count) rows, with the
+    largest counts first and only the top authors.
+    """
+    counts = OrderedDict((facet, OrderedDict()) for facet in FACETS)
+    for facet, value, count in sorted(
+            rows, key=lambda row: (-row[2], row[1])):
+        if count > 0 and (facet != 'a' or len(counts[facet]) < TOP_AUTHORS):
+            counts[facet][value] = count
+    return counts
+
+
+def stored_counts(counts, facet_field, value_field):
+    """
+    (facet, value, count) rows of a count queryset, with only the top
+    authors.
+    """
+    counts = counts.filter(count__gt=0)
+    rows = list(counts.exclude(**{facet_field: 'a'}).values_list(
+        facet_field, value_field, 'count'))
+    rows.extend(counts.filter(**{facet_field: 'a'}).order_by(
+        '-count', value_field).values_list(
+        facet_field, value_field, 'count')[:TOP_AUTHORS])
+    return rows
+
+
+def facet_counts(filters):
+    """
+    The number of books having each facet value among the books matching
+    filters (all of them if there are none); see group_counts().
+    """
+    if not filters:
+        return group_counts(stored_counts(
+            FacetCount.objects.all(), 'facet', 'value'))
+    if len(filters) == 1 and filters[0][0] in PAIRED_FACETS:
+        facet, value = filters[0]
+        rows = stored_counts(FacetCount.objects.filter(
+            facet=facet, value=value), 'facet', 'value')
+        rows.extend(stored_counts(FacetPairCount.objects.filter(
+            facet=facet, value=value), 'other_facet', 'other_value'))
+        return group_counts(rows)
+
+    # Other combinations match fewer books: group their index entries
+    # once per version of the index
+    versions = get_versions(['catalog', 'facets'])[0]
+    key = 'catalog:facets:%s' % hashlib.md5(('%s|%s' % (
+        sorted(versions.items()), filters)).encode('utf-8')).hexdigest()
+    cache = get_cache()
+    counts = cache.get(key)
+    if counts is None:
+        rows = filter_books(BookFacet.objects.all(), filters,
+                            'book_id').values('facet', 'value').annotate(
+            count=Count('book')).order_by()
+        counts = group_counts((row['facet'], row['value'], row['count'])
+                              for row in rows)
+        cache.set(key, counts, COUNTS_TIMEOUT)
+    return counts
+
+
+def value_names(counts, filters):
+    """
+    {facet: {value: name}} for the values counted or filtered on.
+    """
+    values = defaultdict(set)
+    for facet, by_value in counts.items():
+        values[facet].update(by_value)
+    for facet, value in filters:
+        values[facet].add(value)
+    return {
+        'g': genres.names(values['g']),
+        'l': languages.names(values['l']),
+        'a': dict((author.pk, str(author)) for author in Author.objects.filter(
+            pk__in=values['a']).only('first_name', 'last_name')),
+        'v': {AVAILABLE: 'Available now'},
+    }
+
+
+def facet_choices(filters):
+    """
+    The filters to offer on the browse page: per facet, its name and
+    values, each with its name, count, whether it is selected and the
+    query string toggling it.
+    """
+    counts = facet_counts(filters)
+    names = value_names(counts, filters)
+    selected = set(filters)
+    choices = []
+    for facet, param in FACETS.items():
+        values = list(counts[facet].items())
+        # A selected value matching no book can still be deselected
+        values.extend((value, 0) for f, value in filters
+                      if f == facet and value not in counts[facet])
+        facet_values = []
+        for value, count in values:
+            if value not in names[facet]:
+                continue
+            toggled = selected.symmetric_difference([(facet, value)])
+            facet_values.append({
+                'value': value,
+                'name': names[facet][value],
+                'count': count,
+                'selected': (facet, value) in selected,
+                'query': filter_query(toggled),
+            })
+        choices.append({'name': dict(BookFacet.FACETS)[facet],
+                        'param': param, 'values': facet_values})
+    return choices
@@ -4,6 +4,25 @@ from django.core.exceptions import ValidationError
 from django.utils.translation import ugettext_lazy as _
 import datetime  # For checking renewal date range
 
+from .dimensions import DIMENSIONS
+from .models import Book
+
+
+def validate_renewal_date(data):
+    """
+    The renewal date rules, shared by single and bulk renewals.
+    """
+    # Check date is not in past
+    if data < datetime.date.today():
+        raise ValidationError(_("Invalid date - renewal in past"))
+
+    # Check date is in range librarian is allowed to change
+    if data > datetime.date.today() + datetime.timedelta(weeks=4):
+        raise ValidationError(_("Invalid date - renewal more than 4 weeks"))
+
+    # Remember always to retund cleaned data
+    return data
+
 
 class RenewBookForm(forms.Form):
     renewal_date = forms.DateField(
@@ -11,15 +30,138 @@ class RenewBookForm(forms.Form):
     )
 
     def clean_renewal_date(self):
-        data = self.cleaned_data['renewal_date']
+        return validate_renewal_date(self.cleaned_data['renewal_date'])
+
+
+class BookSearchForm(forms.Form):
+    q = forms.CharField(
+        label='Search',
+        max_length=200,
+        required=False,
+        help_text='Words from a title, summary, author or genre'
+    )
 
-        # Check date is not in past
-        if data < datetime.date.today():
-            raise ValidationError(_("Invalid date - renewal in past"))
 
-        # Check date is in range librarian is allowed to change
-        if data > datetime.date.today() + datetime.timedelta(weeks=4):
-            raise ValidationError(_("Invalid date - renewal more than 4 weeks"))
+class BulkLoanForm(forms.Form):
+    """
+    Renew or return many copies at once, given by their ids.
+    """
+    ACTIONS = (
+        ('renew', 'Renew'),
+        ('return', 'Return'),
+    )
+    action = forms.ChoiceField(choices=ACTIONS)
+    renewal_date = forms.DateField(
+        required=False,
+        help_text='For renewals: a date between now and 4 weeks'
+    )
+    copy_ids = forms.CharField(
+        label='Copies',
+        required=False,
+        widget=forms.Textarea,
+        help_text='Copy ids, separated by spaces or new lines'
+    )
 
-        # Remember always to retund cleaned data
+    def clean_renewal_date(self):
+        data = self.cleaned_data['renewal_date']
+        if data is not None:
+            validate_renewal_date(data)
         return data
+
+    def clean_copy_ids(self):
+        return self.cleaned_data['copy_ids'].split()
+
+    def clean(self):
+        cleaned_data = super(BulkLoanForm, self).clean()
+        if (cleaned_data.get('action') == 'renew' and
+                'renewal_date' not in self.errors and
+                not cleaned_data.get('renewal_date')):
+            self.add_error('renewal_date',
+                           _('A renewal date is required to renew.'))
+        return cleaned_data
+
+
+class DimensionChoiceIterator(object):
+    """
+    The choices of a dimension field, from the cached names.
+    """
+
+    def __init__(self, field):
+        self.field = field
+
+    def __iter__(self):
+        if self.field.empty_label is not None:
+            yield ('', self.field.empty_label)
+        for choice in self.field.dimension.choices():
+            yield choice
+
+    def __len__(self):
+        return (len(self.field.dimension.choices()) +
+                (1 if self.field.empty_label is not None else 0))
+
+
+class DimensionChoiceField(forms.ModelChoiceField):
+    """
+    ModelChoiceField for a genre or language, offering and validating the
+    names cached by catalog.dimensions instead of querying the table for
+    every form. The queryset only names the model: it is not filtered.
+    """
+
+    def __init__(self, queryset, *args, **kwargs):
+        self.dimension = DIMENSIONS[queryset.model]
+        super(DimensionChoiceField, self).__init__(queryset, *args, **kwargs)
+
+    def _get_choices(self):
+        # As ModelChoiceField, which has no hook for its iterator
+        if hasattr(self, '_choices'):
+            return self._choices
+        return DimensionChoiceIterator(self)
+
+    choices = property(_get_choices, forms.ChoiceField._set_choices)
+
+    def lookup(self, value):
+        try:
+            instance = self.dimension.instance(int(value))
+        except (ValueError, TypeError):
+            instance = None
+        if instance is None:
+            raise ValidationError(
+                self.error_messages['invalid_choice'], code='invalid_choice',
+                params={'value': value})
+        return instance
+
+    def to_python(self, value):
+        if value in self.empty_values:
+            return None
+        return self.lookup(value)
+
+
+class DimensionMultipleChoiceField(DimensionChoiceField,
+                                   forms.ModelMultipleChoiceField):
+    """
+    ModelMultipleChoiceField for genres or languages, from the cached
+    names (see DimensionChoiceField).
+    """
+
+    def to_python(self, value):
+        if not value:
+            return []
+        return self._check_values(value)
+
+    def _check_values(self, value):
+        try:
+            value = frozenset(value)
+        except TypeError:
+            raise ValidationError(self.error_messages['list'], code='list')
+        return [self.lookup(pk) for pk in value]
+
+
+class BookForm(forms.ModelForm):
+    """
+    Book form offering the cached genres.
+    """
+
+    class Meta:
+        model = Book
+        fields = '__all__'
+        field_classes = {'genre': DimensionMultipleChoiceField}
@@ -0,0 +1,287 @@
+"""
+Bulk import of catalog holdings from CSV or JSON Lines files.
+
+Each row describes one copy of a book:
+
+    title, summary, isbn, author_first_name, author_last_name,
+    genres (separated by ';'), language, imprint, status, due_back
+
+Books are identified by ISBN; authors by name; genres and languages by
+name. Rows are streamed and written in batches with bulk_create, one
+transaction per batch, so memory use depends on the batch size and the
+number of distinct authors, books, genres and languages, not on the
+size of the file. After each batch the number of rows done is written to
+a checkpoint file, from which an interrupted import can resume.
+"""
+from collections import Counter
+import csv
+import datetime
+import io
+import json
+import os
+import time
+
+from django.db import transaction
+from django.db.models import F
+
+from .caching import bump_versions
+from .dimensions import genres, languages
+from .facets import recount_facets, update_index
+from .models import (Author, Book, BookInstance, BookSearchTerm, Genre,
+                     Language)
+from .search import document_terms
+from .stats import STATUS_COUNTERS, rebuild_catalog_stats
+
+FORMATS = ('csv', 'jsonl')
+
+DEFAULT_BATCH_SIZE = 5000
+
+LOAN_STATUSES = frozenset(status for status, name in BookInstance.LOAN_STATUS)
+
+# Keys per IN (...) lookup, below SQLite's limit on query parameters
+LOOKUP_CHUNK_SIZE = 500
+
+
+def chunked(items, size=LOOKUP_CHUNK_SIZE):
+    items = list(items)
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+def read_rows(path, file_format):
+    """
+    Yield the rows of a file as dicts, one at a time.
+    """
+    with io.open(path, encoding='utf-8', newline='') as source:
+        if file_format == 'csv':
+            for row in csv.DictReader(source):
+                yield row
+        else:
+            for line in source:
+                if line.strip():
+                    yield json.loads(line)
+
+
+def guess_format(path):
+    extension = os.path.splitext(path)[1].lower().lstrip('.')
+    if extension in ('json', 'jsonl', 'ndjson'):
+        return 'jsonl'
+    return 'csv'
+
+
+def clean(row):
+    """
+    Normalize a row, raising ValueError if it cannot be imported.
+    """
+    def text(name):
+        return (row.get(name) or '').strip()
+
+    if not text('title') or not text('isbn'):
+        raise ValueError('title and isbn are required')
+    status = text('status') or None
+    if status is not None and status not in LOAN_STATUSES:
+        raise ValueError('unknown status %r' % status)
+    due_back = text('due_back') or None
+    if due_back is not None:
+        due_back = datetime.datetime.strptime(due_back, '%Y-%m-%d').date()
+    genres = row.get('genres') or []
+    if not isinstance(genres, list):
+        genres = genres.split(';')
+    return {
+        'title': text('title'),
+        'summary': text('summary'),
+        'isbn': text('isbn'),
+        'author': (text('author_first_name'), text('author_last_name')),
+        'genres': [name.strip() for name in genres if name.strip()],
+        'language': text('language'),
+        'imprint': text('imprint'),
+        'status': status,
+        'due_back': due_back,
+    }
+
+
+class CatalogImporter(object):
+    """
+    Imports rows into Author, Genre, Language, Book and BookInstance.
+
+    The lookup maps (natural key -> primary key) are loaded once from the
+    database and grow as new objects are created, so each distinct author,
+    genre, language and book is looked up or created only once.
+    """
+
+    def __init__(self, batch_size=DEFAULT_BATCH_SIZE, checkpoint=None,
+                 progress=None):
+        self.batch_size = batch_size
+        self.checkpoint = checkpoint
+        self.progress = progress
+        self.authors = dict(
+            ((first, last), pk) for pk, first, last in
+            Author.objects.values_list('pk', 'first_name', 'last_name'))
+        self.genres = dict(
+            (name, pk) for pk, name in Genre.objects.values_list('pk', 'name'))
+        self.languages = dict(
+            (name, pk) for pk, name in
+            Language.objects.values_list('pk', 'name'))
+        self.books = dict(
+            (isbn, pk) for pk, isbn in Book.objects.values_list('pk', 'isbn'))
+        self.rows_done = 0
+        self.copies_created = 0
+        self.errors = []
+
+    def read_checkpoint(self):
+        if self.checkpoint and os.path.exists(self.checkpoint):
+            with open(self.checkpoint) as handle:
+                return json.load(handle)['rows']
+        return 0
+
+    def write_checkpoint(self):
+        if self.checkpoint:
+            temporary = self.checkpoint + '.tmp'
+            with open(temporary, 'w') as handle:
+                json.dump({'rows': self.rows_done}, handle)
+            # Replace atomically so a crash never leaves half a checkpoint
+            os.rename(temporary, self.checkpoint)
+
+    def run(self, rows, resume=False):
+        """
+        Import an iterable of raw rows, resuming after the rows recorded
+        in the checkpoint if asked to. Returns the elapsed time.
+        """
+        start = time.time()
+        number = self.rows_done = self.read_checkpoint() if resume else 0
+        batch = []
+        for number, row in enumerate(rows, start=1):
+            if number <= self.rows_done:
+                continue
+            try:
+                batch.append(clean(row))
+            except (ValueError, TypeError) as error:
+                self.errors.append((number, str(error)))
+            if number - self.rows_done >= self.batch_size:
+                self.import_batch(batch, number)
+                batch = []
+        self.import_batch(batch, max(number, self.rows_done))
+        self.finish()
+        return time.time() - start
+
+    def import_batch(self, batch, rows_done):
+        """
+        Write a batch of clean rows in one transaction and record that
+        the rows up to rows_done are imported.
+        """
+        with transaction.atomic():
+            self.create_missing(
+                Author, self.authors, set(row['author'] for row in batch
+                                          if any(row['author'])),
+                lambda key: Author(first_name=key[0], last_name=key[1]),
+                lambda obj: (obj.first_name, obj.last_name))
+            new_genres = self.create_missing(
+                Genre, self.genres,
+                set(name for row in batch for name in row['genres']),
+                lambda name: Genre(name=name), lambda obj: obj.name)
+            new_languages = self.create_missing(
+                Language, self.languages,
+                set(row['language'] for row in batch if row['language']),
+                lambda name: Language(name=name), lambda obj: obj.name)
+
+            first_rows = {}
+            copies = {}
+            for row in batch:
+                first_rows.setdefault(row['isbn'], row)
+                counters = copies.setdefault(row['isbn'], Counter())
+                counters['copies_total'] += 1
+                if row['status'] in STATUS_COUNTERS:
+                    counters[STATUS_COUNTERS[row['status']]] += 1
+            new_books = self.create_missing(
+                Book, self.books, set(first_rows),
+                lambda isbn: Book(
+                    isbn=isbn, title=first_rows[isbn]['title'],
+                    summary=first_rows[isbn]['summary'],
+                    author_id=self.authors.get(first_rows[isbn]['author']),
+                    **copies[isbn]),
+                lambda obj: obj.isbn)
+            # Books already in the catalog gain the batch's copies
+            for isbn in set(first_rows).difference(new_books):
+                Book.objects.filter(pk=self.books[isbn]).update(**dict(
+                    (name, F(name) + count)
+                    for name, count in copies[isbn].items()))
+            Book.genre.through.objects.bulk_create(
+                Book.genre.through(book_id=self.books[isbn],
+                                   genre_id=self.genres[name])
+                for isbn in new_books
+                for name in set(first_rows[isbn]['genres']))
+
+            BookInstance.objects.bulk_create(
+                (BookInstance(
+                    book_id=self.books[row['isbn']],
+                    language_id=self.languages.get(row['language']),
+                    imprint=row['imprint'], status=row['status'],
+                    due_back=row['due_back'])
+                 for row in batch))
+            # Index the new books straight from the rows
+            BookSearchTerm.objects.bulk_create(
+                term for isbn in new_books
+                for term in document_terms(
+                    self.books[isbn], first_rows[isbn]['title'],
+                    first_rows[isbn]['summary'],
+                    ' '.join(first_rows[isbn]['author']),
+                    first_rows[isbn]['genres']))
+            # The counts are recounted once at the end
+            update_index(self.books[isbn] for isbn in first_rows)
+
+        # Too many pages change to expire them one by one
+        bump_versions('catalog')
+        # bulk_create skipped the signals expiring the cached names of
+        # catalog.dimensions
+        if new_genres:
+            genres.clear()
+            bump_versions('genre')
+        if new_languages:
+            languages.clear()
+            bump_versions('language')
+        self.copies_created += len(batch)
+        self.rows_done = rows_done
+        self.write_checkpoint()
+        if self.progress:
+            self.progress(self)
+
+    def create_missing(self, model, lookup, keys, build, natural_key):
+        """
+        Bulk create the objects of keys not in lookup and add their
+        primary keys to it. Returns the keys created.
+        """
+        missing = [key for key in keys if key not in lookup]
+        if not missing:
+            return missing
+        objects = [build(key) for key in missing]
+        model.objects.bulk_create(objects)
+        if any(obj.pk is None for obj in objects):
+            # Only some databases (e.g. PostgreSQL) return the new ids;
+            # look the rest up by their natural key.
+            for obj in self.fetch_created(model, missing):
+                lookup[natural_key(obj)] = obj.pk
+        else:
+            for obj in objects:
+                lookup[natural_key(obj)] = obj.pk
+        return missing
+
+    def fetch_created(self, model, keys):
+        if model is Author:
+            last_names = set(last for first, last in keys)
+            for chunk in chunked(last_names):
+                for obj in Author.objects.filter(last_name__in=chunk).only(
+                        'first_name', 'last_name'):
+                    yield obj
+        elif model is Book:
+            for chunk in chunked(keys):
+                for obj in Book.objects.filter(isbn__in=chunk).only('isbn'):
+                    yield obj
+        else:
+            for chunk in chunked(keys):
+                for obj in model.objects.filter(name__in=chunk).only('name'):
+                    yield obj
+
+    def finish(self):
+        # bulk_create skipped the signal handlers: recount the statistics
+        rebuild_catalog_stats()
+        recount_facets()
@@ -0,0 +1,412 @@
+"""
+Per-request performance instrumentation.
+
+InstrumentationMiddleware records, for each request, the wall time, the
+number and total time of the database queries, the time spent rendering
+templates, the page cache hits and misses and the view that handled it.
+The figures are aggregated into in-process histograms, served in the
+Prometheus text format by the `catalog-metrics` view; requests slower
+than CATALOG_SLOW_REQUEST_MS are also logged, as one JSON object, to the
+'catalog.slow_requests' logger with their slowest SQL statements.
+
+Django 1.10 has no hook around query execution (connection.execute_wrapper
+arrived in 2.0), so for the duration of the request each connection
+wraps its cursors in an InstrumentedCursorWrapper, which times every
+query. It replaces the connection's plain cursor wrapper, not its debug
+one, so queries are neither logged nor run differently unless DEBUG (or
+assertNumQueries) logs them anyway. Set CATALOG_INSTRUMENT_SQL = False to
+skip it.
+
+Template rendering is timed by InstrumentedDjangoTemplates, a template
+backend wrapping the templates of the stock Django one.
+
+The metrics also report the state of the database connection pools
+(see catalog.dbbackends.pool).
+
+The histograms live in each process: with several workers, Prometheus
+scrapes each of them (or sums them) separately.
+"""
+from collections import defaultdict
+from functools import partial
+import json
+import logging
+import threading
+import time
+
+from django.conf import settings
+from django.db import connections
+from django.db.backends.utils import CursorDebugWrapper, CursorWrapper
+from django.template.backends.django import DjangoTemplates
+
+from .dbbackends.pool import pool_stats
+
+logger = logging.getLogger('catalog.slow_requests')
+
+# Upper bounds of the histogram buckets
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0,
+                    10.0)
+QUERY_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200)
+
+DEFAULT_SLOW_REQUEST_MS = 500
+DEFAULT_SLOW_SQL_COUNT = 5
+
+# Data of the request being handled by the current thread
+_local = threading.local()
+
+
+def current_record():
+    """
+    The RequestRecord of the request in progress, or None outside one.
+    """
+    return getattr(_local, 'record', None)
+
+
+def record_cache(hit):
+    """
+    Count a page cache hit (or miss) against the current request.
+    """
+    record = current_record()
+    if record is not None:
+        if hit:
+            record.cache_hits += 1
+        else:
+            record.cache_misses += 1
+
+
+class RequestRecord(object):
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.duration = 0.0
+        self.template_time = 0.0
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self.queries = []
+
+
+class Histogram(object):
+    """
+    A Prometheus histogram, with a series per tuple of label values.
+    """
+
+    def __init__(self, name, description, labels, buckets):
+        self.name = name
+        self.description = description
+        self.labels = labels
+        self.buckets = buckets
+        self.counts = defaultdict(lambda: [0] * (len(buckets) + 1))
+        self.sums = defaultdict(float)
+
+    def observe(self, label_values, value):
+        counts = self.counts[label_values]
+        for index, bound in enumerate(self.buckets):
+            if value <= bound:
+                counts[index] += 1
+        counts[-1] += 1
+        self.sums[label_values] += value
+
+    def render(self):
+        yield '# HELP %s %s' % (self.name, self.description)
+        yield '# TYPE %s histogram' % self.name
+        for label_values in sorted(self.counts):
+            labels = format_labels(self.labels, label_values)
+            counts = self.counts[label_values]
+            for bound, count in zip(self.buckets, counts):
+                yield '%s_bucket{%s,le="%s"} %d' % (
+                    self.name, labels, bound, count)
+            yield '%s_bucket{%s,le="+Inf"} %d' % (self.name, labels,
+                                                  counts[-1])
+            yield '%s_sum{%s} %s' % (self.name, labels,
+                                     repr(self.sums[label_values]))
+            yield '%s_count{%s} %d' % (self.name, labels, counts[-1])
+
+
+class Counter(object):
+    """
+    A Prometheus counter, with a series per tuple of label values.
+    """
+
+    def __init__(self, name, description, labels):
+        self.name = name
+        self.description = description
+        self.labels = labels
+        self.values = defaultdict(int)
+
+    def inc(self, label_values, amount=1):
+        self.values[label_values] += amount
+
+    def render(self):
+        yield '# HELP %s %s' % (self.name, self.description)
+        yield '# TYPE %s counter' % self.name
+        for label_values in sorted(self.values):
+            yield '%s{%s} %d' % (self.name,
+                                 format_labels(self.labels, label_values),
+                                 self.values[label_values])
+
+
+class Gauge(object):
+    """
+    A Prometheus gauge (or a counter of fractional values), with a series
+    per tuple of label values.
+    """
+
+    def __init__(self, name, description, labels, metric_type='gauge'):
+        self.name = name
+        self.description = description
+        self.labels = labels
+        self.metric_type = metric_type
+        self.values = {}
+
+    def set(self, label_values, value):
+        self.values[label_values] = value
+
+    def render(self):
+        yield '# HELP %s %s' % (self.name, self.description)
+        yield '# TYPE %s %s' % (self.name, self.metric_type)
+        for label_values in sorted(self.values):
+            yield '%s{%s} %s' % (self.name,
+                                 format_labels(self.labels, label_values),
+                                 repr(float(self.values[label_values])))
+
+
+def format_labels(names, values):
+    return ','.join('%s="%s"' % (name, str(value).replace('\\', '\\\\')
+                                 .replace('"', '\\"').replace('\n', '\\n'))
+                    for name, value in zip(names, values))
+
+
+class Metrics(object):
+    """
+    The metrics of this process, updated once per request.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        self.requests = Counter(
+            'catalog_requests_total', 'Requests handled.',
+            ('view', 'method', 'status'))
+        self.duration = Histogram(
+            'catalog_request_duration_seconds', 'Wall time per request.',
+            ('view',), DURATION_BUCKETS)
+        self.db_queries = Histogram(
+            'catalog_request_db_queries', 'Database queries per request.',
+            ('view',), QUERY_BUCKETS)
+        self.db_duration = Histogram(
+            'catalog_request_db_duration_seconds',
+            'Time spent in database queries per request.',
+            ('view',), DURATION_BUCKETS)
+        self.template_duration = Histogram(
+            'catalog_request_template_duration_seconds',
+            'Time spent rendering templates per request.',
+            ('view',), DURATION_BUCKETS)
+        self.cache = Counter(
+            'catalog_page_cache_total', 'Page cache lookups.',
+            ('view', 'result'))
+
+    def observe(self, view, method, status, record):
+        db_time = sum(duration for sql, duration in record.queries)
+        with self.lock:
+            self.requests.inc((view, method, status))
+            self.duration.observe((view,), record.duration)
+            self.db_queries.observe((view,), len(record.queries))
+            self.db_duration.observe((view,), db_time)
+            self.template_duration.observe((view,), record.template_time)
+            if record.cache_hits:
+                self.cache.inc((view, 'hit'), record.cache_hits)
+            if record.cache_misses:
+                self.cache.inc((view, 'miss'), record.cache_misses)
+
+    def render(self):
+        with self.lock:
+            lines = []
+            for metric in (self.requests, self.duration, self.db_queries,
+                           self.db_duration, self.template_duration,
+                           self.cache):
+                lines.extend(metric.render())
+        for metric in pool_metrics():
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+
+# The counters of the connection pools, with their metric and help text
+POOL_COUNTERS = (
+    ('opened', 'catalog_db_pool_opened_total', 'Connections opened.'),
+    ('reused', 'catalog_db_pool_reused_total',
+     'Connections handed out again by the pool.'),
+    ('discarded', 'catalog_db_pool_discarded_total',
+     'Connections closed as broken, too old or no longer pooled.'),
+    ('failed_checks', 'catalog_db_pool_failed_checks_total',
+     'Idle connections failing their health check.'),
+    ('waits', 'catalog_db_pool_waits_total',
+     'Connections waited for, the pool being full.'),
+    ('timeouts', 'catalog_db_pool_timeouts_total',
+     'Waits for a connection given up after the pool TIMEOUT.'),
+)
+
+
+def pool_metrics():
+    """
+    The state of the database connection pools of this process (see
+    catalog.dbbackends.pool), read when the metrics are scraped.
+    """
+    connections = Gauge('catalog_db_pool_connections',
+                        'Pooled connections, by state.',
+                        ('database', 'state'))
+    counters = [(key, Counter(name, description, ('database',)))
+                for key, name, description in POOL_COUNTERS]
+    wait_time = Gauge('catalog_db_pool_wait_seconds_total',
+                      'Time spent waiting for a connection.',
+                      ('database',), metric_type='counter')
+    for stats in pool_stats():
+        database = stats['alias']
+        for state in ('idle', 'in_use', 'max_size'):
+            connections.set((database, state), stats[state])
+        for key, counter in counters:
+            counter.inc((database,), stats[key])
+        wait_time.set((database,), stats['wait_time'])
+    return [connections] + [counter for key, counter in counters] + [
+        wait_time]
+
+
+metrics = Metrics()
+
+
+def view_name(request):
+    match = getattr(request, 'resolver_match', None)
+    if match is None:
+        return 'unresolved'
+    return match.view_name or match._func_path
+
+
+class InstrumentationMiddleware(object):
+    """
+    Measure each request and add it to the process metrics.
+    Goes first in MIDDLEWARE, so the time includes the other middleware.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        record = _local.record = RequestRecord()
+        instrumented = []
+        if getattr(settings, 'CATALOG_INSTRUMENT_SQL', True):
+            for connection in connections.all():
+                instrumented.append(connection)
+                connection.make_cursor = partial(
+                    InstrumentedCursorWrapper, db=connection)
+                # Used instead when queries are logged
+                connection.make_debug_cursor = partial(
+                    InstrumentedCursorDebugWrapper, db=connection)
+        try:
+            response = self.get_response(request)
+        finally:
+            record.duration = time.perf_counter() - record.start
+            for connection in instrumented:
+                del connection.make_cursor
+                del connection.make_debug_cursor
+            _local.record = None
+
+        metrics.observe(view_name(request), request.method,
+                        response.status_code, record)
+        threshold = getattr(settings, 'CATALOG_SLOW_REQUEST_MS',
+                            DEFAULT_SLOW_REQUEST_MS)
+        if threshold is not None and record.duration * 1000 >= threshold:
+            self.log_slow_request(request, response, record)
+        return response
+
+    def log_slow_request(self, request, response, record):
+        top = getattr(settings, 'CATALOG_SLOW_REQUEST_SQL',
+                      DEFAULT_SLOW_SQL_COUNT)
+        slowest = sorted(record.queries, key=lambda query: -query[1])[:top]
+        logger.warning(json.dumps({
+            'event': 'slow_request',
+            'method': request.method,
+            'path': request.get_full_path(),
+            'view': view_name(request),
+            'status': response.status_code,
+            'duration_ms': round(record.duration * 1000, 1),
+            'db_queries': len(record.queries),
+            'db_ms': round(sum(duration for sql, duration in
+                               record.queries) * 1000, 1),
+            'template_ms': round(record.template_time * 1000, 1),
+            'cache_hits': record.cache_hits,
+            'cache_misses': record.cache_misses,
+            'slowest_sql': [{'sql': sql, 'ms': round(duration * 1000, 1)}
+                            for sql, duration in slowest],
+        }, sort_keys=True))
+
+
+class InstrumentedCursorWrapper(CursorWrapper):
+    """
+    Cursor adding each query and its time to the request.
+    """
+
+    def execute(self, sql, params=None):
+        start = time.perf_counter()
+        try:
+            return super(InstrumentedCursorWrapper, self).execute(sql, params)
+        finally:
+            self.record(sql, time.perf_counter() - start)
+
+    def executemany(self, sql, param_list):
+        start = time.perf_counter()
+        try:
+            return super(InstrumentedCursorWrapper, self).executemany(
+                sql, param_list)
+        finally:
+            self.record(sql, time.perf_counter() - start)
+
+    def record(self, sql, duration):
+        record = current_record()
+        if record is not None:
+            record.queries.append((sql, duration))
+
+
+class InstrumentedCursorDebugWrapper(InstrumentedCursorWrapper,
+                                     CursorDebugWrapper):
+    """
+    InstrumentedCursorWrapper that also logs to connection.queries_log,
+    as the debug cursor it replaces does when queries are logged.
+    """
+
+
+class InstrumentedTemplate(object):
+    """
+    Wraps a backend template to add its render time to the request.
+    """
+
+    def __init__(self, template):
+        self.template = template
+
+    def __getattr__(self, name):
+        return getattr(self.template, name)
+
+    def render(self, context=None, request=None):
+        record = current_record()
+        if record is None:
+            return self.template.render(context, request)
+        start = time.perf_counter()
+        try:
+            return self.template.render(context, request)
+        finally:
+            record.template_time += time.perf_counter() - start
+
+
+class InstrumentedDjangoTemplates(DjangoTemplates):
+    """
+    The Django template backend, timing how long templates take to render.
+    """
+
+    def from_string(self, template_code):
+        return InstrumentedTemplate(
+            super(InstrumentedDjangoTemplates, self).from_string(
+                template_code))
+
+    def get_template(self, template_name):
+        return InstrumentedTemplate(
+            super(InstrumentedDjangoTemplates, self).get_template(
+                template_name))
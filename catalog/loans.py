@@ -0,0 +1,337 @@
+"""
+Loan operations on book copies: checkout, return, renew and reserve.
+
+Each operation moves a copy from one status to another with a single
+conditional UPDATE (`... WHERE id = %s AND status = 'a'`) writing only
+the fields that change, so two librarians acting on the same copy at
+once cannot both succeed: the second UPDATE matches no row and raises
+LoanError, instead of silently overwriting the first as a read-modify-
+save() of the whole row would.
+
+The bulk variants (return_copies, renew_copies) first lock the copies
+that can move (SELECT ... FOR UPDATE on PostgreSQL; SQLite locks the
+whole database for writes anyway) and then move them all with one
+UPDATE per chunk, in one transaction.
+
+Patrons can also queue for a book with a Hold. A copy coming back is
+reserved for the oldest waiting hold on its book in the same transaction
+as the return, and allocate_holds() matches any number of available
+copies to their queues in one pass.
+
+queryset.update() skips the signal handlers, so the operations keep
+the catalog statistics, the book counters, the availability facet and
+the page cache versions current themselves.
+"""
+from collections import Counter, defaultdict
+import datetime
+
+from django.core.exceptions import ValidationError
+from django.db import connection, transaction
+from django.utils import timezone
+
+from .caching import bump_versions
+from .facets import index_books
+from .models import Book, BookInstance, Hold
+from .stats import adjust_many_book_counters, adjust_stat
+
+# Default length of a loan
+LOAN_PERIOD = datetime.timedelta(weeks=3)
+
+# A returned copy keeps nothing of its last loan, so the next one does
+# not start with the previous borrower's fine or reminder date
+RETURNED_FIELDS = {'borrower': None, 'due_back': None, 'fine': 0,
+                   'overdue_notified': None}
+
+# Copies per IN (...) lookup, below SQLite's limit on query parameters
+CHUNK_SIZE = 500
+
+
+class LoanError(Exception):
+    """
+    The copy does not exist or is not in a status allowing the operation.
+    """
+
+
+def chunked(items, size=CHUNK_SIZE):
+    items = list(items)
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+def record_moves(moves):
+    """
+    Bring the derived data up to date after copies changed status.
+    moves -- (book id, old status, new status) per copy moved
+    """
+    deltas = Counter()
+    available = 0
+    book_ids = set()
+    for book_id, old_status, new_status in moves:
+        book_ids.add(book_id)
+        if old_status != new_status:
+            deltas[book_id, old_status] -= 1
+            deltas[book_id, new_status] += 1
+            available += (new_status == 'a') - (old_status == 'a')
+    book_ids.discard(None)
+    if deltas:
+        adjust_many_book_counters(deltas)
+    adjust_stat('num_instances_available', available)
+    # Books whose number of available copies changed may have gained or
+    # lost their first one
+    index_books(set(book_id for (book_id, status), delta in deltas.items()
+                    if status == 'a' and delta and book_id is not None),
+                facets='v')
+    if book_ids:
+        # The same pages as catalog.signals.expire_copy_pages
+        author_ids = Book.objects.filter(pk__in=book_ids).exclude(
+            author=None).values_list('author_id', flat=True)
+        bump_versions('book', *['book:%s' % pk for pk in book_ids] +
+                      ['author:%s' % pk for pk in author_ids])
+
+
+def move(copy_id, old_status, new_status, holder=None, **fields):
+    """
+    Move a copy from old_status (lent to or reserved for holder, if
+    given) to new_status, setting fields, with one conditional UPDATE.
+    Returns whether the copy moved.
+    """
+    copies = BookInstance.objects.filter(pk=copy_id, status__exact=old_status)
+    if holder is not None:
+        copies = copies.filter(borrower=holder)
+    with transaction.atomic():
+        if not copies.update(status=new_status, **fields):
+            return False
+        book_id = BookInstance.objects.filter(pk=copy_id).values_list(
+            'book_id', flat=True).get()
+        record_moves([(book_id, old_status, new_status)])
+    return True
+
+
+def checkout(copy_id, borrower, due_back=None):
+    """
+    Lend an available copy (or one reserved for borrower) to borrower.
+    Returns the due date.
+    """
+    due_back = due_back or datetime.date.today() + LOAN_PERIOD
+    fields = {'borrower': borrower, 'due_back': due_back}
+    if not (move(copy_id, 'a', 'o', **fields) or
+            move(copy_id, 'r', 'o', holder=borrower, **fields)):
+        raise LoanError('Copy %s is not available to %s.' % (
+            copy_id, borrower))
+    return due_back
+
+
+def return_copy(copy_id):
+    """
+    Check a copy on loan back in, reserving it for the next patron
+    waiting for the book, if any.
+    """
+    with transaction.atomic():
+        if not move(copy_id, 'o', 'a', **RETURNED_FIELDS):
+            raise LoanError('Copy %s is not on loan.' % copy_id)
+        allocate_holds([copy_id])
+
+
+def renew(copy_id, due_back, borrower=None):
+    """
+    Extend a loan (to borrower, if given) until due_back.
+    """
+    if not move(copy_id, 'o', 'o', holder=borrower, due_back=due_back):
+        raise LoanError('Copy %s is not on loan.' % copy_id)
+
+
+def reserve(copy_id, borrower):
+    """
+    Put an available copy aside for borrower.
+    """
+    if not move(copy_id, 'a', 'r', borrower=borrower, due_back=None):
+        raise LoanError('Copy %s is not available.' % copy_id)
+
+
+def clean_ids(copy_ids):
+    """
+    Split copy ids (UUIDs or strings) into valid UUIDs and invalid ids.
+    """
+    valid, invalid = [], []
+    for copy_id in copy_ids:
+        try:
+            valid.append(BookInstance._meta.pk.to_python(copy_id))
+        except ValidationError:
+            invalid.append(copy_id)
+    return valid, invalid
+
+
+def move_many(copy_ids, old_status, new_status, **fields):
+    """
+    Move the copies in old_status to new_status in one transaction.
+    Returns (moved ids, ids not moved).
+    """
+    copy_ids, failed = clean_ids(copy_ids)
+    moved = []
+    moves = []
+    with transaction.atomic():
+        for chunk in chunked(set(copy_ids)):
+            # Lock the copies that can move (a no-op on SQLite)
+            rows = list(BookInstance.objects.select_for_update().filter(
+                pk__in=chunk, status__exact=old_status).order_by(
+                ).values_list('pk', 'book_id'))
+            if not rows:
+                continue
+            pks = [pk for pk, book_id in rows]
+            updated = BookInstance.objects.filter(
+                pk__in=pks, status__exact=old_status).update(
+                status=new_status, **fields)
+            if updated != len(pks):
+                # Only possible without row locks; roll back everything
+                raise LoanError('Copies changed during the operation.')
+            moved.extend(pks)
+            moves.extend((book_id, old_status, new_status)
+                         for pk, book_id in rows)
+        record_moves(moves)
+    moved_set = set(moved)
+    failed.extend(pk for pk in copy_ids if pk not in moved_set)
+    return moved, failed
+
+
+def return_copies(copy_ids):
+    """
+    Check a whole cart of copies back in, reserving them for the patrons
+    waiting for their books. Returns (returned ids, ids of the copies
+    that were not on loan).
+    """
+    with transaction.atomic():
+        returned, failed = move_many(copy_ids, 'o', 'a', **RETURNED_FIELDS)
+        allocate_holds(returned)
+    return returned, failed
+
+
+def renew_copies(copy_ids, due_back):
+    """
+    Extend many loans until due_back. Returns (renewed ids, ids of the
+    copies that were not on loan).
+    """
+    return move_many(copy_ids, 'o', 'o', due_back=due_back)
+
+
+def place_hold(book_id, borrower):
+    """
+    Queue borrower for the next copy of a book; a copy available now is
+    reserved for them straight away. Returns the hold.
+    """
+    with transaction.atomic():
+        if Hold.objects.filter(book_id=book_id, borrower=borrower,
+                               status__exact='w').exists():
+            raise LoanError('%s is already waiting for book %s.' % (
+                borrower, book_id))
+        hold = Hold.objects.create(book_id=book_id, borrower=borrower)
+        allocate_holds(book_ids=[book_id])
+    hold.refresh_from_db()
+    return hold
+
+
+def cancel_hold(hold_id, borrower=None):
+    """
+    Cancel a hold (of borrower, if given). A copy already reserved for
+    it goes to the next patron in the queue.
+    """
+    holds = Hold.objects.select_for_update().filter(
+        pk=hold_id, status__in=('w', 'f'))
+    if borrower is not None:
+        holds = holds.filter(borrower=borrower)
+    with transaction.atomic():
+        hold = holds.first()
+        if hold is None:
+            raise LoanError('Hold %s cannot be cancelled.' % hold_id)
+        Hold.objects.filter(pk=hold.pk).update(status='c')
+        # Unless the patron has collected it already
+        if hold.copy_id and move(hold.copy_id, 'r', 'a',
+                                 holder=hold.borrower_id, borrower=None):
+            allocate_holds([hold.copy_id])
+
+
+def available_copies(copy_ids=None, book_ids=None):
+    """
+    Lock the available copies among copy_ids, or of the books in
+    book_ids, or all of them; returns {book id: [copy ids]}.
+    """
+    copies = BookInstance.objects.select_for_update().filter(
+        status__exact='a').exclude(book=None).order_by('pk')
+    if copy_ids is not None:
+        querysets = [copies.filter(pk__in=chunk)
+                     for chunk in chunked(set(copy_ids))]
+    elif book_ids is not None:
+        querysets = [copies.filter(book__in=chunk)
+                     for chunk in chunked(set(book_ids))]
+    else:
+        querysets = [copies]
+    available = defaultdict(list)
+    for queryset in querysets:
+        for book_id, pk in queryset.values_list('book_id', 'pk').iterator():
+            available[book_id].append(pk)
+    return available
+
+
+def reserve_matched(matches):
+    """
+    Reserve each matched copy for its hold's patron and mark the holds
+    fulfilled. Every row gets different values, and building a CASE
+    expression of one WHEN per row costs the ORM far more than the
+    database's work, so this sends one executemany() per table.
+    matches -- (hold id, copy id, borrower id, book id) tuples
+    """
+    copies = BookInstance._meta
+    holds = Hold._meta
+    quote = connection.ops.quote_name
+    with connection.cursor() as cursor:
+        cursor.executemany(
+            'UPDATE %s SET %s = %%s, %s = %%s, %s = NULL '
+            'WHERE %s = %%s AND %s = %%s' % tuple(quote(name) for name in (
+                copies.db_table, copies.get_field('status').column,
+                copies.get_field('borrower').column,
+                copies.get_field('due_back').column, copies.pk.column,
+                copies.get_field('status').column)),
+            [('r', borrower_id,
+              copies.pk.get_db_prep_value(copy_pk, connection), 'a')
+             for hold_pk, copy_pk, borrower_id, book_id in matches])
+        if cursor.rowcount != len(matches):
+            # Only possible without row locks; roll back everything
+            raise LoanError('Copies changed during the operation.')
+        fulfilled = holds.get_field('fulfilled').get_db_prep_value(
+            timezone.now(), connection)
+        cursor.executemany(
+            'UPDATE %s SET %s = %%s, %s = %%s, %s = %%s '
+            'WHERE %s = %%s' % tuple(quote(name) for name in (
+                holds.db_table, holds.get_field('status').column,
+                holds.get_field('fulfilled').column,
+                holds.get_field('copy').column, holds.pk.column)),
+            [('f', fulfilled,
+              copies.pk.get_db_prep_value(copy_pk, connection), hold_pk)
+             for hold_pk, copy_pk, borrower_id, book_id in matches])
+
+
+def allocate_holds(copy_ids=None, book_ids=None):
+    """
+    Reserve available copies for the oldest waiting holds on their
+    books, in one pass: the copies in copy_ids, those of the books in
+    book_ids, or every available copy. Returns the fulfilled holds' ids.
+    """
+    with transaction.atomic():
+        available = available_copies(copy_ids, book_ids)
+        # (hold, copy, borrower, book) per copy to reserve; each book's
+        # queue is read in order, until its copies run out
+        matches = []
+        for chunk in chunked(sorted(available)):
+            queue = Hold.objects.select_for_update().filter(
+                book__in=chunk, status__exact='w').order_by(
+                'book', 'placed', 'id').values_list(
+                'pk', 'book_id', 'borrower_id')
+            for hold_pk, book_id, borrower_id in queue.iterator():
+                if available[book_id]:
+                    matches.append((hold_pk, available[book_id].pop(0),
+                                    borrower_id, book_id))
+        if matches:
+            reserve_matched(matches)
+            record_moves((book_id, 'a', 'r')
+                         for hold_pk, copy_pk, borrower_id, book_id
+                         in matches)
+    return [match[0] for match in matches]
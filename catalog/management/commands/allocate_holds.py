@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+
+from catalog.loans import allocate_holds
+
+
+class Command(BaseCommand):
+    help = ('Reserve every available copy for the oldest waiting hold on '
+            'its book, e.g. after copies were made available in bulk.')
+
+    def handle(self, *args, **options):
+        fulfilled = allocate_holds()
+        self.stdout.write(self.style.SUCCESS(
+            '%d holds fulfilled.' % len(fulfilled)))
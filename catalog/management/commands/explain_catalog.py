@@ -0,0 +1,115 @@
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections, DEFAULT_DB_ALIAS
+from django.test import RequestFactory
+
+from catalog import views
+from catalog.models import BookInstance, CatalogStatistic
+from catalog.search import search_books
+
+
+def main_queries(user):
+    """
+    Yield (name, queryset) for the main query of each catalog page,
+    built by the views themselves so the plans follow any change to them.
+    """
+    yield 'index', CatalogStatistic.objects.all()
+    yield 'stats rebuild (available copies)', BookInstance.objects.filter(
+        status__exact='a')
+    yield 'search', search_books('python programming').matches[:10]
+    yield 'process_overdue', BookInstance.objects.overdue().order_by(
+        'due_back', 'id')
+
+    request = RequestFactory().get('/')
+    request.user = user
+    list_views = (
+        ('books', views.BookListView),
+        ('book-browse', views.BookBrowseView),
+        ('authors', views.AuthorListView),
+        ('my-borrowed', views.LoanedBookByUserListView),
+        ('all-borrowed', views.LoadBooksByAllUsersListView),
+    )
+    for name, view_class in list_views:
+        view = view_class()
+        view.request, view.args, view.kwargs = request, (), {}
+        queryset = view.get_queryset()
+        if view.keyset_pagination:
+            queryset = queryset.order_by(*view.keyset_ordering)
+        yield name, queryset[:view.paginate_by]
+
+    for name, view_class in (('book-detail', views.BookDetailView),
+                             ('author-detail', views.AuthorDetailView)):
+        view = view_class()
+        view.request, view.args, view.kwargs = request, (), {'pk': 1}
+        yield name, view.get_queryset().filter(pk=1)
+
+
+def explain(connection, queryset):
+    """
+    Return the plan lines for a queryset and the ones that are
+    sequential (full table) scans.
+    """
+    sql, params = queryset.query.sql_with_params()
+    with connection.cursor() as cursor:
+        if connection.vendor == 'sqlite':
+            cursor.execute('EXPLAIN QUERY PLAN ' + sql, params)
+            # Rows are (id, parent, notused, detail)
+            lines = [row[-1] for row in cursor.fetchall()]
+            scans = [line for line in lines
+                     if line.startswith('SCAN') and 'USING' not in line]
+        elif connection.vendor == 'postgresql':
+            cursor.execute('EXPLAIN ' + sql, params)
+            lines = [row[0] for row in cursor.fetchall()]
+            scans = [line for line in lines if 'Seq Scan' in line]
+        else:
+            raise CommandError('EXPLAIN is only supported on SQLite and '
+                               'PostgreSQL, not %s.' % connection.vendor)
+    return lines, scans
+
+
+class Command(BaseCommand):
+    help = ('Run EXPLAIN on the main query of each catalog view and report '
+            'sequential scans.')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--database', default=DEFAULT_DB_ALIAS,
+            help='Database to explain the queries on (default: "default").')
+        parser.add_argument(
+            '--username',
+            help='User whose "My books" query is explained '
+                 '(default: any user id).')
+        parser.add_argument(
+            '--fail-on-scan', action='store_true',
+            help='Exit with an error if any query does a sequential scan.')
+
+    def handle(self, *args, **options):
+        connection = connections[options['database']]
+        if options['username']:
+            try:
+                user = User.objects.get(username=options['username'])
+            except User.DoesNotExist:
+                raise CommandError('No user "%s".' % options['username'])
+        else:
+            user = User(pk=0)
+
+        scanning = []
+        for name, queryset in main_queries(user):
+            lines, scans = explain(connection, queryset.using(
+                options['database']))
+            self.stdout.write(self.style.MIGRATE_HEADING(name))
+            for line in lines:
+                if line in scans:
+                    self.stdout.write(self.style.WARNING('  ' + line))
+                else:
+                    self.stdout.write('  ' + line)
+            if scans:
+                scanning.append(name)
+
+        if scanning:
+            message = 'Sequential scans in: %s' % ', '.join(scanning)
+            if options['fail_on_scan']:
+                raise CommandError(message)
+            self.stdout.write(self.style.WARNING(message))
+        else:
+            self.stdout.write(self.style.SUCCESS('No sequential scans.'))
@@ -0,0 +1,31 @@
+import io
+
+from django.core.management.base import BaseCommand
+
+from catalog.export import DEFAULT_CHUNK_SIZE, FORMATS, export_lines
+
+
+class Command(BaseCommand):
+    help = ('Export every book copy with its book, author, language, '
+            'borrower and due date as CSV or JSON Lines.')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--format', choices=FORMATS, default='csv',
+            help='Output format (default: csv).')
+        parser.add_argument(
+            '--output',
+            help='File to write to (default: standard output).')
+        parser.add_argument(
+            '--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE,
+            help='Copies read per query (default: %d).' % DEFAULT_CHUNK_SIZE)
+
+    def handle(self, *args, **options):
+        lines = export_lines(options['format'], options['chunk_size'])
+        if options['output']:
+            with io.open(options['output'], 'w', encoding='utf-8',
+                         newline='') as output:
+                output.writelines(lines)
+        else:
+            for line in lines:
+                self.stdout.write(line, ending='')
@@ -0,0 +1,12 @@
+from django.core.management.base import BaseCommand
+
+from catalog.visits import flush_visits
+
+
+class Command(BaseCommand):
+    help = ('Save the home page visits buffered in the cache to the '
+            'database. Run periodically so quiet sites keep an exact count.')
+
+    def handle(self, *args, **options):
+        flushed = flush_visits()
+        self.stdout.write(self.style.SUCCESS('%d visits saved.' % flushed))
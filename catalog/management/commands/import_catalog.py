@@ -0,0 +1,59 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from catalog.importer import (CatalogImporter, DEFAULT_BATCH_SIZE, FORMATS,
+                              guess_format, read_rows)
+
+
+class Command(BaseCommand):
+    help = ('Import book copies (with their books, authors, genres and '
+            'languages) from a CSV or JSON Lines file.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='File to import.')
+        parser.add_argument(
+            '--format', choices=FORMATS,
+            help='File format (default: guessed from the extension).')
+        parser.add_argument(
+            '--batch-size', type=int, default=DEFAULT_BATCH_SIZE,
+            help='Rows written per transaction (default: %d).'
+                 % DEFAULT_BATCH_SIZE)
+        parser.add_argument(
+            '--checkpoint',
+            help='File recording progress after each batch '
+                 '(default: PATH.checkpoint).')
+        parser.add_argument(
+            '--resume', action='store_true',
+            help='Skip the rows recorded in the checkpoint file.')
+
+    def handle(self, *args, **options):
+        path = options['path']
+        file_format = options['format'] or guess_format(path)
+        if options['batch_size'] < 1:
+            raise CommandError('--batch-size must be positive.')
+
+        def progress(importer):
+            if self.verbosity > 1:
+                self.stdout.write('%d rows done' % importer.rows_done)
+
+        self.verbosity = options['verbosity']
+        importer = CatalogImporter(
+            batch_size=options['batch_size'],
+            checkpoint=options['checkpoint'] or path + '.checkpoint',
+            progress=progress)
+        try:
+            elapsed = importer.run(read_rows(path, file_format),
+                                   resume=options['resume'])
+        except (IOError, ValueError) as error:
+            raise CommandError('Import failed after row %d: %s' % (
+                importer.rows_done, error))
+
+        for number, error in importer.errors[:20]:
+            self.stderr.write('Row %d skipped: %s' % (number, error))
+        if len(importer.errors) > 20:
+            self.stderr.write('... and %d more rows skipped.' % (
+                len(importer.errors) - 20))
+        self.stdout.write(self.style.SUCCESS(
+            'Imported %d copies in %.1fs (%.0f rows/sec), %d rows skipped.' % (
+                importer.copies_created, elapsed,
+                importer.copies_created / max(elapsed, 1e-6),
+                len(importer.errors))))
@@ -0,0 +1,42 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from catalog.prerender import (CHUNK_SIZE, DEFAULT_LIST_PAGES,
+                               prerender_catalog, prerender_root)
+
+
+class Command(BaseCommand):
+    help = ('Render the anonymous book and author pages and lists to static '
+            'files, re-rendering only the pages changed since the last run.')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--processes', type=int,
+            help='Rendering processes (default: one per CPU).')
+        parser.add_argument(
+            '--full', action='store_true',
+            help='Render every page, changed or not.')
+        parser.add_argument(
+            '--list-pages', type=int, default=DEFAULT_LIST_PAGES,
+            help='Pages prerendered of each list (default: %d).'
+                 % DEFAULT_LIST_PAGES)
+        parser.add_argument(
+            '--chunk-size', type=int, default=CHUNK_SIZE,
+            help='Pages per task sent to a process (default: %d).'
+                 % CHUNK_SIZE)
+
+    def handle(self, *args, **options):
+        if options['processes'] is not None and options['processes'] < 1:
+            raise CommandError('--processes must be positive.')
+        if options['chunk_size'] < 1:
+            raise CommandError('--chunk-size must be positive.')
+        stats = prerender_catalog(
+            processes=options['processes'], full=options['full'],
+            list_pages=options['list_pages'],
+            chunk_size=options['chunk_size'])
+        self.stdout.write(self.style.SUCCESS(
+            'Rendered %d of %d pages in %.1fs (%.0f pages/sec) into %s: '
+            '%d files written, %d unchanged, %d removed.' % (
+                stats['rendered'], stats['pages'], stats['elapsed'],
+                stats['rendered'] / max(stats['elapsed'], 1e-6),
+                prerender_root(), stats['written'],
+                stats['rendered'] - stats['written'], stats['removed'])))
@@ -0,0 +1,33 @@
+import datetime
+
+from django.core.management.base import BaseCommand, CommandError
+
+from catalog.overdue import process_overdue
+
+
+class Command(BaseCommand):
+    help = ('Fine every overdue loan and email each borrower a reminder '
+            'of their overdue books.')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--date',
+            help='Process the loans as of this date, YYYY-MM-DD '
+                 '(default: today).')
+        parser.add_argument(
+            '--no-email', action='store_false', dest='notify',
+            help='Update the fines without sending reminders.')
+
+    def handle(self, *args, **options):
+        today = None
+        if options['date']:
+            try:
+                today = datetime.datetime.strptime(
+                    options['date'], '%Y-%m-%d').date()
+            except ValueError:
+                raise CommandError('--date must be in YYYY-MM-DD format.')
+        fined, borrowers, sent = process_overdue(
+            today=today, notify=options['notify'])
+        self.stdout.write(self.style.SUCCESS(
+            '%d overdue loans fined, %d borrowers, %d reminders sent.' % (
+                fined, borrowers, sent)))
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from catalog.stats import rebuild_catalog_stats
+
+
+class Command(BaseCommand):
+    help = ('Recount the catalog and rebuild the statistics shown on the '
+            'home page. Run periodically to fix any drift.')
+
+    def handle(self, *args, **options):
+        counts = rebuild_catalog_stats()
+        for name in sorted(counts):
+            self.stdout.write('%s: %s' % (name, counts[name]))
+        self.stdout.write(self.style.SUCCESS('Catalog statistics rebuilt.'))
@@ -0,0 +1,21 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from catalog.facets import BATCH_SIZE, rebuild_facets
+
+
+class Command(BaseCommand):
+    help = ('Rebuild the browse facet index and its counts from scratch, '
+            'e.g. once after migrating an existing catalog.')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size', type=int, default=BATCH_SIZE,
+            help='Number of books indexed per transaction.')
+
+    def handle(self, *args, **options):
+        start = time.time()
+        indexed = rebuild_facets(options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(
+            'Indexed %d books in %.1fs.' % (indexed, time.time() - start)))
@@ -0,0 +1,22 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from catalog.search import BATCH_SIZE, rebuild_search_index
+
+
+class Command(BaseCommand):
+    help = ('Rebuild the book search index from scratch. Run '
+            'rebuild_catalog_stats afterwards, as the home page counts '
+            'come partly from the index.')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size', type=int, default=BATCH_SIZE,
+            help='Number of books indexed per transaction.')
+
+    def handle(self, *args, **options):
+        start = time.time()
+        indexed = rebuild_search_index(options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(
+            'Indexed %d books in %.1fs.' % (indexed, time.time() - start)))
@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+
+from catalog.stats import reconcile_book_counters
+
+
+class Command(BaseCommand):
+    help = ('Recount the copies of every book and fix the availability '
+            'counters that drifted.')
+
+    def handle(self, *args, **options):
+        fixed = reconcile_book_counters()
+        self.stdout.write(self.style.SUCCESS(
+            'Book counters reconciled, %d books fixed.' % fixed))
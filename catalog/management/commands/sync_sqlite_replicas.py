@@ -0,0 +1,43 @@
+import os
+import shutil
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS, connections
+
+from catalog.dbbackends.pool import close_pools
+
+
+def sqlite_path(alias):
+    database = settings.DATABASES[alias]
+    if connections[alias].vendor != 'sqlite':
+        raise CommandError('Database "%s" is not SQLite.' % alias)
+    return database['NAME']
+
+
+class Command(BaseCommand):
+    help = ('Copy the primary SQLite database over each SQLite read replica, '
+            'to try the replica routing locally.')
+
+    def handle(self, *args, **options):
+        replicas = getattr(settings, 'CATALOG_REPLICAS', [])
+        if not replicas:
+            raise CommandError('No replicas configured: set '
+                               'DATABASE_REPLICA_URLS.')
+        source = sqlite_path(DEFAULT_DB_ALIAS)
+        # Move the commits still in the write-ahead log into the file
+        with connections[DEFAULT_DB_ALIAS].cursor() as cursor:
+            cursor.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+        for alias in replicas:
+            target = sqlite_path(alias)
+            connections[alias].close()
+            close_pools(alias)
+            # Copy next to the replica and swap it in, so readers never
+            # see half a file
+            shutil.copyfile(source, target + '.tmp')
+            # The replica's log belongs to the file being replaced
+            for suffix in ('-wal', '-shm'):
+                if os.path.exists(target + suffix):
+                    os.remove(target + suffix)
+            os.rename(target + '.tmp', target)
+            self.stdout.write('Copied the primary to %s.' % alias)
@@ -0,0 +1,25 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10 on 2026-10-17 04:02
+from __future__ import unicode_literals
+
+from django.conf import settings
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('catalog', '0005_catalogstatistic'),
+    ]
+
+    operations = [
+        migrations.AlterIndexTogether(
+            name='author',
+            index_together=set([('last_name', 'first_name')]),
+        ),
+        migrations.AlterIndexTogether(
+            name='bookinstance',
+            index_together=set([('borrower', 'status', 'due_back', 'id'), ('status', 'due_back', 'id')]),
+        ),
+    ]
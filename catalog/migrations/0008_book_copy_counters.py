@@ -0,0 +1,64 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10 on 2026-10-17 04:19
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+from django.db.models import Count
+
+
+STATUS_COUNTERS = {
+    'a': 'copies_available',
+    'o': 'copies_on_loan',
+    'r': 'copies_reserved',
+    'd': 'copies_maintenance',
+}
+
+
+def count_copies(apps, schema_editor):
+    Book = apps.get_model('catalog', 'Book')
+    BookInstance = apps.get_model('catalog', 'BookInstance')
+    counters = {}
+    for row in BookInstance.objects.exclude(book=None).values(
+            'book', 'status').annotate(copies=Count('id')).order_by():
+        book_counters = counters.setdefault(row['book'], {'copies_total': 0})
+        book_counters['copies_total'] += row['copies']
+        if row['status'] in STATUS_COUNTERS:
+            book_counters[STATUS_COUNTERS[row['status']]] = row['copies']
+    for pk, book_counters in counters.items():
+        Book.objects.filter(pk=pk).update(**book_counters)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('catalog', '0007_booksearchterm'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='book',
+            name='copies_available',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='book',
+            name='copies_maintenance',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='book',
+            name='copies_on_loan',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='book',
+            name='copies_reserved',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='book',
+            name='copies_total',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(count_copies, migrations.RunPython.noop),
+    ]
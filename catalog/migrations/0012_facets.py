@@ -0,0 +1,65 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10 on 2026-10-17 05:03
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('catalog', '0011_hold'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BookFacet',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('facet', models.CharField(choices=[('g', 'Genre'), ('l', 'Language'), ('a', 'Author'), ('v', 'Availability')], max_length=1)),
+                ('value', models.PositiveIntegerField()),
+                ('book', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='catalog.Book')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='FacetCount',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('facet', models.CharField(choices=[('g', 'Genre'), ('l', 'Language'), ('a', 'Author'), ('v', 'Availability')], max_length=1)),
+                ('value', models.PositiveIntegerField()),
+                ('count', models.IntegerField(default=0)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='FacetPairCount',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('facet', models.CharField(choices=[('g', 'Genre'), ('l', 'Language'), ('a', 'Author'), ('v', 'Availability')], max_length=1)),
+                ('value', models.PositiveIntegerField()),
+                ('other_facet', models.CharField(choices=[('g', 'Genre'), ('l', 'Language'), ('a', 'Author'), ('v', 'Availability')], max_length=1)),
+                ('other_value', models.PositiveIntegerField()),
+                ('count', models.IntegerField(default=0)),
+            ],
+        ),
+        migrations.AlterUniqueTogether(
+            name='facetpaircount',
+            unique_together=set([('facet', 'value', 'other_facet', 'other_value')]),
+        ),
+        migrations.AlterIndexTogether(
+            name='facetpaircount',
+            index_together=set([('facet', 'value', 'other_facet', 'count')]),
+        ),
+        migrations.AlterUniqueTogether(
+            name='facetcount',
+            unique_together=set([('facet', 'value')]),
+        ),
+        migrations.AlterIndexTogether(
+            name='facetcount',
+            index_together=set([('facet', 'count')]),
+        ),
+        migrations.AlterUniqueTogether(
+            name='bookfacet',
+            unique_together=set([('facet', 'value', 'book')]),
+        ),
+    ]
@@ -0,0 +1,19 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10 on 2026-10-17 05:52
+from __future__ import unicode_literals
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('catalog', '0013_book_counters_signed'),
+    ]
+
+    operations = [
+        migrations.AlterIndexTogether(
+            name='book',
+            index_together=set([('title', 'id')]),
+        ),
+    ]
@@ -6,6 +6,7 @@ import uuid
 
 from django.contrib.auth.models import User
 from django.db import models
+from django.utils import timezone
 # Used to generate URLs by reverseing the URL patterns
 from django.urls import reverse
 
@@ -71,25 +72,110 @@ class Book(models.Model):
     # ManyToManyField used because genere can contain many books. Books can cover many generes.
     # Generes class has already been defined so we can specify the object above.
 
+    # Number of copies in each state, maintained from BookInstance changes
+    # (see catalog.stats) so pages can show availability without counting.
+    # Not PositiveIntegerFields: bulk writes skipping the signals can make
+    # them drift below zero until `manage.py reconcile_book_counters` runs,
+    # and a CHECK (>= 0) would fail the ordinary save that follows.
+    copies_total = models.IntegerField(default=0, editable=False)
+    copies_available = models.IntegerField(default=0, editable=False)
+    copies_on_loan = models.IntegerField(default=0, editable=False)
+    copies_reserved = models.IntegerField(default=0, editable=False)
+    copies_maintenance = models.IntegerField(default=0, editable=False)
+
+    COPY_COUNTERS = ('copies_total', 'copies_available', 'copies_on_loan',
+                     'copies_reserved', 'copies_maintenance')
+
+    class Meta:
+        # Book lists are paged by (title, id) (see catalog.pagination)
+        index_together = [('title', 'id')]
+
     def __str__(self):
         return self.title
 
+    def save(self, *args, **kwargs):
+        # The copy counters only change through F() updates; never write
+        # the (possibly stale) values loaded with the book back over them.
+        if not self._state.adding and not kwargs.get('update_fields'):
+            kwargs['update_fields'] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key and
+                field.name not in self.COPY_COUNTERS]
+        super(Book, self).save(*args, **kwargs)
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super(Book, cls).from_db(db, field_names, values)
+        # Remember the values as loaded so signal handlers can tell
+        # what changed when the book is saved again.
+        instance._loaded_values = dict(zip(field_names, values))
+        return instance
+
     def get_absolute_url(self):
         """
         Returns the url to access a particular book instance
         """
         return reverse('book-detail', args=[str(self.id)])
 
+    def copies(self):
+        """
+        The copies of the book (their language names come from
+        catalog.dimensions). Queried lazily by the template, only when its
+        cached copies fragment has expired.
+        """
+        return self.bookinstance_set.all()
+
+    def genre_names(self):
+        """
+        The names of the book's genres, from the genre cache (see
+        catalog.dimensions): only the links to them are queried, unless
+        attach_genre_ids() or prefetch_related('genre') loaded them.
+        """
+        from .dimensions import genres
+
+        prefetched = getattr(self, '_prefetched_objects_cache', {})
+        if 'genre' in prefetched:
+            return [genre.name for genre in prefetched['genre']]
+        genre_ids = getattr(self, '_genre_ids', None)
+        if genre_ids is None:
+            genre_ids = self._genre_ids = sorted(
+                Book.genre.through.objects.filter(book_id=self.pk)
+                .values_list('genre_id', flat=True))
+        names = genres.names(genre_ids)
+        return [names[pk] for pk in genre_ids if pk in names]
+
     def display_genre(self):
         """
         Creates a string for the Genre.
         This is required to display genre in Admin.
         """
-        return ', '.join(genre.name for genre in self.genre.all()[:3])
+        # The admin loads the genre ids of the whole page in one query
+        return ', '.join(self.genre_names()[:3])
 
     display_genre.short_description = 'Genre'
 
 
+class BookInstanceQuerySet(models.QuerySet):
+
+    def overdue(self, today=None):
+        """
+        Loans past their due date.
+        """
+        return self.filter(status__exact='o',
+                           due_back__lt=today or date.today())
+
+    def with_overdue(self, today=None):
+        """
+        Annotate each copy with `overdue`, computed by the database rather
+        than per row while rendering.
+        """
+        return self.annotate(overdue=models.Case(
+            models.When(status__exact='o', due_back__lt=today or date.today(),
+                        then=models.Value(True)),
+            default=models.Value(False),
+            output_field=models.BooleanField()))
+
+
 class BookInstance(models.Model):
     """
     Model representing a specific copy of a book
@@ -108,7 +194,8 @@ class BookInstance(models.Model):
         null=True)
 
     imprint = models.CharField(max_length=200)
-    due_back = models.DateField(null=True, blank=True)
+    # Indexed for the admin's date filter and default ordering
+    due_back = models.DateField(null=True, blank=True, db_index=True)
 
     LOAN_STATUS = (
         ('d', 'Maintanace'),
@@ -129,9 +216,21 @@ class BookInstance(models.Model):
         blank=True
     )
 
+    # Set on overdue loans by `manage.py process_overdue`
+    fine = models.DecimalField(max_digits=8, decimal_places=2, default=0)
+    overdue_notified = models.DateField(null=True, blank=True, editable=False)
+
+    objects = BookInstanceQuerySet.as_manager()
+
     class Meta:
         ordering = ['due_back']
         permissions = (("can_mark_returned", "Set book as returned"),)
+        # Loan queries filter on status (and the borrower for 'My books')
+        # and page through loans by (due_back, id)
+        index_together = [
+            ('status', 'due_back', 'id'),
+            ('borrower', 'status', 'due_back', 'id'),
+        ]
 
     def __str__(self):
         '''
@@ -139,11 +238,63 @@ class BookInstance(models.Model):
         '''
         return '%s (%s)' % (self.id, self.book.title)
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super(BookInstance, cls).from_db(db, field_names, values)
+        # Remember the values as loaded so signal handlers can tell
+        # which way a copy moved (e.g. from 'On loan' to 'Available').
+        instance._loaded_values = dict(zip(field_names, values))
+        return instance
+
+    @property
+    def language_name(self):
+        """
+        The name of the copy's language, from the language cache (see
+        catalog.dimensions) rather than a join or a query per copy.
+        """
+        from .dimensions import languages
+
+        return languages.name(self.language_id)
+
     @property
     def is_overdue(self):
-        if date.today() > self.due_back:
-            return True
-        return False
+        # Copies not on loan have no due date
+        if self.due_back is None:
+            return False
+        return date.today() > self.due_back
+
+
+class Hold(models.Model):
+    """
+    Model representing a patron's place in the queue for a book: they
+    get the first copy coming back after the holds placed before theirs.
+    """
+    book = models.ForeignKey('Book', on_delete=models.CASCADE)
+    borrower = models.ForeignKey(User, on_delete=models.CASCADE)
+    placed = models.DateTimeField(default=timezone.now)
+
+    HOLD_STATUS = (
+        ('w', 'Waiting'),
+        ('f', 'Fulfilled'),
+        ('c', 'Cancelled'),
+    )
+
+    status = models.CharField(max_length=1, choices=HOLD_STATUS,
+                              default='w')
+
+    # The copy reserved for the patron, once the hold is fulfilled
+    copy = models.ForeignKey('BookInstance', on_delete=models.SET_NULL,
+                             null=True, blank=True)
+    fulfilled = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ['placed', 'id']
+        # The queue of a book: its waiting holds, oldest first
+        index_together = [('book', 'status', 'placed', 'id')]
+
+    def __str__(self):
+        return '%s for %s (%s)' % (self.book_id, self.borrower_id,
+                                   self.get_status_display())
 
 
 class Author(models.Model):
@@ -155,6 +306,10 @@ class Author(models.Model):
     date_of_birth = models.DateField(null=True, blank=True)
     date_of_death = models.DateField('Died', null=True, blank=True)
 
+    class Meta:
+        # Authors are listed and paged by name
+        index_together = [('last_name', 'first_name')]
+
     def get_absolute_url(self):
         """
         Returns the url to access a particular author instance
@@ -167,3 +322,124 @@ class Author(models.Model):
         """
 
         return '%s, %s' % (self.last_name, self.first_name)
+
+
+class CatalogStatistic(models.Model):
+    """
+    Model representing a materialized catalog counter (e.g. number of books)
+    so the home page does not have to count whole tables on every hit.
+    """
+    name = models.CharField(max_length=50, unique=True)
+    value = models.IntegerField(default=0)
+
+    def __str__(self):
+        """
+        String for representing the Model object.
+        """
+        return '%s: %s' % (self.name, self.value)
+
+
+class BookSearchTerm(models.Model):
+    """
+    Model representing an entry of the book search index (an inverted
+    index): a term found in one part of a book, weighted for ranking.
+    """
+    SOURCES = (
+        ('t', 'Title'),
+        ('a', 'Author'),
+        ('g', 'Genre'),
+        ('s', 'Summary'),
+    )
+
+    term = models.CharField(max_length=50)
+    book = models.ForeignKey('Book', on_delete=models.CASCADE)
+    source = models.CharField(max_length=1, choices=SOURCES)
+    weight = models.PositiveIntegerField()
+
+    class Meta:
+        # Leading with the term makes this the index searches look up
+        unique_together = ('term', 'source', 'book')
+
+    def __str__(self):
+        """
+        String for representing the Model object.
+        """
+        return '%s (%s)' % (self.term, self.get_source_display())
+
+
+class BookFacet(models.Model):
+    """
+    Model representing an entry of the browse facet index: a book has
+    a value (a genre, language or author id, or 1 if a copy is
+    available) of a facet.
+    """
+    FACETS = (
+        ('g', 'Genre'),
+        ('l', 'Language'),
+        ('a', 'Author'),
+        ('v', 'Availability'),
+    )
+
+    facet = models.CharField(max_length=1, choices=FACETS)
+    value = models.PositiveIntegerField()
+    book = models.ForeignKey('Book', on_delete=models.CASCADE)
+
+    class Meta:
+        # Leading with the facet value makes this the index filters
+        # look up the books of
+        unique_together = ('facet', 'value', 'book')
+
+    def __str__(self):
+        """
+        String for representing the Model object.
+        """
+        return '%s %s: %s' % (self.get_facet_display(), self.value,
+                              self.book_id)
+
+
+class FacetCount(models.Model):
+    """
+    Model representing the number of books having a facet value, so the
+    unfiltered browse page does not count the facet index.
+    """
+    facet = models.CharField(max_length=1, choices=BookFacet.FACETS)
+    value = models.PositiveIntegerField()
+    count = models.IntegerField(default=0)
+
+    class Meta:
+        unique_together = ('facet', 'value')
+        # The most common authors are listed first
+        index_together = [('facet', 'count')]
+
+    def __str__(self):
+        """
+        String for representing the Model object.
+        """
+        return '%s %s: %s' % (self.get_facet_display(), self.value,
+                              self.count)
+
+
+class FacetPairCount(models.Model):
+    """
+    Model representing the number of books having both a genre, language
+    or availability value and another facet value, so filtering on one
+    value does not count the facet index either.
+    """
+    facet = models.CharField(max_length=1, choices=BookFacet.FACETS)
+    value = models.PositiveIntegerField()
+    other_facet = models.CharField(max_length=1, choices=BookFacet.FACETS)
+    other_value = models.PositiveIntegerField()
+    count = models.IntegerField(default=0)
+
+    class Meta:
+        unique_together = ('facet', 'value', 'other_facet', 'other_value')
+        # The most common authors of a genre are listed first
+        index_together = [('facet', 'value', 'other_facet', 'count')]
+
+    def __str__(self):
+        """
+        String for representing the Model object.
+        """
+        return '%s %s and %s %s: %s' % (
+            self.get_facet_display(), self.value,
+            self.get_other_facet_display(), self.other_value, self.count)
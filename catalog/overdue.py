@@ -0,0 +1,154 @@
+"""
+Batch processing of overdue loans.
+
+`manage.py process_overdue` (run daily, e.g. from cron) finds every loan
+past its due date in one query on the (status, due_back, id) index, sets
+their fines with one UPDATE per distinct due date, and emails each
+borrower a single reminder listing all their overdue books. The emails
+are sent over one connection to the mail backend, rather than opening a
+connection per message, and the loans of those sent are marked notified
+in batches.
+"""
+from collections import OrderedDict
+from datetime import date, timedelta
+from decimal import Decimal
+
+from django.core.mail import EmailMessage, get_connection
+from django.db import transaction
+from django.template.loader import render_to_string
+
+from .models import BookInstance
+
+# Fine charged for each day a loan is overdue
+FINE_PER_DAY = Decimal('0.20')
+
+# Borrowers are reminded again after this long
+REMINDER_INTERVAL = timedelta(days=7)
+
+# Messages sent between the updates marking their loans notified
+EMAIL_BATCH_SIZE = 100
+
+# Keys per IN (...) lookup, below SQLite's limit on query parameters
+UPDATE_CHUNK_SIZE = 500
+
+
+def chunked(items, size):
+    items = list(items)
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+def fine_for(due_back, today):
+    return FINE_PER_DAY * (today - due_back).days
+
+
+def find_overdue(today):
+    """
+    Return the overdue loans grouped by borrower:
+    {borrower id: {'email', 'name', 'loans': [loan dicts]}}, in due date order.
+    """
+    borrowers = OrderedDict()
+    loans = BookInstance.objects.overdue(today).exclude(borrower=None).order_by(
+        'due_back', 'id').values_list(
+        'id', 'due_back', 'overdue_notified', 'book__title', 'borrower_id',
+        'borrower__email', 'borrower__first_name', 'borrower__username')
+    for (pk, due_back, notified, title, borrower_id, email, first_name,
+         username) in loans:
+        borrower = borrowers.setdefault(borrower_id, {
+            'email': email,
+            'name': first_name or username,
+            'loans': [],
+        })
+        borrower['loans'].append({
+            'id': pk,
+            'title': title,
+            'due_back': due_back,
+            'notified': notified,
+            'fine': fine_for(due_back, today),
+        })
+    return borrowers
+
+
+def update_fines(today):
+    """
+    Set the fine of every overdue loan; loans due the same day owe the
+    same fine, so this is one UPDATE per distinct due date.
+    Returns the number of loans fined.
+    """
+    overdue = BookInstance.objects.overdue(today)
+    due_dates = overdue.order_by('due_back').values_list(
+        'due_back', flat=True).distinct()
+    fined = 0
+    with transaction.atomic():
+        for due_back in list(due_dates):
+            fined += overdue.filter(due_back=due_back).update(
+                fine=fine_for(due_back, today))
+    return fined
+
+
+def needs_reminder(borrower, today):
+    """
+    Whether a borrower has a loan not reminded of in REMINDER_INTERVAL.
+    """
+    return bool(borrower['email']) and any(
+        loan['notified'] is None or
+        loan['notified'] <= today - REMINDER_INTERVAL
+        for loan in borrower['loans'])
+
+
+def reminder_message(borrower, today):
+    context = dict(borrower, today=today,
+                   total_fine=sum(loan['fine'] for loan in borrower['loans']))
+    return EmailMessage(
+        subject='Overdue library books',
+        body=render_to_string('catalog/overdue_reminder.txt', context),
+        to=[borrower['email']])
+
+
+def send_reminders(borrowers, today, batch_size=EMAIL_BATCH_SIZE,
+                   connection=None):
+    """
+    Email each borrower due a reminder, over a single connection, and
+    record the loans of the emails sent as notified today. Returns the
+    number of emails sent.
+    """
+    due = [borrower for borrower in borrowers.values()
+           if needs_reminder(borrower, today)]
+    if not due:
+        return 0
+    connection = connection or get_connection()
+    sent = 0
+    connection.open()
+    try:
+        for batch in chunked(due, batch_size):
+            pks = []
+            try:
+                # One message at a time, so a failure leaves the other
+                # borrowers to be reminded next run
+                for borrower in batch:
+                    if connection.send_messages(
+                            [reminder_message(borrower, today)]):
+                        sent += 1
+                        pks.extend(loan['id'] for loan in borrower['loans'])
+            finally:
+                # Only what actually went out is recorded as notified
+                for chunk in chunked(pks, UPDATE_CHUNK_SIZE):
+                    BookInstance.objects.filter(pk__in=chunk).update(
+                        overdue_notified=today)
+    finally:
+        connection.close()
+    return sent
+
+
+def process_overdue(today=None, notify=True, connection=None):
+    """
+    Fine every overdue loan and remind their borrowers.
+    Returns (loans fined, borrowers with overdue loans, emails sent).
+    """
+    today = today or date.today()
+    fined = update_fines(today)
+    borrowers = find_overdue(today)
+    sent = 0
+    if notify:
+        sent = send_reminders(borrowers, today, connection=connection)
+    return fined, len(borrowers), sent
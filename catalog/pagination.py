@@ -0,0 +1,244 @@
+"""
+Keyset (a.k.a. seek or cursor) pagination for catalog list views.
+
+Offset pagination needs a COUNT(*) of the whole listing and an OFFSET that
+makes the database walk past every earlier row, so deep pages get slower
+and slower. Keyset pagination instead remembers the ordering key of the
+last row shown and asks for the rows after it, which an index on that key
+answers directly. The price is that there are no page numbers: pages only
+link to their neighbours through opaque cursors.
+
+Where page numbers are wanted over huge tables (the admin changelists),
+EstimatedCountPaginator avoids counting every row on each page load.
+"""
+import hashlib
+
+from django.core import signing
+from django.core.paginator import Paginator
+from django.db import connections
+from django.db.models import Q
+from django.http import Http404
+from django.utils.functional import cached_property
+
+from .caching import get_cache
+
+CURSOR_SALT = 'catalog.pagination.cursor'
+
+
+class InvalidCursor(Exception):
+    pass
+
+
+class KeysetPage(object):
+    """
+    A page of objects with cursors pointing to the neighbouring pages.
+    Offers the parts of django.core.paginator.Page that make sense
+    without a total count.
+    """
+
+    def __init__(self, object_list, paginator, next_cursor=None,
+                 previous_cursor=None):
+        self.object_list = object_list
+        self.paginator = paginator
+        self.next_cursor = next_cursor
+        self.previous_cursor = previous_cursor
+
+    def __repr__(self):
+        return '<Keyset page of %d objects>' % len(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __getitem__(self, index):
+        return self.object_list[index]
+
+    def has_next(self):
+        return self.next_cursor is not None
+
+    def has_previous(self):
+        return self.previous_cursor is not None
+
+    def has_other_pages(self):
+        return self.has_next() or self.has_previous()
+
+
+class KeysetPaginator(object):
+    """
+    Paginates a queryset (of objects or of .values() rows) on a unique,
+    ascending ordering key such as ('due_back', 'id'). The last field
+    should be the primary key so the ordering is total and no row is
+    skipped or repeated between pages.
+    """
+    # Lets templates tell keyset pages apart from numbered ones
+    is_keyset = True
+
+    def __init__(self, queryset, per_page, ordering):
+        self.queryset = queryset
+        self.per_page = int(per_page)
+        self.ordering = tuple(ordering)
+        self.fields = [queryset.model._meta.get_field(name)
+                       for name in self.ordering]
+
+    def encode_cursor(self, obj, forward):
+        if isinstance(obj, dict):
+            # A row from .values()
+            key = [obj[field.attname] for field in self.fields]
+        else:
+            key = [getattr(obj, field.attname) for field in self.fields]
+        key = [field.get_prep_value(value)
+               for field, value in zip(self.fields, key)]
+        # Dates, UUIDs etc. are stored in their string form
+        key = [value if value is None or isinstance(value, (int, float))
+               else str(value) for value in key]
+        return signing.dumps({'k': key, 'f': forward}, salt=CURSOR_SALT)
+
+    def decode_cursor(self, cursor):
+        try:
+            data = signing.loads(cursor, salt=CURSOR_SALT)
+            key = data['k']
+            forward = bool(data['f'])
+            if len(key) != len(self.fields):
+                raise ValueError
+            key = [None if value is None else field.to_python(value)
+                   for field, value in zip(self.fields, key)]
+        except (signing.BadSignature, KeyError, TypeError, ValueError):
+            raise InvalidCursor('Invalid cursor')
+        return key, forward
+
+    def beyond(self, key, forward):
+        """
+        Build a filter matching the rows sorting after (forward) or
+        before the given key.
+        """
+        nulls_largest = connections[self.queryset.db].features.nulls_order_largest
+        condition = Q(pk__in=[])
+        equal = Q()
+        for field, value in zip(self.ordering, key):
+            condition |= equal & self._compare(
+                field, value, forward, nulls_largest)
+            if value is None:
+                equal &= Q(**{field + '__isnull': True})
+            else:
+                equal &= Q(**{field: value})
+        return condition
+
+    def _compare(self, field, value, forward, nulls_largest):
+        # Where NULL sorts depends on the database, so a nullable key
+        # column needs its NULLs placed on the right side of the cursor.
+        nulls_after = nulls_largest == forward
+        if value is None:
+            if nulls_after:
+                return Q(pk__in=[])
+            return Q(**{field + '__isnull': False})
+        lookup = '__gt' if forward else '__lt'
+        condition = Q(**{field + lookup: value})
+        if nulls_after:
+            condition |= Q(**{field + '__isnull': True})
+        return condition
+
+    def page(self, cursor=None):
+        """
+        Return the page following (or preceding) the position recorded
+        in cursor, or the first page when there is no cursor.
+        """
+        queryset = self.queryset
+        forward = True
+        if cursor:
+            key, forward = self.decode_cursor(cursor)
+            queryset = queryset.filter(self.beyond(key, forward))
+
+        if forward:
+            queryset = queryset.order_by(*self.ordering)
+        else:
+            queryset = queryset.order_by(
+                *['-' + name for name in self.ordering])
+
+        # Fetch one extra row to learn whether there is another page
+        object_list = list(queryset[:self.per_page + 1])
+        has_more = len(object_list) > self.per_page
+        object_list = object_list[:self.per_page]
+        if not forward:
+            object_list.reverse()
+
+        next_cursor = previous_cursor = None
+        if object_list:
+            if has_more or not forward:
+                next_cursor = self.encode_cursor(object_list[-1], True)
+            if cursor and (has_more or forward):
+                previous_cursor = self.encode_cursor(object_list[0], False)
+        return KeysetPage(object_list, self, next_cursor, previous_cursor)
+
+
+class KeysetPaginationMixin(object):
+    """
+    Mixin for ListViews adding an opt-in keyset pagination mode.
+
+    keyset_pagination -- set to True to page with cursors
+    keyset_ordering -- the unique ordering the cursors follow
+    """
+    keyset_pagination = False
+    keyset_ordering = None
+    cursor_kwarg = 'cursor'
+
+    def paginate_queryset(self, queryset, page_size):
+        if not self.keyset_pagination:
+            return super(KeysetPaginationMixin, self).paginate_queryset(
+                queryset, page_size)
+        paginator = KeysetPaginator(queryset, page_size, self.keyset_ordering)
+        try:
+            page = paginator.page(self.request.GET.get(self.cursor_kwarg))
+        except InvalidCursor:
+            raise Http404('Invalid page cursor.')
+        return (paginator, page, page.object_list, page.has_other_pages())
+
+
+class EstimatedCountPaginator(Paginator):
+    """
+    Paginator that does not COUNT(*) big tables on every page.
+
+    An unfiltered listing on PostgreSQL uses the planner's row estimate
+    (pg_class.reltuples, refreshed by VACUUM and ANALYZE). Otherwise the
+    exact count is used, but counts above LARGE_COUNT are cached for
+    COUNT_TIMEOUT seconds, so browsing a big listing counts it once.
+    Small counts are always exact.
+    """
+    LARGE_COUNT = 10000
+    COUNT_TIMEOUT = 60
+
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        if not hasattr(queryset, 'query'):
+            return super(EstimatedCountPaginator, self).count
+        estimate = self.estimate(queryset)
+        if estimate is not None and estimate >= self.LARGE_COUNT:
+            return estimate
+
+        sql, params = queryset.query.sql_with_params()
+        key = 'catalog:count:%s' % hashlib.md5(
+            ('%s|%s|%r' % (queryset.db, sql, params)).encode('utf-8')
+        ).hexdigest()
+        cache = get_cache()
+        count = cache.get(key)
+        if count is None:
+            count = queryset.count()
+            if count >= self.LARGE_COUNT:
+                cache.set(key, count, self.COUNT_TIMEOUT)
+        return count
+
+    def estimate(self, queryset):
+        """
+        The planner's estimate of the rows of an unfiltered queryset's
+        table, or None if there is none to be had.
+        """
+        connection = connections[queryset.db]
+        if connection.vendor != 'postgresql' or queryset.query.where:
+            return None
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT reltuples FROM pg_class WHERE relname = %s',
+                           [queryset.model._meta.db_table])
+            row = cursor.fetchone()
+        return int(row[0]) if row else None
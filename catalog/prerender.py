@@ -0,0 +1,313 @@
+"""
+Static HTML copies of the public catalog pages, for anonymous visitors.
+
+`manage.py prerender_catalog` renders the anonymous version of every book
+and author page and of the book and author lists into
+settings.CATALOG_PRERENDER_ROOT, one file per page, e.g.
+
+    /catalog/book/3         catalog/book/3.html
+    /catalog/books/         catalog/books/index.html
+    /catalog/books/?page=2  catalog/books/index-2.html
+
+with a gzipped copy next to each. PrerenderedPages (see
+locallibrary/wsgi.py) serves them with whitenoise, before Django sees the
+request.
+
+A page depends on the same versions as in the page cache (see
+catalog.caching), and each file's modification time is set to when its
+rendering started. So a file is current when none of its page's versions
+changed after its modification time. Stale files are never served:
+PrerenderedPages checks the versions with one cache read and hands stale
+pages to Django. The next run of the command re-renders only the stale
+pages, and only rewrites the files whose content changed.
+
+The versions must live in a cache shared with the web workers (see
+catalog.caching). With the local-memory cache, every run of the command
+finds every version changed and renders everything.
+"""
+from concurrent.futures import ProcessPoolExecutor
+import gzip
+import os
+import re
+import time
+
+from django.conf import settings
+from django.contrib.auth.models import AnonymousUser
+from django.core.urlresolvers import Resolver404, resolve, reverse
+from django.db import connections
+from django.http import Http404, parse_cookie
+from django.test import RequestFactory
+from whitenoise.base import WhiteNoise
+from whitenoise.utils import MissingFileError, decode_path_info
+
+from .caching import get_modified
+from .dbbackends.pool import close_pools
+from .models import Author, Book
+from .views import (AuthorDetailView, AuthorListView, BookDetailView,
+                    BookListView)
+
+# The views whose pages are prerendered
+PRERENDERED_VIEWS = (BookListView, BookDetailView, AuthorListView,
+                     AuthorDetailView)
+
+# Offset pages get slower the deeper they are, so only the first ones
+# of each list are prerendered; Django serves the rest
+DEFAULT_LIST_PAGES = 100
+
+# Pages per task sent to a rendering process
+CHUNK_SIZE = 200
+
+# Pages whose freshness is checked with one cache read
+CHECK_CHUNK_SIZE = 1000
+
+SAFE_PATH_RE = re.compile(r'^/[\w/-]*$')
+PAGE_QUERY_RE = re.compile(r'^page=([1-9]\d*)$')
+
+
+def prerender_root():
+    return getattr(settings, 'CATALOG_PRERENDER_ROOT',
+                   os.path.join(settings.BASE_DIR, 'prerendered'))
+
+
+def page_file(root, path, query=''):
+    """
+    The file holding the page at path (and query string), or None if
+    such a page cannot have one.
+    """
+    if not SAFE_PATH_RE.match(path) or '//' in path:
+        return None
+    suffix = ''
+    if query:
+        match = PAGE_QUERY_RE.match(query)
+        if match is None:
+            return None
+        if match.group(1) != '1':
+            suffix = '-' + match.group(1)
+    if path.endswith('/'):
+        path += 'index'
+    return os.path.join(root, path[1:] + suffix + '.html')
+
+
+def page_version_names(path):
+    """
+    The versions the page at path depends on, or None if it is not a
+    prerendered page.
+    """
+    try:
+        match = resolve(path)
+    except Resolver404:
+        return None
+    view_class = getattr(match.func, 'view_class', None)
+    if view_class not in PRERENDERED_VIEWS:
+        return None
+    view = view_class()
+    view.args = match.args
+    view.kwargs = match.kwargs
+    return view.get_cache_names()
+
+
+def catalog_pages(list_pages=DEFAULT_LIST_PAGES):
+    """
+    The (path, query string) of every page to prerender.
+    """
+    pages = []
+    for view_class, url_name, model in ((BookListView, 'books', Book),
+                                        (AuthorListView, 'authors', Author)):
+        path = reverse(url_name)
+        count = model.objects.count()
+        pages.append((path, ''))
+        last = min((count - 1) // view_class.paginate_by + 1, list_pages)
+        pages.extend((path, 'page=%d' % number)
+                     for number in range(2, last + 1))
+    for url_name, model in (('book-detail', Book), ('author-detail', Author)):
+        pages.extend((reverse(url_name, args=[pk]), '') for pk in
+                     model.objects.order_by('pk').values_list(
+                         'pk', flat=True).iterator())
+    return pages
+
+
+def stale_pages(root, pages):
+    """
+    The pages whose file is missing or older than the last change of one
+    of their versions.
+    """
+    stale = []
+    for start in range(0, len(pages), CHECK_CHUNK_SIZE):
+        chunk = pages[start:start + CHECK_CHUNK_SIZE]
+        names = dict((path, page_version_names(path))
+                     for path, query in chunk)
+        modified = get_modified(set(
+            name for page_names in names.values() for name in page_names))
+        for path, query in chunk:
+            try:
+                rendered = os.stat(page_file(root, path, query)).st_mtime
+            except OSError:
+                rendered = None
+            if rendered is None or any(modified[name] > rendered
+                                       for name in names[path]):
+                stale.append((path, query))
+    return stale
+
+
+def render_page(path, query=''):
+    """
+    Render the page as an anonymous visitor gets it; returns the response.
+    """
+    request = RequestFactory().get(path + ('?' + query if query else ''))
+    request.user = AnonymousUser()
+    match = resolve(path)
+    response = match.func(request, *match.args, **match.kwargs)
+    if hasattr(response, 'render'):
+        response.render()
+    return response
+
+
+def write_file(filename, content, mtime):
+    """
+    Atomically replace filename with content, dated mtime.
+    """
+    temporary = filename + '.tmp'
+    with open(temporary, 'wb') as output:
+        output.write(content)
+    os.utime(temporary, (mtime, mtime))
+    os.rename(temporary, filename)
+
+
+def render_pages(root, pages):
+    """
+    Render pages into root, writing only the files whose content changed.
+    Returns (pages rendered, files written, pages gone).
+    """
+    rendered = written = gone = 0
+    for path, query in pages:
+        filename = page_file(root, path, query)
+        # Changes made from now on may be missing from the page
+        started = time.time()
+        try:
+            response = render_page(path, query)
+        except Http404:
+            response = None
+        if response is None or response.status_code != 200:
+            # E.g. a book deleted since the pages were listed
+            remove_file(filename)
+            gone += 1
+            continue
+        rendered += 1
+        try:
+            with open(filename, 'rb') as existing:
+                changed = (existing.read() != response.content or
+                           not os.path.exists(filename + '.gz'))
+        except (IOError, OSError):
+            changed = True
+        if changed:
+            os.makedirs(os.path.dirname(filename), exist_ok=True)
+            # Whitenoise serves the gzipped copy to clients accepting it
+            write_file(filename + '.gz', gzip.compress(response.content, 9),
+                       started)
+            write_file(filename, response.content, started)
+            written += 1
+        else:
+            os.utime(filename + '.gz', (started, started))
+            os.utime(filename, (started, started))
+    return rendered, written, gone
+
+
+def remove_file(filename):
+    for name in (filename, filename + '.gz'):
+        try:
+            os.remove(name)
+        except OSError:
+            pass
+
+
+def remove_other_files(root, pages):
+    """
+    Delete the files of pages that no longer exist (e.g. of deleted
+    books). Returns the number of pages removed.
+    """
+    keep = set(page_file(root, path, query) for path, query in pages)
+    removed = 0
+    for directory, _, filenames in os.walk(root):
+        for name in filenames:
+            filename = os.path.join(directory, name)
+            if name.endswith('.html') and filename not in keep:
+                remove_file(filename)
+                removed += 1
+    return removed
+
+
+def prerender_catalog(processes=None, full=False,
+                      list_pages=DEFAULT_LIST_PAGES, chunk_size=CHUNK_SIZE,
+                      root=None):
+    """
+    Bring the prerendered pages up to date, rendering the stale ones (or
+    all of them) across processes. Returns a dict of counts.
+    """
+    root = root or prerender_root()
+    pages = catalog_pages(list_pages)
+    stats = {'pages': len(pages),
+             'removed': remove_other_files(root, pages)}
+    if not full:
+        pages = stale_pages(root, pages)
+    chunks = [pages[start:start + chunk_size]
+              for start in range(0, len(pages), chunk_size)]
+
+    start = time.time()
+    if processes == 1:
+        results = [render_pages(root, chunk) for chunk in chunks]
+    else:
+        # Forked processes must not share the parent's connections
+        connections.close_all()
+        close_pools()
+        with ProcessPoolExecutor(processes) as pool:
+            results = list(pool.map(render_pages, [root] * len(chunks),
+                                    chunks))
+    stats['elapsed'] = time.time() - start
+    stats['rendered'] = sum(result[0] for result in results)
+    stats['written'] = sum(result[1] for result in results)
+    stats['removed'] += sum(result[2] for result in results)
+    return stats
+
+
+class PrerenderedPages(WhiteNoise):
+    """
+    WSGI middleware serving the prerendered pages to anonymous visitors,
+    when they are current.
+    """
+    # Pages change: browsers must revalidate (with If-Modified-Since)
+    max_age = 0
+
+    def __init__(self, application, root=None):
+        super(PrerenderedPages, self).__init__(application)
+        self.root = root or prerender_root()
+
+    def __call__(self, environ, start_response):
+        page = None
+        if environ['REQUEST_METHOD'] in ('GET', 'HEAD'):
+            page = self.find_page(environ)
+        if page is None:
+            return self.application(environ, start_response)
+        return self.serve(page, environ, start_response)
+
+    def find_page(self, environ):
+        # Logged in users see their name on every page
+        cookies = parse_cookie(environ.get('HTTP_COOKIE', ''))
+        if settings.SESSION_COOKIE_NAME in cookies:
+            return None
+        path = decode_path_info(environ['PATH_INFO'])
+        filename = page_file(self.root, path, environ.get('QUERY_STRING', ''))
+        if filename is None:
+            return None
+        try:
+            rendered = os.stat(filename).st_mtime
+        except OSError:
+            return None
+        names = page_version_names(path)
+        if names is None or any(modified > rendered for modified in
+                                get_modified(names).values()):
+            return None
+        try:
+            return self.get_static_file(filename, path)
+        except MissingFileError:
+            # Removed since
+            return None
@@ -0,0 +1,107 @@
+"""
+Read-replica routing for the catalog.
+
+Reads of the catalog's reference data (books, authors, genres,
+languages) made while handling a GET or HEAD request go to one of the
+read replicas in settings.CATALOG_REPLICAS; every write, and every other
+read, goes to the primary ('default').
+
+Replicas lag behind the primary, so a user who just changed something
+must see it: ReplicaStickinessMiddleware keeps a request on the primary
+once it has written to the catalog, and sets a cookie keeping that
+user's following requests on the primary for CATALOG_REPLICA_STICKY_SECONDS.
+
+Management commands and other code running outside a request always use
+the primary, so they never read stale rows and write them back. So do
+pages rendered for the page cache (see catalog.caching), which would
+otherwise keep a page built from a lagging replica under the version
+that was just bumped.
+"""
+from contextlib import contextmanager
+import random
+import threading
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS
+
+STICKY_COOKIE = 'catalog_primary'
+DEFAULT_STICKY_SECONDS = 15
+
+# Models whose reads may be served by a replica
+REPLICA_MODELS = frozenset(('catalog.book', 'catalog.author', 'catalog.genre',
+                            'catalog.language'))
+
+# Apps whose writes pin the user to the primary
+STICKY_APPS = frozenset(('catalog',))
+
+_local = threading.local()
+
+
+def model_label(model):
+    return '%s.%s' % (model._meta.app_label, model._meta.model_name)
+
+
+@contextmanager
+def use_primary():
+    """
+    Read everything from the primary within the block.
+    """
+    previous = getattr(_local, 'use_replicas', False)
+    _local.use_replicas = False
+    try:
+        yield
+    finally:
+        _local.use_replicas = previous and not getattr(_local, 'wrote', False)
+
+
+class PrimaryReplicaRouter(object):
+    """
+    Database router sending catalog reads to replicas when that is safe.
+    """
+
+    def db_for_read(self, model, **hints):
+        replicas = getattr(settings, 'CATALOG_REPLICAS', [])
+        if (replicas and getattr(_local, 'use_replicas', False) and
+                model_label(model) in REPLICA_MODELS):
+            return random.choice(replicas)
+        return DEFAULT_DB_ALIAS
+
+    def db_for_write(self, model, **hints):
+        if model._meta.app_label in STICKY_APPS:
+            # Read our own writes for the rest of the request
+            _local.use_replicas = False
+            _local.wrote = True
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # The replicas hold the same data as the primary
+        databases = set([DEFAULT_DB_ALIAS])
+        databases.update(getattr(settings, 'CATALOG_REPLICAS', []))
+        if obj1._state.db in databases and obj2._state.db in databases:
+            return True
+        return None
+
+
+class ReplicaStickinessMiddleware(object):
+    """
+    Let safe requests read from the replicas, unless the user wrote to
+    the catalog in the last CATALOG_REPLICA_STICKY_SECONDS.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        _local.wrote = False
+        _local.use_replicas = (request.method in ('GET', 'HEAD') and
+                               STICKY_COOKIE not in request.COOKIES)
+        try:
+            response = self.get_response(request)
+            if _local.wrote:
+                response.set_cookie(
+                    STICKY_COOKIE, '1', httponly=True,
+                    max_age=getattr(settings, 'CATALOG_REPLICA_STICKY_SECONDS',
+                                    DEFAULT_STICKY_SECONDS))
+        finally:
+            _local.use_replicas = _local.wrote = False
+        return response
@@ -0,0 +1,172 @@
+"""
+Full-text search over the catalog.
+
+Books are indexed into the BookSearchTerm table, an inverted index mapping
+each term to the books (and the parts of them) it appears in. A search
+looks its terms up in that index, keeps the books containing all of them
+and ranks them by the weight of the matches, so titles count more than
+author and genre names, which count more than summaries.
+
+The index is a plain table with a B-tree on the term, so it behaves the
+same on SQLite and PostgreSQL. It is kept current by the signal handlers
+in catalog.signals; `manage.py rebuild_search_index` rebuilds it.
+"""
+from collections import Counter
+import re
+
+from django.db import transaction
+from django.db.models import Count, Sum
+
+from .models import Book, BookSearchTerm
+
+# Weight of one occurrence of a term in each part of a book
+WEIGHTS = {
+    't': 8,
+    'a': 4,
+    'g': 4,
+    's': 1,
+}
+
+STOP_WORDS = frozenset((
+    'a', 'an', 'and', 'are', 'as', 'at', 'be', 'by', 'for', 'from', 'in',
+    'is', 'it', 'of', 'on', 'or', 'the', 'to', 'with',
+))
+
+TERM_LENGTH = BookSearchTerm._meta.get_field('term').max_length
+
+TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+
+# Number of books indexed per batch when rebuilding
+BATCH_SIZE = 500
+
+
+def tokenize(text):
+    """
+    Split text into normalized search terms.
+    """
+    if not text:
+        return []
+    return [token[:TERM_LENGTH] for token in TOKEN_RE.findall(text.lower())
+            if len(token) > 1 and token not in STOP_WORDS]
+
+
+def book_terms(book):
+    """
+    Build (unsaved) index entries for a book.
+    The author and genres should be loaded already (select_related and
+    prefetch_related) when indexing many books.
+    """
+    author = book.author
+    return document_terms(
+        book.pk, book.title, book.summary,
+        author and '%s %s' % (author.first_name, author.last_name),
+        [genre.name for genre in book.genre.all()])
+
+
+def document_terms(book_pk, title, summary, author_name, genre_names):
+    """
+    Build (unsaved) index entries for a book from its text.
+    """
+    sources = [('t', title), ('s', summary), ('a', author_name)]
+    sources.extend(('g', name) for name in genre_names)
+
+    counts = Counter()
+    for source, text in sources:
+        for term in tokenize(text):
+            counts[term, source] += 1
+    return [BookSearchTerm(term=term, source=source, book_id=book_pk,
+                           weight=count * WEIGHTS[source])
+            for (term, source), count in counts.items()]
+
+
+def index_books(books):
+    """
+    (Re)index the books of a queryset.
+    """
+    books = list(books.select_related('author').prefetch_related('genre'))
+    with transaction.atomic():
+        BookSearchTerm.objects.filter(
+            book__in=[book.pk for book in books]).delete()
+        entries = []
+        for book in books:
+            entries.extend(book_terms(book))
+        BookSearchTerm.objects.bulk_create(entries)
+    return len(books)
+
+
+def rebuild_search_index(batch_size=BATCH_SIZE):
+    """
+    Index every book from scratch. Returns the number of books indexed.
+    """
+    BookSearchTerm.objects.all().delete()
+    indexed = 0
+    last_pk = 0
+    while True:
+        batch = Book.objects.filter(pk__gt=last_pk).order_by('pk')
+        pks = list(batch.values_list('pk', flat=True)[:batch_size])
+        if not pks:
+            return indexed
+        indexed += index_books(Book.objects.filter(pk__in=pks))
+        last_pk = pks[-1]
+
+
+def count_books_with_title_term(term):
+    """
+    Number of books whose title contains the (single word) term.
+    """
+    return BookSearchTerm.objects.filter(term=term, source='t').count()
+
+
+class SearchResults(object):
+    """
+    Lazily evaluated, ranked search results.
+
+    Supports count() and slicing so it can be handed to a Paginator;
+    slicing returns Book objects (with their author loaded) carrying
+    their score as `rank`.
+    """
+    model = Book
+
+    def __init__(self, query):
+        self.query = query
+        self.terms = sorted(set(tokenize(query)))
+        self.matches = (
+            BookSearchTerm.objects.filter(term__in=self.terms)
+            .values('book')
+            .annotate(rank=Sum('weight'),
+                      matched=Count('term', distinct=True))
+            .filter(matched=len(self.terms))
+            .order_by('-rank', 'book'))
+
+    def count(self):
+        if not self.terms:
+            return 0
+        return self.matches.count()
+
+    def __len__(self):
+        return self.count()
+
+    def __getitem__(self, index):
+        if not self.terms:
+            return []
+        rows = self.matches[index]
+        if not isinstance(index, slice):
+            rows = [rows]
+        books = Book.objects.select_related('author').in_bulk(
+            [row['book'] for row in rows])
+        results = []
+        for row in rows:
+            book = books.get(row['book'])
+            if book is not None:
+                book.rank = row['rank']
+                results.append(book)
+        if not isinstance(index, slice):
+            return results[0]
+        return results
+
+
+def search_books(query):
+    """
+    Return the books matching every term of query, best match first.
+    """
+    return SearchResults(query)
@@ -0,0 +1,409 @@
+"""
+Signal handlers keeping derived catalog data in step with the models.
+They are connected when the app is ready (see CatalogConfig.ready).
+"""
+from functools import partial
+
+from django.contrib.auth.models import Group, Permission, User
+from django.core.signals import request_finished, request_started
+from django.db import transaction
+from django.db.models.signals import (m2m_changed, post_delete, post_save,
+                                      pre_delete, pre_save)
+from django.dispatch import receiver
+
+from . import dimensions, facets
+from .caching import bump_versions
+from .models import Author, Book, BookInstance, Genre, Language
+from .search import index_books
+from .stats import adjust_book_counters, adjust_stat, contains_python
+
+# Sentinel for a value we cannot know (object not loaded from the database)
+UNKNOWN = object()
+
+
+def loaded_value(instance, attname):
+    """
+    Return the value an attribute had when the object was last loaded
+    or saved, or UNKNOWN.
+    """
+    return getattr(instance, '_loaded_values', {}).get(attname, UNKNOWN)
+
+
+def remember_values(instance):
+    """
+    Record the values just written so a later save of the same
+    object is compared against them.
+    """
+    instance._loaded_values = dict(
+        (field.attname, getattr(instance, field.attname))
+        for field in instance._meta.concrete_fields)
+
+
+@receiver(post_save, sender=Book)
+def book_saved(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    if created:
+        adjust_stat('num_books', 1)
+        adjust_stat('num_python', int(contains_python(instance.title)))
+    else:
+        old_title = loaded_value(instance, 'title')
+        if old_title is not UNKNOWN:
+            adjust_stat('num_python', int(contains_python(instance.title)) -
+                        int(contains_python(old_title)))
+
+
+@receiver(post_delete, sender=Book)
+def book_deleted(sender, instance, **kwargs):
+    adjust_stat('num_books', -1)
+    adjust_stat('num_python', -int(contains_python(instance.title)))
+
+
+@receiver(post_save, sender=BookInstance)
+def bookinstance_saved(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    available = int(instance.status == 'a')
+    if created:
+        adjust_stat('num_instances', 1)
+        adjust_stat('num_instances_available', available)
+    else:
+        old_status = loaded_value(instance, 'status')
+        if old_status is not UNKNOWN:
+            adjust_stat('num_instances_available',
+                        available - int(old_status == 'a'))
+
+
+@receiver(post_delete, sender=BookInstance)
+def bookinstance_deleted(sender, instance, **kwargs):
+    adjust_stat('num_instances', -1)
+    adjust_stat('num_instances_available', -int(instance.status == 'a'))
+
+
+@receiver(post_save, sender=Author)
+def author_saved(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        adjust_stat('num_authors', 1)
+
+
+@receiver(post_save, sender=BookInstance)
+def count_saved_copy(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    if created:
+        adjust_book_counters(instance.book_id, instance.status, 1)
+        return
+    old_book_id = loaded_value(instance, 'book_id')
+    old_status = loaded_value(instance, 'status')
+    if UNKNOWN in (old_book_id, old_status):
+        return
+    if (old_book_id, old_status) != (instance.book_id, instance.status):
+        adjust_book_counters(old_book_id, old_status, -1)
+        adjust_book_counters(instance.book_id, instance.status, 1)
+
+
+@receiver(post_delete, sender=BookInstance)
+def count_deleted_copy(sender, instance, **kwargs):
+    adjust_book_counters(instance.book_id, instance.status, -1)
+
+
+@receiver(post_delete, sender=Author)
+def author_deleted(sender, instance, **kwargs):
+    adjust_stat('num_authors', -1)
+
+
+@receiver(post_save, sender=Genre)
+def genre_saved(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        adjust_stat('num_genre', 1)
+
+
+@receiver(post_delete, sender=Genre)
+def genre_deleted(sender, instance, **kwargs):
+    adjust_stat('num_genre', -1)
+
+
+# Search index: a book's entries cover its title, summary, author and genres
+
+@receiver(post_save, sender=Book)
+def index_saved_book(sender, instance, raw=False, **kwargs):
+    if not raw:
+        index_books(Book.objects.filter(pk=instance.pk))
+
+
+@receiver(m2m_changed, sender=Book.genre.through)
+def index_book_genres(sender, instance, action, reverse, pk_set, **kwargs):
+    if reverse and action == 'pre_clear':
+        # genre.book_set.clear() does not say which books it touched
+        instance._indexed_book_pks = list(
+            instance.book_set.values_list('pk', flat=True))
+    elif action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    elif not reverse:
+        index_books(Book.objects.filter(pk=instance.pk))
+    elif action == 'post_clear':
+        index_books(Book.objects.filter(pk__in=instance._indexed_book_pks))
+    else:
+        index_books(Book.objects.filter(pk__in=pk_set))
+
+
+@receiver(post_save, sender=Author)
+@receiver(post_save, sender=Genre)
+def index_renamed_books(sender, instance, created, raw=False, **kwargs):
+    if not created and not raw:
+        index_books(instance.book_set.all())
+
+
+@receiver(pre_delete, sender=Author)
+@receiver(pre_delete, sender=Genre)
+def remember_indexed_books(sender, instance, **kwargs):
+    # The links to the books are gone by post_delete
+    instance._indexed_book_pks = list(
+        instance.book_set.values_list('pk', flat=True))
+
+
+@receiver(post_delete, sender=Author)
+@receiver(post_delete, sender=Genre)
+def index_orphaned_books(sender, instance, **kwargs):
+    pks = getattr(instance, '_indexed_book_pks', None)
+    if pks:
+        index_books(Book.objects.filter(pk__in=pks))
+
+
+# Page cache: bump the versions of the pages showing what changed
+# (see catalog.caching)
+
+def changed_values(instance, attname):
+    """
+    Return the current value of an attribute and, if known and different,
+    the one it had when loaded.
+    """
+    values = [getattr(instance, attname)]
+    old = loaded_value(instance, attname)
+    if old is not UNKNOWN and old != values[0]:
+        values.append(old)
+    return [value for value in values if value is not None]
+
+
+@receiver(post_save, sender=Book)
+@receiver(post_delete, sender=Book)
+def expire_book_pages(sender, instance, **kwargs):
+    bump_versions('book', 'book:%s' % instance.pk, *[
+        'author:%s' % pk for pk in changed_values(instance, 'author_id')])
+
+
+@receiver(m2m_changed, sender=Book.genre.through)
+def expire_book_genre_pages(sender, instance, action, reverse, pk_set,
+                            **kwargs):
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    if not reverse:
+        # The API lists books with their genres
+        bump_versions('book', 'book:%s' % instance.pk)
+    else:
+        # Genres only appear on the book pages (and the API's books),
+        # which depend on 'genre'
+        bump_versions('genre')
+
+
+@receiver(post_save, sender=BookInstance)
+@receiver(post_delete, sender=BookInstance)
+def expire_copy_pages(sender, instance, **kwargs):
+    book_pks = changed_values(instance, 'book_id')
+    # Author pages show how many copies each book has
+    author_pks = Book.objects.filter(pk__in=book_pks).exclude(
+        author=None).values_list('author_id', flat=True)
+    # ... and the book list shows how many copies are available
+    bump_versions('book', *['book:%s' % pk for pk in book_pks] +
+                  ['author:%s' % pk for pk in author_pks])
+
+
+@receiver(post_save, sender=Author)
+@receiver(post_delete, sender=Author)
+def expire_author_pages(sender, instance, **kwargs):
+    bump_versions('author', 'author:%s' % instance.pk)
+
+
+@receiver(post_save, sender=Genre)
+@receiver(post_delete, sender=Genre)
+def expire_genre_pages(sender, instance, **kwargs):
+    bump_versions('genre')
+
+
+@receiver(post_save, sender=Language)
+@receiver(post_delete, sender=Language)
+def expire_language_pages(sender, instance, **kwargs):
+    bump_versions('language')
+
+
+# Dimension cache (see catalog.dimensions): this process forgets its copy
+# of the table at once; the others see the version, bumped again once
+# the change is committed so none of them keeps the rows read before
+
+def expire_dimension(dimension):
+    dimension.clear()
+    bump_versions(dimension.version_name)
+
+
+@receiver(post_save, sender=Genre)
+@receiver(post_delete, sender=Genre)
+@receiver(post_save, sender=Language)
+@receiver(post_delete, sender=Language)
+def expire_dimension_names(sender, instance, using, **kwargs):
+    dimension = dimensions.DIMENSIONS[sender]
+    dimension.clear()
+    transaction.on_commit(partial(expire_dimension, dimension), using=using)
+
+
+@receiver(request_started)
+def check_dimensions_once(sender, **kwargs):
+    dimensions.start_request()
+
+
+@receiver(request_finished)
+def check_dimensions_always(sender, **kwargs):
+    dimensions.end_request()
+
+
+# Facet index: a book's genres, the languages of its copies, its author
+# and whether a copy is available (see catalog.facets). Availability is
+# read from the book counters, which the handlers above have updated.
+
+def has_changed(instance, attnames):
+    """
+    Whether any of the attributes may differ from when the object was
+    last loaded or saved.
+    """
+    for attname in attnames:
+        old = loaded_value(instance, attname)
+        if old is UNKNOWN or old != getattr(instance, attname):
+            return True
+    return False
+
+
+@receiver(post_save, sender=Book)
+def index_book_author_facet(sender, instance, created, raw=False,
+                            **kwargs):
+    if not raw and (created or has_changed(instance, ['author_id'])):
+        facets.index_books([instance.pk], 'a')
+
+
+@receiver(pre_delete, sender=Book)
+def unindex_book_facets(sender, instance, **kwargs):
+    facets.remove_books([instance.pk])
+
+
+@receiver(m2m_changed, sender=Book.genre.through)
+def index_book_genre_facets(sender, instance, action, reverse, pk_set,
+                            **kwargs):
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    if not reverse:
+        facets.index_books([instance.pk], 'g')
+    elif action == 'post_clear':
+        # Remembered by index_book_genres on pre_clear
+        facets.index_books(instance._indexed_book_pks, 'g')
+    else:
+        facets.index_books(pk_set, 'g')
+
+
+@receiver(post_save, sender=BookInstance)
+@receiver(post_delete, sender=BookInstance)
+def index_copy_facets(sender, instance, created=False, raw=False,
+                      **kwargs):
+    if raw:
+        return
+    if (created or kwargs['signal'] is post_delete or
+            has_changed(instance, ['book_id', 'language_id', 'status'])):
+        facets.index_books(changed_values(instance, 'book_id'), 'lv')
+
+
+@receiver(pre_delete, sender=Language)
+def remember_language_books(sender, instance, **kwargs):
+    # The copies lose their language without a signal
+    instance._indexed_book_pks = list(BookInstance.objects.filter(
+        language=instance).exclude(book=None).values_list(
+        'book_id', flat=True).distinct())
+
+
+@receiver(post_delete, sender=Author)
+@receiver(post_delete, sender=Genre)
+@receiver(post_delete, sender=Language)
+def index_orphaned_book_facets(sender, instance, **kwargs):
+    # Remembered by remember_indexed_books or remember_language_books
+    pks = getattr(instance, '_indexed_book_pks', None)
+    if pks:
+        facets.index_books(pks, {Author: 'a', Genre: 'g', Language: 'l'}[
+            sender])
+
+
+# Permission cache: bump the versions of the permission sets that changed
+# (see catalog.backends)
+
+# The User fields deciding the permissions (groups and user_permissions
+# change through m2m_changed)
+USER_PERMISSION_FIELDS = ('is_active', 'is_staff', 'is_superuser')
+
+
+@receiver(pre_save, sender=User)
+def remember_user_permission_fields(sender, instance, update_fields=None,
+                                    raw=False, **kwargs):
+    # Logging in saves last_login alone: nothing to expire
+    if raw or instance.pk is None or (
+            update_fields is not None and
+            not set(update_fields).intersection(USER_PERMISSION_FIELDS)):
+        instance._permission_fields = None
+        return
+    instance._permission_fields = User.objects.filter(
+        pk=instance.pk).values_list(*USER_PERMISSION_FIELDS).first()
+
+
+@receiver(post_save, sender=User)
+def expire_user_permissions(sender, instance, created, raw=False,
+                            **kwargs):
+    if raw:
+        return
+    old = getattr(instance, '_permission_fields', None)
+    # A new user may reuse the pk of a deleted one (SQLite does)
+    if created or (old is not None and old != tuple(
+            getattr(instance, name) for name in USER_PERMISSION_FIELDS)):
+        bump_versions('perms:%s' % instance.pk)
+
+
+@receiver(post_delete, sender=User)
+def expire_deleted_user_permissions(sender, instance, **kwargs):
+    bump_versions('perms:%s' % instance.pk)
+
+
+@receiver(m2m_changed, sender=User.user_permissions.through)
+@receiver(m2m_changed, sender=User.groups.through)
+def expire_user_m2m_permissions(sender, instance, action, reverse, pk_set,
+                                **kwargs):
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    if not reverse:
+        bump_versions('perms:%s' % instance.pk)
+    else:
+        # A permission or group changed for many users at once
+        bump_versions('perms')
+
+
+@receiver(m2m_changed, sender=Group.permissions.through)
+def expire_group_permissions(sender, action, **kwargs):
+    if action in ('post_add', 'post_remove', 'post_clear'):
+        bump_versions('perms')
+
+
+@receiver(post_delete, sender=Group)
+@receiver(post_delete, sender=Permission)
+def expire_deleted_permissions(sender, instance, **kwargs):
+    bump_versions('perms')
+
+
+# Keep this last: the handlers above compare against the values loaded
+# before the save.
+
+@receiver(post_save, sender=Book)
+@receiver(post_save, sender=BookInstance)
+def remember_saved_values(sender, instance, raw=False, **kwargs):
+    remember_values(instance)
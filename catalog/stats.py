@@ -0,0 +1,172 @@
+"""
+Materialized catalog statistics shown on the home page.
+
+The counters live in the CatalogStatistic table and are kept current by the
+signal handlers in catalog.signals, so the index page reads a handful of
+rows instead of counting every table on each request.
+Bulk operations that skip signals (queryset.update(), bulk_create())
+can make the counters drift; `manage.py rebuild_catalog_stats` fixes that.
+
+Each Book also carries counters of its copies in each state, maintained
+the same way and reconciled by `manage.py reconcile_book_counters`.
+"""
+from collections import Counter, defaultdict
+
+from django.db import transaction
+from django.db.models import Case, Count, F, IntegerField, Value, When
+
+from .models import Author, Book, BookInstance, CatalogStatistic, Genre
+from .search import count_books_with_title_term, tokenize
+
+# Word counted by the 'Contains python' statistic on the home page
+PYTHON_TERM = 'python'
+
+STAT_NAMES = (
+    'num_books',
+    'num_instances',
+    'num_instances_available',
+    'num_authors',
+    'num_genre',
+    'num_python',
+)
+
+
+def count_catalog():
+    """
+    Count every statistic straight from the catalog tables (the slow path).
+    """
+    return {
+        'num_books': Book.objects.count(),
+        'num_instances': BookInstance.objects.count(),
+        'num_instances_available': BookInstance.objects.filter(
+            status__exact='a').count(),
+        'num_authors': Author.objects.count(),
+        'num_genre': Genre.objects.count(),
+        # Looked up in the search index rather than a LIKE scan of titles
+        'num_python': count_books_with_title_term(PYTHON_TERM),
+    }
+
+
+def rebuild_catalog_stats():
+    """
+    Recount the catalog and overwrite the stored statistics.
+    """
+    counts = count_catalog()
+    with transaction.atomic():
+        for name, value in counts.items():
+            CatalogStatistic.objects.update_or_create(
+                name=name, defaults={'value': value})
+    return counts
+
+
+def get_catalog_stats():
+    """
+    Return the stored statistics as a dict, with a single query.
+    The table is (re)built the first time it is found incomplete.
+    """
+    stats = dict(CatalogStatistic.objects.values_list('name', 'value'))
+    if any(name not in stats for name in STAT_NAMES):
+        stats.update(rebuild_catalog_stats())
+    return stats
+
+
+def adjust_stat(name, delta):
+    """
+    Atomically add delta to a stored statistic.
+    Nothing happens if the table has not been built yet; the first read
+    will count everything anyway.
+    """
+    if delta:
+        CatalogStatistic.objects.filter(name=name).update(
+            value=F('value') + delta)
+
+
+def contains_python(title):
+    """
+    Whether a book title counts towards the 'Contains python' statistic,
+    i.e. has 'python' as one of its search terms.
+    """
+    return PYTHON_TERM in tokenize(title)
+
+
+# Book counter incremented for a copy in each loan status
+STATUS_COUNTERS = {
+    'a': 'copies_available',
+    'o': 'copies_on_loan',
+    'r': 'copies_reserved',
+    'd': 'copies_maintenance',
+}
+
+BOOK_COUNTERS = Book.COPY_COUNTERS
+
+
+def adjust_book_counters(book_id, status, delta):
+    """
+    Atomically count delta copies in the given status for a book.
+    """
+    if book_id is None or not delta:
+        return
+    updates = {'copies_total': F('copies_total') + delta}
+    counter = STATUS_COUNTERS.get(status)
+    if counter is not None:
+        updates[counter] = F(counter) + delta
+    Book.objects.filter(pk=book_id).update(**updates)
+
+
+def adjust_many_book_counters(deltas, chunk_size=100):
+    """
+    Apply {(book_id, status): delta} to the book counters in one UPDATE
+    per chunk_size books, e.g. after moving many copies between statuses.
+    """
+    per_book = defaultdict(Counter)
+    for (book_id, status), delta in deltas.items():
+        if book_id is None or not delta:
+            continue
+        per_book[book_id]['copies_total'] += delta
+        if status in STATUS_COUNTERS:
+            per_book[book_id][STATUS_COUNTERS[status]] += delta
+    book_ids = sorted(per_book)
+    for start in range(0, len(book_ids), chunk_size):
+        chunk = book_ids[start:start + chunk_size]
+        updates = {}
+        for name in BOOK_COUNTERS:
+            whens = [When(pk=pk, then=Value(per_book[pk][name]))
+                     for pk in chunk if per_book[pk][name]]
+            if whens:
+                updates[name] = F(name) + Case(
+                    *whens, default=Value(0), output_field=IntegerField())
+        if updates:
+            Book.objects.filter(pk__in=chunk).update(**updates)
+
+
+def count_book_copies():
+    """
+    Count the copies of every book by status, straight from BookInstance.
+    Returns {book pk: {counter name: value}} for books having copies.
+    """
+    counters = {}
+    for row in BookInstance.objects.exclude(book=None).values(
+            'book', 'status').annotate(copies=Count('id')).order_by():
+        book_counters = counters.setdefault(
+            row['book'], dict.fromkeys(BOOK_COUNTERS, 0))
+        book_counters['copies_total'] += row['copies']
+        if row['status'] in STATUS_COUNTERS:
+            book_counters[STATUS_COUNTERS[row['status']]] = row['copies']
+    return counters
+
+
+def reconcile_book_counters():
+    """
+    Recount the copies of every book and fix the counters that drifted.
+    Returns the number of books fixed.
+    """
+    counters = count_book_copies()
+    zero = dict.fromkeys(BOOK_COUNTERS, 0)
+    fixed = 0
+    for row in Book.objects.values('pk', *BOOK_COUNTERS).iterator():
+        pk = row.pop('pk')
+        expected = counters.get(pk, zero)
+        if row != expected:
+            Book.objects.filter(pk=pk).update(**expected)
+            fixed += 1
+    return fixed
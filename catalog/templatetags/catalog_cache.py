@@ -0,0 +1,38 @@
+"""
+Template tags for caching page fragments on the catalog versions
+(see catalog.caching).
+"""
+from django import template
+
+from catalog.backends import permissions_timeout
+from catalog.caching import get_versions
+
+register = template.Library()
+
+
+@register.simple_tag
+def catalog_versions(*names, **objects):
+    """
+    Return the current versions of the named models, and of the objects
+    given as name=pk, as one string to vary a {% cache %} fragment on:
+
+        {% catalog_versions 'language' book=book.pk as versions %}
+        {% cache 86400 book_copies versions %}...{% endcache %}
+
+    Stale fragments are never read again, so the timeout only bounds
+    memory use.
+    """
+    names = ['catalog'] + list(names) + [
+        '%s:%s' % (name, pk) for name, pk in sorted(objects.items())]
+    versions, last_modified = get_versions(names)
+    return '|'.join('%s=%s' % (name, versions[name]) for name in names)
+
+
+
+@register.simple_tag(name='permissions_timeout')
+def permissions_timeout_tag():
+    """
+    The timeout of {% cache %} fragments depending on the user's
+    permissions (see catalog.backends).
+    """
+    return permissions_timeout()
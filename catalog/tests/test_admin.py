@@ -0,0 +1,87 @@
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.urlresolvers import reverse
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+
+from catalog.models import Author, Book, BookInstance, Genre
+from catalog.pagination import EstimatedCountPaginator
+
+
+class CatalogAdminChangelistTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        User.objects.create_superuser('admin', 'admin@example.com', '12345')
+        cls.author = Author.objects.create(first_name='John',
+                                           last_name='Smith')
+        cls.genres = [Genre.objects.create(name='Genre %d' % n)
+                      for n in range(4)]
+        cls.borrower = User.objects.create_user('borrower')
+
+    def setUp(self):
+        self.client.login(username='admin', password='12345')
+
+    def add_books(self, number):
+        for _ in range(number):
+            book = Book.objects.create(
+                title='Book', summary='Summary', isbn='ISBN',
+                author=self.author)
+            book.genre.set(self.genres)
+            BookInstance.objects.create(book=book, imprint='Imprint',
+                                        status='o', borrower=self.borrower)
+
+    def count_queries(self, url):
+        with CaptureQueriesContext(connection) as queries:
+            resp = self.client.get(url)
+        self.assertEqual(resp.status_code, 200)
+        return len(queries)
+
+    def assertQueriesDoNotGrow(self, url):
+        self.add_books(2)
+        # Load what each process caches (see catalog.dimensions)
+        self.count_queries(url)
+        few = self.count_queries(url)
+        self.add_books(20)
+        self.assertEqual(self.count_queries(url), few)
+
+    def test_book_changelist_queries_do_not_grow(self):
+        self.assertQueriesDoNotGrow(
+            reverse('admin:catalog_book_changelist'))
+
+    def test_book_changelist_shows_genres(self):
+        self.add_books(1)
+        resp = self.client.get(reverse('admin:catalog_book_changelist'))
+        self.assertContains(resp, 'Genre 0, Genre 1, Genre 2')
+
+    def test_bookinstance_changelist_queries_do_not_grow(self):
+        self.assertQueriesDoNotGrow(
+            reverse('admin:catalog_bookinstance_changelist'))
+
+
+class EstimatedCountPaginatorTest(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        for number in range(5):
+            Genre.objects.create(name='Genre %d' % number)
+
+    def test_small_counts_are_exact(self):
+        paginator = EstimatedCountPaginator(Genre.objects.all(), 2)
+        self.assertEqual(paginator.count, 5)
+        Genre.objects.create(name='Another')
+        paginator = EstimatedCountPaginator(Genre.objects.all(), 2)
+        self.assertEqual(paginator.count, 6)
+
+    def test_large_counts_are_cached(self):
+        class SmallPaginator(EstimatedCountPaginator):
+            LARGE_COUNT = 3
+
+        self.assertEqual(SmallPaginator(Genre.objects.all(), 2).count, 5)
+        Genre.objects.create(name='Another')
+        with self.assertNumQueries(0):
+            self.assertEqual(SmallPaginator(Genre.objects.all(), 2).count, 5)
+        # Another listing is counted separately
+        self.assertEqual(SmallPaginator(
+            Genre.objects.exclude(name='Genre 0'), 2).count, 5)
@@ -0,0 +1,162 @@
+import json
+
+from django.contrib.auth.models import Permission, User
+from django.core.cache import cache
+from django.core.urlresolvers import reverse
+from django.test import TestCase
+
+from catalog.models import Author, Book, BookInstance, Genre, Language
+
+
+class ApiTestMixin(object):
+
+    def setUp(self):
+        cache.clear()
+        self.author = Author.objects.create(first_name='John',
+                                            last_name='Smith')
+        self.genres = [Genre.objects.create(name='Genre %d' % number)
+                       for number in range(2)]
+        self.language = Language.objects.create(name='English')
+        self.books = []
+        for number in range(5):
+            book = Book.objects.create(
+                title='Book %d' % number, summary='Summary', isbn='ISBN',
+                author=self.author)
+            book.genre.set(self.genres)
+            BookInstance.objects.create(book=book, imprint='Imprint',
+                                        status='a', language=self.language)
+            self.books.append(book)
+
+    def get_json(self, url, status=200, **extra):
+        resp = self.client.get(url, **extra)
+        self.assertEqual(resp.status_code, status)
+        return json.loads(resp.content.decode())
+
+    def send_json(self, method, url, data):
+        return getattr(self.client, method)(
+            url, json.dumps(data), content_type='application/json')
+
+
+class ApiReadTest(ApiTestMixin, TestCase):
+
+    def test_list_with_sparse_fields(self):
+        content = self.get_json(reverse('api-list', args=['books']) +
+                                '?fields=title,genres')
+        self.assertEqual(content['data'][0], {
+            'id': self.books[0].pk, 'title': 'Book 0',
+            'genres': [genre.pk for genre in self.genres]})
+        self.assertNotIn('included', content)
+
+    def test_include_does_not_grow_with_the_page(self):
+        url = (reverse('api-list', args=['books']) +
+               '?include=author,genres,copies&fields[authors]=last_name')
+        # Page, genre links, authors, genres and copies
+        with self.assertNumQueries(5):
+            content = self.get_json(url)
+        self.assertEqual(len(content['data']), 5)
+        self.assertEqual(content['included']['authors'], [
+            {'id': self.author.pk, 'last_name': 'Smith'}])
+        self.assertEqual(len(content['included']['genres']), 2)
+        self.assertEqual(
+            sorted(copy['book'] for copy in content['included']['copies']),
+            [book.pk for book in self.books])
+
+    def test_keyset_pages(self):
+        url = reverse('api-list', args=['books']) + '?page_size=2'
+        titles = []
+        while url:
+            content = self.get_json(url)
+            titles.extend(book['title'] for book in content['data'])
+            url = content['links']['next']
+        self.assertEqual(titles, ['Book %d' % n for n in range(5)])
+
+        content = self.get_json(reverse('api-list', args=['copies']) +
+                                '?page_size=2')
+        self.assertEqual(len(content['data']), 2)
+        self.assertIsNotNone(content['links']['next'])
+
+    def test_detail(self):
+        copy = BookInstance.objects.first()
+        content = self.get_json(
+            reverse('api-detail', args=['copies', copy.pk]) +
+            '?include=language')
+        self.assertEqual(content['data']['id'], str(copy.pk))
+        self.assertNotIn('borrower', content['data'])
+        self.assertEqual(content['included']['languages'], [
+            {'id': self.language.pk, 'name': 'English'}])
+        self.get_json(reverse('api-detail', args=['copies', 'missing']), 404)
+        self.get_json(reverse('api-detail', args=['books', 0]), 404)
+
+    def test_bad_requests(self):
+        url = reverse('api-list', args=['books'])
+        for query in ('?fields=borrower', '?include=language',
+                      '?cursor=bad', '?page_size=0'):
+            self.assertIn('errors', self.get_json(url + query, 400))
+
+    def test_conditional_get(self):
+        url = reverse('api-list', args=['books']) + '?include=author'
+        resp = self.client.get(url)
+        with self.assertNumQueries(0):
+            resp = self.client.get(url, HTTP_IF_NONE_MATCH=resp['ETag'])
+        self.assertEqual(resp.status_code, 304)
+
+        self.author.last_name = 'Jones'
+        self.author.save()
+        resp = self.client.get(url, HTTP_IF_NONE_MATCH=resp['ETag'])
+        self.assertEqual(resp.status_code, 200)
+        self.assertContains(resp, 'Jones')
+
+        # Changing a book's genres changes the listing too
+        etag = resp['ETag']
+        self.books[0].genre.remove(self.genres[0])
+        resp = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(resp.status_code, 200)
+
+
+class ApiWriteTest(ApiTestMixin, TestCase):
+
+    def setUp(self):
+        super(ApiWriteTest, self).setUp()
+        self.user = User.objects.create_user('librarian', password='12345')
+        self.client.login(username='librarian', password='12345')
+
+    def grant(self, *codenames):
+        self.user.user_permissions.add(
+            *Permission.objects.filter(codename__in=codenames))
+
+    def test_writes_need_permissions(self):
+        resp = self.send_json('post', reverse('api-list', args=['genres']),
+                              {'name': 'Poetry'})
+        self.assertEqual(resp.status_code, 403)
+        self.assertFalse(Genre.objects.filter(name='Poetry').exists())
+
+    def test_create_update_and_delete(self):
+        self.grant('add_book', 'change_book', 'delete_book')
+        resp = self.send_json('post', reverse('api-list', args=['books']), {
+            'title': 'New', 'summary': 'Summary', 'isbn': '123',
+            'author': self.author.pk, 'genres': [self.genres[1].pk]})
+        self.assertEqual(resp.status_code, 201)
+        data = json.loads(resp.content.decode())['data']
+        self.assertEqual(data['genres'], [self.genres[1].pk])
+        self.assertEqual(data['copies_total'], 0)
+        url = resp['Location']
+
+        resp = self.send_json('patch', url, {'title': 'Newer'})
+        self.assertEqual(resp.status_code, 200)
+        book = Book.objects.get(pk=data['id'])
+        self.assertEqual((book.title, book.isbn), ('Newer', '123'))
+        self.assertEqual(list(book.genre.all()), [self.genres[1]])
+
+        resp = self.send_json('put', url, {'title': 'Newest'})
+        self.assertEqual(resp.status_code, 400)
+        self.assertIn('summary', json.loads(resp.content.decode())['errors'])
+
+        self.assertEqual(self.client.delete(url).status_code, 204)
+        self.assertFalse(Book.objects.filter(pk=data['id']).exists())
+
+    def test_unknown_fields_rejected(self):
+        self.grant('change_book')
+        resp = self.send_json(
+            'patch', reverse('api-detail', args=['books', self.books[0].pk]),
+            {'copies_total': 10})
+        self.assertEqual(resp.status_code, 400)
@@ -0,0 +1,230 @@
+import shutil
+import tempfile
+
+from django.contrib.auth.models import Permission, User
+from django.core.cache import cache
+from django.core.urlresolvers import reverse
+from django.db import connection, transaction
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from catalog.backends import LOCAL_PERMISSIONS_TIMEOUT, permissions_timeout
+from catalog.caching import PAGE_TIMEOUT, bump_versions, get_versions
+from catalog.models import Author, Book, BookInstance, Genre, Language
+
+
+class CachedPagesTest(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.author = Author.objects.create(first_name='John',
+                                            last_name='Smith')
+        self.genre = Genre.objects.create(name='Fantasy')
+        self.language = Language.objects.create(name='English')
+        self.book = Book.objects.create(
+            title='Book Title', summary='My book summary', isbn='ABCDEFG',
+            author=self.author)
+        self.book.genre.add(self.genre)
+        self.copy = BookInstance.objects.create(
+            book=self.book, imprint='Imprint', status='a',
+            language=self.language)
+
+    def assertServedFromCache(self, url):
+        self.client.get(url)
+        with self.assertNumQueries(0):
+            resp = self.client.get(url)
+        self.assertEqual(resp.status_code, 200)
+        return resp
+
+    def test_pages_served_from_cache(self):
+        for url in (reverse('books'), reverse('authors'),
+                    self.book.get_absolute_url(),
+                    self.author.get_absolute_url()):
+            self.assertServedFromCache(url)
+
+    def test_unread_query_parameters_share_the_page(self):
+        url = reverse('books')
+        self.client.get(url + '?page=1')
+        with self.assertNumQueries(0):
+            self.client.get(url + '?utm_source=mail&page=1')
+        # Parameters the view reads make a page of their own
+        self.assertNotEqual(self.client.get(url + '?page=1')['ETag'],
+                            self.client.get(url)['ETag'])
+
+    def test_versions_bumped_again_on_commit(self):
+        before = get_versions(['book'])[0]['book']
+        pending = len(connection.run_on_commit)
+        with transaction.atomic():
+            bump_versions('book')
+        bumped = get_versions(['book'])[0]['book']
+        self.assertNotEqual(bumped, before)
+        # TestCase never commits: run what the commit would
+        self.assertEqual(len(connection.run_on_commit), pending + 1)
+        sids, callback = connection.run_on_commit.pop()
+        callback()
+        self.assertNotEqual(get_versions(['book'])[0]['book'], bumped)
+
+    def test_conditional_get_not_modified(self):
+        resp = self.client.get(self.book.get_absolute_url())
+        self.assertTrue(resp.has_header('ETag'))
+        self.assertTrue(resp.has_header('Last-Modified'))
+
+        resp = self.client.get(self.book.get_absolute_url(),
+                               HTTP_IF_NONE_MATCH=resp['ETag'])
+        self.assertEqual(resp.status_code, 304)
+
+    def test_book_change_expires_book_page(self):
+        url = self.book.get_absolute_url()
+        self.assertServedFromCache(url)
+        self.book.title = 'New Title'
+        self.book.save()
+        self.assertContains(self.client.get(url), 'New Title')
+
+    def test_copy_change_expires_book_and_author_pages(self):
+        book_url = self.book.get_absolute_url()
+        author_url = self.author.get_absolute_url()
+        self.assertServedFromCache(book_url)
+        self.assertServedFromCache(author_url)
+
+        BookInstance.objects.create(book=self.book, imprint='Imprint',
+                                    status='o', language=self.language)
+        self.assertContains(self.client.get(book_url), 'On loan')
+        self.assertContains(self.client.get(author_url), '(2)')
+
+    def test_genre_and_language_changes_expire_book_page(self):
+        url = self.book.get_absolute_url()
+        self.assertServedFromCache(url)
+        self.genre.name = 'Horror'
+        self.genre.save()
+        self.assertContains(self.client.get(url), 'Horror')
+
+        self.language.name = 'French'
+        self.language.save()
+        self.assertContains(self.client.get(url), 'French')
+
+    def test_unrelated_change_keeps_cached_page(self):
+        url = self.book.get_absolute_url()
+        other = Book.objects.create(title='Other', summary='Summary',
+                                    isbn='123')
+        self.client.get(url)
+        other.title = 'Still other'
+        other.save()
+        with self.assertNumQueries(0):
+            self.client.get(url)
+
+    def test_logged_in_users_not_served_from_cache(self):
+        User.objects.create_user(username='testuser1', password='12345')
+        self.client.login(username='testuser1', password='12345')
+        url = self.book.get_absolute_url()
+        self.client.get(url)
+        resp = self.client.get(url)
+        self.assertEqual(str(resp.context['user']), 'testuser1')
+        self.assertFalse(resp.has_header('ETag'))
+
+
+class LoggedInFragmentCacheTest(TestCase):
+    """
+    Pages for logged in users are rendered each time, but reuse cached
+    fragments and permission sets.
+    """
+
+    def setUp(self):
+        cache.clear()
+        self.author = Author.objects.create(first_name='John',
+                                            last_name='Smith')
+        self.language = Language.objects.create(name='English')
+        self.book = Book.objects.create(
+            title='Book Title', summary='My book summary', isbn='ABCDEFG',
+            author=self.author)
+        self.copy = BookInstance.objects.create(
+            book=self.book, imprint='First imprint', status='a',
+            language=self.language)
+        self.user = User.objects.create_user(username='testuser1',
+                                             password='12345')
+        self.client.login(username='testuser1', password='12345')
+
+    def count_queries(self, url):
+        with CaptureQueriesContext(connection) as queries:
+            resp = self.client.get(url)
+        self.assertEqual(resp.status_code, 200)
+        return [query['sql'] for query in queries]
+
+    def test_copies_fragment_cached_and_expired(self):
+        url = self.book.get_absolute_url()
+        first = self.count_queries(url)
+        second = self.count_queries(url)
+        self.assertLess(len(second), len(first))
+        self.assertFalse(any('catalog_bookinstance' in sql
+                             for sql in second))
+
+        self.copy.imprint = 'Second imprint'
+        self.copy.save()
+        self.assertContains(self.client.get(url), 'Second imprint')
+        self.language.name = 'French'
+        self.language.save()
+        self.assertContains(self.client.get(url), 'French')
+
+    def test_author_books_fragment_expired(self):
+        url = self.author.get_absolute_url()
+        self.client.get(url)
+        self.book.title = 'New Title'
+        self.book.save()
+        self.assertContains(self.client.get(url), 'New Title')
+
+    def test_permissions_cached_and_expired(self):
+        url = reverse('books')
+        self.assertContains(self.client.get(url), 'Library Member')
+        self.assertFalse(any('auth_permission' in sql
+                             for sql in self.count_queries(url)))
+
+        self.user.user_permissions.add(
+            Permission.objects.get(codename='can_mark_returned'))
+        self.assertContains(self.client.get(url), 'Library Staff')
+
+    def test_permissions_expired_by_relevant_user_fields(self):
+        versions = lambda: get_versions(['perms:%s' % self.user.pk])[0]
+        before = versions()
+        # As logging in does
+        self.user.last_login = timezone.now()
+        self.user.save(update_fields=['last_login'])
+        self.user.first_name = 'Jane'
+        self.user.save()
+        self.assertEqual(versions(), before)
+        self.user.is_staff = True
+        self.user.save()
+        self.assertNotEqual(versions(), before)
+
+    def test_permissions_kept_briefly_in_local_cache(self):
+        self.assertEqual(permissions_timeout(), LOCAL_PERMISSIONS_TIMEOUT)
+        caches = {'default': {
+            'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+            'LOCATION': tempfile.mkdtemp(),
+        }}
+        self.addCleanup(shutil.rmtree, caches['default']['LOCATION'])
+        with override_settings(CACHES=caches):
+            self.assertEqual(permissions_timeout(), PAGE_TIMEOUT)
+
+
+class FileBasedCachedPagesTest(TestCase):
+
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.cache_dir)
+
+    def test_pages_cached_and_expired(self):
+        caches = {'default': {
+            'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+            'LOCATION': self.cache_dir,
+        }}
+        with override_settings(CACHES=caches):
+            author = Author.objects.create(first_name='John',
+                                           last_name='Smith')
+            self.client.get(author.get_absolute_url())
+            with self.assertNumQueries(0):
+                self.client.get(author.get_absolute_url())
+
+            author.first_name = 'Jane'
+            author.save()
+            self.assertContains(self.client.get(author.get_absolute_url()),
+                                'Jane')
@@ -0,0 +1,143 @@
+import os
+import shutil
+import tempfile
+import threading
+
+from django.db import connection
+from django.db.utils import load_backend
+from django.test import SimpleTestCase, TestCase
+
+from catalog.dbbackends.pool import (ConnectionPool, PoolTimeout,
+                                     close_pools, pool_stats)
+
+
+class FakeConnection(object):
+
+    def __init__(self):
+        self.usable = True
+        self.closed = False
+
+    def close(self):
+        self.closed = True
+
+
+class ConnectionPoolTest(SimpleTestCase):
+
+    def setUp(self):
+        self.pool = ConnectionPool('test', max_size=2, timeout=0.05,
+                                   check_after=0, max_age=60)
+        self.checked = []
+
+    def check(self, connection):
+        self.checked.append(connection)
+        return connection.usable
+
+    def acquire(self):
+        return self.pool.acquire(FakeConnection, self.check)
+
+    def release(self, connection, usable=True):
+        self.pool.release(connection, lambda connection: usable)
+
+    def test_connections_reused(self):
+        first = self.acquire()
+        self.release(first)
+        self.assertIs(self.acquire(), first)
+        self.assertEqual(self.checked, [first])
+        stats = self.pool.stats()
+        self.assertEqual((stats['opened'], stats['reused'], stats['in_use'],
+                          stats['idle']), (1, 1, 1, 0))
+
+    def test_broken_connections_replaced(self):
+        first = self.acquire()
+        first.usable = False
+        self.release(first)
+        second = self.acquire()
+        self.assertIsNot(second, first)
+        self.assertTrue(first.closed)
+        self.assertEqual(self.pool.stats()['failed_checks'], 1)
+
+        # Not reset cleanly when given back
+        self.release(second, usable=False)
+        self.assertTrue(second.closed)
+        self.assertEqual(self.pool.stats()['discarded'], 2)
+
+    def test_old_connections_replaced(self):
+        self.pool.max_age = 0
+        first = self.acquire()
+        self.release(first)
+        self.assertTrue(first.closed)
+        self.assertIsNot(self.acquire(), first)
+
+    def test_full_pool_waits_then_times_out(self):
+        first = self.acquire()
+        self.acquire()
+        threading.Timer(0.01, self.release, [first]).start()
+        self.assertIs(self.acquire(), first)
+        with self.assertRaises(PoolTimeout):
+            self.acquire()
+        stats = self.pool.stats()
+        self.assertEqual((stats['waits'], stats['timeouts']), (2, 1))
+
+    def test_closed_pool_closes_connections(self):
+        first, second = self.acquire(), self.acquire()
+        self.release(first)
+        self.pool.close()
+        self.assertTrue(first.closed)
+        self.release(second)
+        self.assertTrue(second.closed)
+
+
+class SQLiteBackendTest(SimpleTestCase):
+
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        DatabaseWrapper = load_backend(
+            'catalog.dbbackends.sqlite3').DatabaseWrapper
+        self.wrapper = DatabaseWrapper({
+            'ENGINE': 'catalog.dbbackends.sqlite3',
+            'NAME': os.path.join(directory, 'test.sqlite3'),
+            'POOL': {'MAX_SIZE': 2}, 'CONN_MAX_AGE': 0, 'OPTIONS': {},
+            'AUTOCOMMIT': True, 'ATOMIC_REQUESTS': False, 'TIME_ZONE': None,
+        }, alias='pooltest')
+        self.addCleanup(close_pools, 'pooltest')
+        self.addCleanup(self.wrapper.close)
+
+    def execute(self, sql):
+        with self.wrapper.cursor() as cursor:
+            cursor.execute(sql)
+
+    def query(self, sql):
+        with self.wrapper.cursor() as cursor:
+            cursor.execute(sql)
+            return cursor.fetchone()[0]
+
+    def test_pragmas_set(self):
+        self.assertEqual(self.query('PRAGMA journal_mode'), 'wal')
+        # NORMAL
+        self.assertEqual(self.query('PRAGMA synchronous'), 1)
+        self.assertEqual(self.query('PRAGMA busy_timeout'), 5000)
+
+    def test_connections_pooled_across_requests(self):
+        self.execute('CREATE TABLE item (id integer)')
+        raw = self.wrapper.connection
+        # A transaction left open is rolled back
+        self.wrapper.set_autocommit(False)
+        self.execute('INSERT INTO item VALUES (1)')
+        self.wrapper.close()
+        self.assertIsNone(self.wrapper.connection)
+
+        self.assertEqual(self.query('SELECT count(*) FROM item'), 0)
+        self.assertIs(self.wrapper.connection, raw)
+        stats = [stats for stats in pool_stats()
+                 if stats['alias'] == 'pooltest'][0]
+        self.assertEqual((stats['opened'], stats['reused']), (1, 1))
+
+
+class SettingsTest(TestCase):
+
+    def test_default_database_pooled(self):
+        self.assertEqual(connection.settings_dict['ENGINE'],
+                         'catalog.dbbackends.sqlite3')
+        self.assertIn('POOL', connection.settings_dict)
+        self.assertEqual(connection.settings_dict['CONN_MAX_AGE'], 0)
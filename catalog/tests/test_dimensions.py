@@ -0,0 +1,113 @@
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.urlresolvers import reverse
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+
+from catalog import dimensions
+from catalog.caching import bump_versions
+from catalog.dimensions import end_request, genres, languages, start_request
+from catalog.forms import BookForm
+from catalog.models import Author, Book, BookInstance, Genre, Language
+
+
+class DimensionTest(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.fiction = Genre.objects.create(name='Fiction')
+        self.poetry = Genre.objects.create(name='Poetry')
+        self.english = Language.objects.create(name='English')
+
+    def test_names_loaded_once(self):
+        with self.assertNumQueries(1):
+            self.assertEqual(genres.name(self.fiction.pk), 'Fiction')
+            self.assertEqual(genres.choices(), [(self.fiction.pk, 'Fiction'),
+                                                (self.poetry.pk, 'Poetry')])
+            self.assertEqual(genres.names([self.poetry.pk]),
+                             {self.poetry.pk: 'Poetry'})
+
+    def test_changes_seen_at_once_by_this_process(self):
+        genres.choices()
+        self.fiction.name = 'Novels'
+        self.fiction.save()
+        self.assertEqual(genres.name(self.fiction.pk), 'Novels')
+        self.poetry.delete()
+        self.assertEqual(genres.choices(), [(self.fiction.pk, 'Novels')])
+
+    def test_changes_by_other_processes_seen_from_next_request(self):
+        start_request()
+        self.addCleanup(end_request)
+        genres.choices()
+        # Another worker renames the genre: here only the version changes
+        Genre.objects.filter(pk=self.fiction.pk).update(name='Novels')
+        bump_versions('genre')
+        # The version is checked once per request
+        self.assertEqual(genres.name(self.fiction.pk), 'Fiction')
+        end_request()
+        start_request()
+        self.assertEqual(genres.name(self.fiction.pk), 'Novels')
+
+    def test_missed_bump_reloads(self):
+        start_request()
+        self.addCleanup(end_request)
+        genres.choices()
+        # Added without bumping the version
+        Genre.objects.bulk_create([Genre(name='Drama')])
+        drama = Genre.objects.get(name='Drama')
+        self.assertEqual(genres.names([drama.pk, self.fiction.pk]),
+                         {drama.pk: 'Drama', self.fiction.pk: 'Fiction'})
+
+        Genre.objects.filter(pk=drama.pk).update(name='Plays')
+        self.assertIn((drama.pk, 'Drama'), genres.choices())
+        genres.snapshot.loaded -= dimensions.MAX_AGE + 1
+        end_request()
+        start_request()
+        self.assertIn((drama.pk, 'Plays'), genres.choices())
+
+    def test_model_names_from_cache(self):
+        book = Book.objects.create(title='Book', summary='Summary', isbn='1')
+        book.genre.add(self.poetry, self.fiction)
+        copy = BookInstance.objects.create(book=book, imprint='Imprint',
+                                           language=self.english)
+        genres.choices()
+        languages.choices()
+
+        copy = BookInstance.objects.get(pk=copy.pk)
+        with self.assertNumQueries(0):
+            self.assertEqual(copy.language_name, 'English')
+        book = Book.objects.get(pk=book.pk)
+        # Only the book's links to its genres
+        with self.assertNumQueries(1):
+            self.assertEqual(book.display_genre(), 'Fiction, Poetry')
+
+    def test_book_form(self):
+        genres.choices()
+        with self.assertNumQueries(0):
+            self.assertEqual(list(BookForm().fields['genre'].choices),
+                             [(self.fiction.pk, 'Fiction'),
+                              (self.poetry.pk, 'Poetry')])
+
+        author = Author.objects.create(first_name='John', last_name='Smith')
+        data = {'title': 'Book', 'summary': 'Summary', 'isbn': '1',
+                'author': author.pk, 'genre': [str(self.poetry.pk)]}
+        form = BookForm(data=data)
+        self.assertTrue(form.is_valid(), form.errors)
+        self.assertEqual(list(form.save().genre.all()), [self.poetry])
+
+        form = BookForm(data=dict(data, genre=['999', 'x']))
+        self.assertIn('genre', form.errors)
+
+    def test_admin_forms_do_not_query_names(self):
+        User.objects.create_superuser('admin', 'admin@example.com', '12345')
+        self.client.login(username='admin', password='12345')
+        url = reverse('admin:catalog_book_add')
+        self.client.get(url)
+        with CaptureQueriesContext(connection) as queries:
+            resp = self.client.get(url)
+        # In the three copy forms and the one added by "Add another"
+        self.assertContains(resp, 'English', count=4)
+        self.assertFalse([query for query in queries
+                          if 'catalog_language' in query['sql'] or
+                          'catalog_genre' in query['sql']])
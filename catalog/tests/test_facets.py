@@ -0,0 +1,156 @@
+from unittest import mock
+
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.core.urlresolvers import reverse
+from django.test import TestCase
+from django.utils.six import StringIO
+
+from catalog import facets
+from catalog.facets import AVAILABLE, adjust_counts, facet_counts
+from catalog.loans import checkout, return_copy
+from catalog.models import (Author, Book, BookFacet, BookInstance,
+                            FacetCount, FacetPairCount, Genre, Language)
+
+
+class FacetTest(TestCase):
+
+    def setUp(self):
+        self.smith = Author.objects.create(first_name='John',
+                                           last_name='Smith')
+        self.jones = Author.objects.create(first_name='Jane',
+                                           last_name='Jones')
+        self.fiction = Genre.objects.create(name='Fiction')
+        self.poetry = Genre.objects.create(name='Poetry')
+        self.english = Language.objects.create(name='English')
+        self.french = Language.objects.create(name='French')
+
+        self.novel = Book.objects.create(title='Novel', summary='Summary',
+                                         isbn='1', author=self.smith)
+        self.novel.genre.add(self.fiction)
+        self.poems = Book.objects.create(title='Poems', summary='Summary',
+                                         isbn='2', author=self.jones)
+        self.poems.genre.add(self.fiction, self.poetry)
+        self.copy = BookInstance.objects.create(
+            book=self.novel, imprint='Imprint', language=self.english,
+            status='a')
+        BookInstance.objects.create(book=self.poems, imprint='Imprint',
+                                    language=self.french, status='o')
+
+    def counts(self, *filters):
+        return dict((facet, dict(counts))
+                    for facet, counts in facet_counts(list(filters)).items())
+
+    def stored(self):
+        return (
+            set(BookFacet.objects.values_list('facet', 'value', 'book_id')),
+            set(FacetCount.objects.filter(count__gt=0).values_list(
+                'facet', 'value', 'count')),
+            set(FacetPairCount.objects.filter(count__gt=0).values_list(
+                'facet', 'value', 'other_facet', 'other_value', 'count')))
+
+    def assertCountsCurrent(self):
+        stored = self.stored()
+        call_command('rebuild_facets', stdout=StringIO())
+        self.assertEqual(stored, self.stored())
+
+    def test_unfiltered_counts(self):
+        self.assertEqual(self.counts(), {
+            'g': {self.fiction.pk: 2, self.poetry.pk: 1},
+            'l': {self.english.pk: 1, self.french.pk: 1},
+            'a': {self.smith.pk: 1, self.jones.pk: 1},
+            'v': {AVAILABLE: 1},
+        })
+        self.assertCountsCurrent()
+
+    def test_filtered_counts(self):
+        self.assertEqual(self.counts(('g', self.poetry.pk)), {
+            'g': {self.fiction.pk: 1, self.poetry.pk: 1},
+            'l': {self.french.pk: 1},
+            'a': {self.jones.pk: 1},
+            'v': {},
+        })
+        self.assertEqual(
+            self.counts(('g', self.fiction.pk), ('v', AVAILABLE))['a'],
+            {self.smith.pk: 1})
+        self.assertEqual(self.counts(('a', self.jones.pk))['g'],
+                         {self.fiction.pk: 1, self.poetry.pk: 1})
+
+    def test_counts_follow_changes(self):
+        self.poems.genre.remove(self.fiction)
+        self.novel.author = self.jones
+        self.novel.save()
+        BookInstance.objects.create(book=self.novel, imprint='Imprint',
+                                    language=self.french, status='a')
+        counts = self.counts()
+        self.assertEqual(counts['g'], {self.fiction.pk: 1,
+                                       self.poetry.pk: 1})
+        self.assertEqual(counts['a'], {self.jones.pk: 2})
+        self.assertEqual(counts['l'], {self.english.pk: 1,
+                                       self.french.pk: 2})
+        self.assertCountsCurrent()
+
+    def test_loans_update_availability(self):
+        reader = User.objects.create_user('reader', password='12345')
+        checkout(self.copy.pk, reader)
+        self.assertEqual(self.counts()['v'], {})
+        self.assertEqual(self.counts(('a', self.smith.pk))['v'], {})
+        return_copy(self.copy.pk)
+        self.assertEqual(self.counts()['v'], {AVAILABLE: 1})
+        self.assertEqual(self.counts(('a', self.smith.pk))['v'],
+                         {AVAILABLE: 1})
+
+    def test_deletions(self):
+        self.poetry.delete()
+        self.smith.delete()
+        self.english.delete()
+        self.poems.delete()
+        self.assertEqual(self.counts(), {
+            'g': {self.fiction.pk: 1}, 'l': {}, 'a': {},
+            'v': {AVAILABLE: 1},
+        })
+        self.assertCountsCurrent()
+
+    def test_counts_created_meanwhile(self):
+        key_conditions = facets.key_conditions
+        calls = []
+
+        def created_meanwhile(*args):
+            # The first read misses the rows, as if another transaction
+            # created them after it
+            calls.append(args)
+            return key_conditions(*args) if len(calls) > 1 else []
+
+        with mock.patch.object(facets, 'key_conditions', created_meanwhile):
+            adjust_counts(FacetCount, {('g', self.fiction.pk): 1,
+                                       ('g', 12345): 1})
+        self.assertEqual(
+            dict(((facet, value), count) for facet, value, count in
+                 FacetCount.objects.filter(facet='g').values_list(
+                     'facet', 'value', 'count')),
+            {('g', self.fiction.pk): 3, ('g', self.poetry.pk): 1,
+             ('g', 12345): 1})
+
+    def test_browse_view(self):
+        resp = self.client.get(reverse('book-browse'))
+        self.assertEqual(resp.status_code, 200)
+        self.assertTemplateUsed(resp, 'catalog/book_browse.html')
+        self.assertEqual(list(resp.context['book_list']),
+                         [self.novel, self.poems])
+
+        resp = self.client.get(reverse('book-browse'), {
+            'genre': [self.fiction.pk, 'x'], 'language': self.french.pk})
+        self.assertEqual(list(resp.context['book_list']), [self.poems])
+        genres = resp.context['facets'][0]['values']
+        self.assertEqual(
+            [(value['name'], value['count'], value['selected'])
+             for value in genres],
+            [('Fiction', 1, True), ('Poetry', 1, False)])
+        # Deselecting a value keeps the others
+        self.assertEqual(genres[0]['query'], 'language=%d' % self.french.pk)
+
+        # Values beyond any id are ignored like those that are not ids
+        resp = self.client.get(reverse('book-browse'), {
+            'genre': '9' * 23, 'language': [self.french.pk, 2 ** 31]})
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(list(resp.context['book_list']), [self.poems])
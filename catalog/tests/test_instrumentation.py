@@ -0,0 +1,81 @@
+import json
+
+from django.core.cache import cache
+from django.core.urlresolvers import reverse
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+
+from catalog.instrumentation import metrics
+from catalog.models import Author, Book
+
+
+class InstrumentationMiddlewareTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        author = Author.objects.create(first_name='John', last_name='Smith')
+        for number in range(3):
+            Book.objects.create(title='Book %s' % number, summary='Summary',
+                                isbn='ISBN%s' % number, author=author)
+
+    def setUp(self):
+        cache.clear()
+        metrics.reset()
+
+    def test_request_is_measured(self):
+        self.client.get(reverse('books'))
+        self.assertEqual(
+            metrics.requests.values[('books', 'GET', 200)], 1)
+        self.assertEqual(metrics.duration.counts[('books',)][-1], 1)
+        self.assertGreater(metrics.db_queries.sums[('books',)], 0)
+        self.assertGreater(metrics.db_duration.sums[('books',)], 0)
+        self.assertGreater(metrics.template_duration.sums[('books',)], 0)
+
+    def test_queries_not_logged(self):
+        self.assertFalse(connection.queries_logged)
+        self.client.get(reverse('books'))
+        self.assertEqual(len(connection.queries_log), 0)
+        self.assertFalse(connection.force_debug_cursor)
+        self.assertGreater(metrics.db_queries.sums[('books',)], 0)
+
+        # Queries logged anyway (as under DEBUG) are counted all the same
+        cache.clear()
+        metrics.reset()
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(reverse('books'))
+        self.assertEqual(metrics.db_queries.sums[('books',)], len(queries))
+
+    def test_page_cache_hits_and_misses(self):
+        self.client.get(reverse('books'))
+        self.client.get(reverse('books'))
+        self.assertEqual(metrics.cache.values[('books', 'miss')], 1)
+        self.assertEqual(metrics.cache.values[('books', 'hit')], 1)
+
+    def test_metrics_endpoint(self):
+        self.client.get(reverse('books'))
+        resp = self.client.get(reverse('catalog-metrics'))
+        self.assertEqual(resp.status_code, 200)
+        self.assertTrue(resp['Content-Type'].startswith('text/plain'))
+        content = resp.content.decode()
+        self.assertIn('# TYPE catalog_request_duration_seconds histogram',
+                      content)
+        self.assertIn('catalog_request_db_queries_bucket{view="books",'
+                      'le="+Inf"} 1', content)
+        self.assertIn('# TYPE catalog_db_pool_connections gauge', content)
+
+    def test_metrics_endpoint_forbidden_outside_internal_ips(self):
+        resp = self.client.get(reverse('catalog-metrics'),
+                               REMOTE_ADDR='10.1.2.3')
+        self.assertEqual(resp.status_code, 403)
+
+    @override_settings(CATALOG_SLOW_REQUEST_MS=0, CATALOG_SLOW_REQUEST_SQL=2)
+    def test_slow_request_logged_with_slowest_sql(self):
+        with self.assertLogs('catalog.slow_requests', 'WARNING') as logs:
+            self.client.get(reverse('books'))
+        entry = json.loads(logs.records[0].getMessage())
+        self.assertEqual(entry['event'], 'slow_request')
+        self.assertEqual(entry['view'], 'books')
+        self.assertEqual(entry['status'], 200)
+        self.assertGreater(entry['db_queries'], 0)
+        self.assertEqual(len(entry['slowest_sql']), 2)
@@ -0,0 +1,260 @@
+import datetime
+import random
+import threading
+import time
+
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.db import OperationalError, connection
+from django.test import TestCase, TransactionTestCase
+from django.utils.six import StringIO
+
+from catalog.loans import (LoanError, allocate_holds, cancel_hold, checkout,
+                           place_hold, renew, reserve, return_copies,
+                           return_copy)
+from catalog.models import Author, Book, BookInstance, Hold
+from catalog.stats import (BOOK_COUNTERS, count_book_copies, count_catalog,
+                           get_catalog_stats)
+
+
+class LoanAssertionsMixin(object):
+
+    def assertDerivedDataCurrent(self):
+        counted = count_book_copies()
+        zero = dict.fromkeys(BOOK_COUNTERS, 0)
+        for book in Book.objects.values('pk', *BOOK_COUNTERS):
+            self.assertEqual(
+                dict((name, book[name]) for name in BOOK_COUNTERS),
+                counted.get(book['pk'], zero))
+        self.assertEqual(get_catalog_stats(), count_catalog())
+
+
+class LoanServiceTest(LoanAssertionsMixin, TestCase):
+
+    def setUp(self):
+        self.reader = User.objects.create_user('reader', password='12345')
+        self.other = User.objects.create_user('other', password='12345')
+        author = Author.objects.create(first_name='John', last_name='Smith')
+        self.book = Book.objects.create(title='Book', summary='Summary',
+                                        isbn='ABCDEFG', author=author)
+        self.copies = [
+            BookInstance.objects.create(book=self.book, imprint='Imprint',
+                                        status='a')
+            for _ in range(3)]
+        get_catalog_stats()
+
+    def copy(self, index):
+        return BookInstance.objects.get(pk=self.copies[index].pk)
+
+    def test_checkout_and_return(self):
+        due_back = checkout(self.copies[0].pk, self.reader)
+        copy = self.copy(0)
+        self.assertEqual((copy.status, copy.borrower, copy.due_back),
+                         ('o', self.reader, due_back))
+        self.assertDerivedDataCurrent()
+
+        return_copy(self.copies[0].pk)
+        copy = self.copy(0)
+        self.assertEqual((copy.status, copy.borrower, copy.due_back),
+                         ('a', None, None))
+        self.assertDerivedDataCurrent()
+
+    def test_checkout_of_copy_on_loan_fails(self):
+        checkout(self.copies[0].pk, self.reader)
+        with self.assertRaises(LoanError):
+            checkout(self.copies[0].pk, self.other)
+        self.assertEqual(self.copy(0).borrower, self.reader)
+
+    def test_reserved_copy_only_lent_to_its_holder(self):
+        reserve(self.copies[0].pk, self.reader)
+        self.assertEqual(self.copy(0).status, 'r')
+        with self.assertRaises(LoanError):
+            checkout(self.copies[0].pk, self.other)
+        checkout(self.copies[0].pk, self.reader)
+        self.assertEqual(self.copy(0).status, 'o')
+        self.assertDerivedDataCurrent()
+
+    def test_renew(self):
+        with self.assertRaises(LoanError):
+            renew(self.copies[0].pk, datetime.date(2030, 1, 1))
+        checkout(self.copies[0].pk, self.reader)
+        with self.assertRaises(LoanError):
+            renew(self.copies[0].pk, datetime.date(2030, 1, 1),
+                  borrower=self.other)
+        renew(self.copies[0].pk, datetime.date(2030, 1, 1))
+        self.assertEqual(self.copy(0).due_back, datetime.date(2030, 1, 1))
+
+    def test_return_cart(self):
+        checkout(self.copies[0].pk, self.reader)
+        checkout(self.copies[1].pk, self.other)
+        returned, failed = return_copies(
+            [str(self.copies[0].pk), self.copies[1].pk, self.copies[2].pk,
+             'not-a-uuid'])
+        self.assertEqual(sorted(returned),
+                         sorted([self.copies[0].pk, self.copies[1].pk]))
+        self.assertEqual(failed, ['not-a-uuid', self.copies[2].pk])
+        self.assertDerivedDataCurrent()
+
+    def test_return_cart_queries_do_not_grow_with_the_cart(self):
+        checkout(self.copies[0].pk, self.reader)
+        # Lock, update, book counters, statistic, availability facet and
+        # authors to expire, then the returned copies and the holds on
+        # their books, with a savepoint around each step and one around
+        # both
+        with self.assertNumQueries(17):
+            return_copies([self.copies[0].pk])
+        for _ in range(20):
+            BookInstance.objects.create(book=self.book, imprint='Imprint',
+                                        status='o', borrower=self.reader)
+        pks = list(BookInstance.objects.filter(
+            status__exact='o').values_list('pk', flat=True))
+        with self.assertNumQueries(17):
+            return_copies(pks)
+
+
+class HoldTest(LoanAssertionsMixin, TestCase):
+
+    def setUp(self):
+        self.readers = [User.objects.create_user('reader%d' % n)
+                        for n in range(3)]
+        self.book = Book.objects.create(title='Book', summary='Summary',
+                                        isbn='ABCDEFG')
+        self.other_book = Book.objects.create(title='Other',
+                                              summary='Summary', isbn='123')
+        self.copies = [
+            BookInstance.objects.create(book=self.book, imprint='Imprint',
+                                        status='o', borrower=self.readers[0])
+            for _ in range(2)]
+        get_catalog_stats()
+
+    def holder(self, copy):
+        copy = BookInstance.objects.get(pk=copy.pk)
+        return copy.status, copy.borrower
+
+    def test_returned_copy_goes_to_the_oldest_hold(self):
+        first = place_hold(self.book.pk, self.readers[1])
+        second = place_hold(self.book.pk, self.readers[2])
+        self.assertEqual(first.status, 'w')
+        with self.assertRaises(LoanError):
+            place_hold(self.book.pk, self.readers[1])
+
+        return_copy(self.copies[0].pk)
+        self.assertEqual(self.holder(self.copies[0]), ('r', self.readers[1]))
+        first.refresh_from_db()
+        self.assertEqual((first.status, first.copy_id),
+                         ('f', self.copies[0].pk))
+        second.refresh_from_db()
+        self.assertEqual(second.status, 'w')
+        self.assertDerivedDataCurrent()
+
+        # Only its holder can borrow the reserved copy
+        with self.assertRaises(LoanError):
+            checkout(self.copies[0].pk, self.readers[2])
+        checkout(self.copies[0].pk, self.readers[1])
+
+    def test_hold_on_available_copy_fulfilled_at_once(self):
+        return_copy(self.copies[0].pk)
+        hold = place_hold(self.book.pk, self.readers[1])
+        self.assertEqual((hold.status, hold.copy_id),
+                         ('f', self.copies[0].pk))
+
+    def test_cancelled_hold_passes_its_copy_on(self):
+        first = place_hold(self.book.pk, self.readers[1])
+        place_hold(self.book.pk, self.readers[2])
+        return_copy(self.copies[0].pk)
+        with self.assertRaises(LoanError):
+            cancel_hold(first.pk, borrower=self.readers[2])
+        cancel_hold(first.pk, borrower=self.readers[1])
+        self.assertEqual(self.holder(self.copies[0]), ('r', self.readers[2]))
+        self.assertDerivedDataCurrent()
+
+    def test_batch_allocation(self):
+        holds = [place_hold(book.pk, reader) for book in (
+            self.book, self.other_book) for reader in self.readers]
+        extra = BookInstance.objects.create(
+            book=self.other_book, imprint='Imprint', status='o')
+        # Made available behind the loan service's back
+        BookInstance.objects.filter(pk__in=[
+            self.copies[0].pk, self.copies[1].pk, extra.pk]).update(
+            status='a', borrower=None)
+        call_command('reconcile_book_counters', stdout=StringIO())
+        call_command('rebuild_catalog_stats', stdout=StringIO())
+
+        fulfilled = allocate_holds()
+        self.assertEqual(sorted(fulfilled),
+                         [holds[0].pk, holds[1].pk, holds[3].pk])
+        self.assertEqual(
+            Hold.objects.filter(status__exact='f').count(), 3)
+        self.assertFalse(BookInstance.objects.filter(
+            status__exact='a').exists())
+        self.assertDerivedDataCurrent()
+
+
+class LoanConcurrencyTest(LoanAssertionsMixin, TransactionTestCase):
+    """
+    Many threads (each with its own database connection) fighting over
+    the same copies.
+    """
+    THREADS = 8
+    COPIES = 10
+
+    def setUp(self):
+        book = Book.objects.create(title='Book', summary='Summary',
+                                   isbn='ABCDEFG')
+        self.users = [User.objects.create_user('reader%d' % n)
+                      for n in range(self.THREADS)]
+        self.pks = [BookInstance.objects.create(
+            book=book, imprint='Imprint', status='a').pk
+            for _ in range(self.COPIES)]
+        get_catalog_stats()
+
+    def run_threads(self, operation):
+        """
+        Apply operation(pk, user) to every copy from every thread, in a
+        random order; returns the number of successful operations.
+        """
+        successes = []
+        errors = []
+
+        def worker(user):
+            pks = list(self.pks)
+            random.shuffle(pks)
+            try:
+                for pk in pks:
+                    for attempt in range(50):
+                        try:
+                            operation(pk, user)
+                            successes.append(pk)
+                        except LoanError:
+                            pass
+                        except OperationalError:
+                            # SQLite: the database is locked by another
+                            # writer, try again
+                            time.sleep(0.01)
+                            continue
+                        break
+                    else:
+                        errors.append(pk)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=worker, args=(user,))
+                   for user in self.users]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(errors, [])
+        return successes
+
+    def test_each_copy_lent_and_returned_once(self):
+        lent = self.run_threads(checkout)
+        self.assertEqual(sorted(lent), sorted(self.pks))
+        self.assertEqual(
+            BookInstance.objects.filter(status__exact='o').count(),
+            self.COPIES)
+        self.assertDerivedDataCurrent()
+
+        returned = self.run_threads(lambda pk, user: return_copy(pk))
+        self.assertEqual(sorted(returned), sorted(self.pks))
+        self.assertDerivedDataCurrent()
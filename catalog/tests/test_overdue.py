@@ -0,0 +1,128 @@
+import datetime
+from decimal import Decimal
+
+from django.contrib.auth.models import User
+from django.core import mail
+from django.core.mail.backends.locmem import EmailBackend
+from django.core.management import call_command
+from django.test import TestCase
+from django.utils.six import StringIO
+
+from catalog.loans import return_copy
+from catalog.models import Book, BookInstance
+from catalog.overdue import process_overdue
+
+
+class RefusingEmailBackend(EmailBackend):
+    """
+    Sends nothing to bob, as a mail server refusing his address would.
+    """
+
+    def send_messages(self, messages):
+        return super(RefusingEmailBackend, self).send_messages(
+            [message for message in messages
+             if message.to != ['bob@example.com']])
+
+
+class OverdueLoansTest(TestCase):
+
+    def setUp(self):
+        self.today = datetime.date(2030, 6, 15)
+        self.alice = User.objects.create_user(
+            'alice', 'alice@example.com', 'password')
+        self.bob = User.objects.create_user('bob', 'bob@example.com',
+                                            'password')
+        self.nomail = User.objects.create_user('nomail', '', 'password')
+        book = Book.objects.create(title='Book', summary='Summary',
+                                   isbn='ABCDEFG')
+
+        def lend(borrower, days_overdue, status='o'):
+            return BookInstance.objects.create(
+                book=book, imprint='Imprint', status=status,
+                borrower=borrower,
+                due_back=self.today - datetime.timedelta(days=days_overdue))
+
+        self.late = [lend(self.alice, 10), lend(self.alice, 3),
+                     lend(self.bob, 3), lend(self.nomail, 1)]
+        self.on_time = [lend(self.alice, 0), lend(self.bob, -5),
+                        lend(self.bob, 10, status='a')]
+        self.unlent = BookInstance.objects.create(book=book,
+                                                  imprint='Imprint',
+                                                  status='a')
+
+    def test_is_overdue_without_due_date(self):
+        self.assertFalse(self.unlent.is_overdue)
+
+    def test_overdue_annotation(self):
+        overdue = dict(BookInstance.objects.with_overdue(
+            self.today).values_list('id', 'overdue'))
+        for copy in self.late:
+            self.assertTrue(overdue[copy.pk])
+        for copy in self.on_time + [self.unlent]:
+            self.assertFalse(overdue[copy.pk])
+
+    def test_fines(self):
+        fined, borrowers, sent = process_overdue(today=self.today,
+                                                 notify=False)
+        self.assertEqual((fined, borrowers, sent), (4, 3, 0))
+        fines = dict(BookInstance.objects.values_list('id', 'fine'))
+        self.assertEqual([fines[copy.pk] for copy in self.late],
+                         [Decimal('2.00'), Decimal('0.60'), Decimal('0.60'),
+                          Decimal('0.20')])
+        for copy in self.on_time:
+            self.assertEqual(fines[copy.pk], 0)
+        self.assertEqual(len(mail.outbox), 0)
+
+    def test_one_reminder_per_borrower(self):
+        with self.assertNumQueries(8):
+            # The due dates, an update per due date inside a savepoint,
+            # the loans and their borrowers, an update per email batch
+            process_overdue(today=self.today)
+        self.assertEqual(sorted(message.to[0] for message in mail.outbox),
+                         ['alice@example.com', 'bob@example.com'])
+        alice = [message for message in mail.outbox
+                 if message.to == ['alice@example.com']][0]
+        self.assertIn('2.60', alice.body)
+
+    def test_reminder_not_escaped(self):
+        self.alice.first_name = "Sean O'Brien"
+        self.alice.save()
+        Book.objects.update(title='Pride & Prejudice')
+        process_overdue(today=self.today)
+        alice = [message for message in mail.outbox
+                 if message.to == ['alice@example.com']][0]
+        self.assertIn("Dear Sean O'Brien,", alice.body)
+        self.assertIn('- Pride & Prejudice, due back', alice.body)
+
+    def test_only_sent_reminders_recorded(self):
+        fined, borrowers, sent = process_overdue(
+            today=self.today, connection=RefusingEmailBackend())
+        self.assertEqual(sent, 1)
+        notified = dict(BookInstance.objects.values_list(
+            'id', 'overdue_notified'))
+        self.assertEqual([notified[copy.pk] for copy in self.late],
+                         [self.today, self.today, None, None])
+        # Bob is reminded on the next run
+        process_overdue(today=self.today)
+        self.assertEqual([message.to for message in mail.outbox],
+                         [['alice@example.com'], ['bob@example.com']])
+
+    def test_return_clears_fine_and_reminder(self):
+        process_overdue(today=self.today)
+        return_copy(self.late[0].pk)
+        self.late[0].refresh_from_db()
+        self.assertEqual((self.late[0].fine, self.late[0].overdue_notified),
+                         (0, None))
+
+    def test_reminders_not_repeated_within_interval(self):
+        process_overdue(today=self.today)
+        process_overdue(today=self.today)
+        self.assertEqual(len(mail.outbox), 2)
+        process_overdue(today=self.today + datetime.timedelta(days=7))
+        self.assertEqual(len(mail.outbox), 4)
+
+    def test_command(self):
+        out = StringIO()
+        call_command('process_overdue', '--date', '2030-06-15', stdout=out)
+        self.assertIn('4 overdue loans fined, 3 borrowers, 2 reminders sent',
+                      out.getvalue())
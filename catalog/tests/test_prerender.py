@@ -0,0 +1,124 @@
+import os
+import shutil
+import tempfile
+
+from django.core.cache import cache
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from django.utils.six import StringIO
+
+from catalog.models import Author, Book
+from catalog.prerender import PrerenderedPages, page_file, prerender_catalog
+
+
+class PrerenderTest(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.root)
+        self.author = Author.objects.create(first_name='John',
+                                            last_name='Smith')
+        self.books = [
+            Book.objects.create(title='Book %d' % n, summary='Summary',
+                                isbn=str(n), author=self.author)
+            for n in range(4)]
+
+    def prerender(self, **kwargs):
+        return prerender_catalog(processes=1, root=self.root, **kwargs)
+
+    def read(self, path, query=''):
+        with open(page_file(self.root, path, query), 'rb') as page:
+            return page.read()
+
+    def test_renders_every_page(self):
+        stats = self.prerender()
+        # Two pages of books, one of authors, and the detail pages
+        self.assertEqual((stats['pages'], stats['rendered'],
+                          stats['written']), (8, 8, 8))
+        self.assertIn(b'Book 3', self.read('/catalog/books/', 'page=2'))
+        self.assertIn(b'Book 0', self.read(self.books[0].get_absolute_url()))
+        self.assertTrue(os.path.exists(page_file(
+            self.root, self.author.get_absolute_url()) + '.gz'))
+
+    def test_only_stale_pages_rendered_and_changed_files_written(self):
+        self.prerender()
+        self.assertEqual(self.prerender()['rendered'], 0)
+
+        self.books[0].title = 'Renamed'
+        self.books[0].save()
+        stats = self.prerender()
+        # The book, its author and the book lists depend on the change
+        # (the author list does not); only the second page of books does
+        # not show the title
+        self.assertEqual((stats['rendered'], stats['written']), (4, 3))
+        self.assertIn(b'Renamed', self.read(self.books[0].get_absolute_url()))
+
+        stats = self.prerender(full=True)
+        self.assertEqual((stats['rendered'], stats['written']), (8, 0))
+
+    def test_pages_of_deleted_objects_removed(self):
+        self.prerender()
+        filename = page_file(self.root, self.books[3].get_absolute_url())
+        self.books[3].delete()
+        stats = self.prerender()
+        # The book and the second page of books
+        self.assertEqual(stats['removed'], 2)
+        self.assertFalse(os.path.exists(filename))
+
+    def test_command(self):
+        out = StringIO()
+        with override_settings(CATALOG_PRERENDER_ROOT=self.root):
+            call_command('prerender_catalog', processes=1, stdout=out)
+        self.assertIn('Rendered 8 of 8 pages', out.getvalue())
+
+
+class PrerenderedPagesTest(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.root)
+        self.book = Book.objects.create(
+            title='Book', summary='Summary', isbn='1',
+            author=Author.objects.create(first_name='John',
+                                         last_name='Smith'))
+        prerender_catalog(processes=1, root=self.root)
+        self.application = PrerenderedPages(self.django, root=self.root)
+
+    def django(self, environ, start_response):
+        start_response('200 OK', [])
+        return [b'From Django']
+
+    def get(self, path, **environ):
+        environ.update({'REQUEST_METHOD': 'GET', 'PATH_INFO': path})
+        status = []
+        content = b''.join(self.application(
+            environ, lambda line, headers: status.append(line)))
+        return status[0], content
+
+    def test_current_pages_served_to_anonymous_visitors(self):
+        status, content = self.get(self.book.get_absolute_url())
+        self.assertEqual(status, '200 OK')
+        self.assertEqual(content, self.read_page())
+        self.assertEqual(self.get('/catalog/books/', QUERY_STRING='page=1')[1],
+                         self.read_page('/catalog/books/'))
+
+    def read_page(self, path=None):
+        with open(page_file(self.root, path or
+                            self.book.get_absolute_url()), 'rb') as page:
+            return page.read()
+
+    def test_other_requests_go_to_django(self):
+        url = self.book.get_absolute_url()
+        self.assertEqual(self.get(url, HTTP_COOKIE='sessionid=abc')[1],
+                         b'From Django')
+        self.assertEqual(self.get('/catalog/books/', QUERY_STRING='page=x')[1],
+                         b'From Django')
+        self.assertEqual(self.get('/catalog/')[1], b'From Django')
+
+    def test_stale_pages_go_to_django(self):
+        self.book.title = 'Renamed'
+        self.book.save()
+        self.assertEqual(self.get(self.book.get_absolute_url())[1],
+                         b'From Django')
@@ -0,0 +1,74 @@
+from django.contrib.auth.models import User
+from django.http import HttpResponse
+from django.test import RequestFactory, TestCase, override_settings
+
+from catalog.models import Author, Book, BookInstance
+from catalog.routers import (PrimaryReplicaRouter, ReplicaStickinessMiddleware,
+                             STICKY_COOKIE, use_primary)
+
+
+@override_settings(CATALOG_REPLICAS=['replica1'])
+class PrimaryReplicaRouterTest(TestCase):
+
+    def setUp(self):
+        self.router = PrimaryReplicaRouter()
+        self.factory = RequestFactory()
+
+    def handle(self, request, view):
+        """
+        Run view(request) through the middleware; returns the response and
+        what the view returned.
+        """
+        seen = {}
+
+        def get_response(request):
+            seen['result'] = view()
+            return HttpResponse()
+
+        response = ReplicaStickinessMiddleware(get_response)(request)
+        return response, seen['result']
+
+    def test_reads_outside_requests_use_the_primary(self):
+        self.assertEqual(self.router.db_for_read(Book), 'default')
+
+    def test_catalog_reads_in_get_requests_use_replicas(self):
+        response, databases = self.handle(
+            self.factory.get('/catalog/books/'),
+            lambda: [self.router.db_for_read(model)
+                     for model in (Book, Author, BookInstance, User)])
+        self.assertEqual(databases,
+                         ['replica1', 'replica1', 'default', 'default'])
+        self.assertNotIn(STICKY_COOKIE, response.cookies)
+
+    def test_post_requests_use_the_primary(self):
+        response, database = self.handle(
+            self.factory.post('/catalog/author/create/'),
+            lambda: self.router.db_for_read(Author))
+        self.assertEqual(database, 'default')
+
+    def test_writes_stick_to_the_primary(self):
+        def view():
+            before = self.router.db_for_read(Book)
+            self.assertEqual(self.router.db_for_write(Book), 'default')
+            return before, self.router.db_for_read(Book)
+
+        response, databases = self.handle(
+            self.factory.get('/catalog/books/'), view)
+        self.assertEqual(databases, ('replica1', 'default'))
+        self.assertIn(STICKY_COOKIE, response.cookies)
+
+        request = self.factory.get('/catalog/books/')
+        request.COOKIES[STICKY_COOKIE] = '1'
+        response, database = self.handle(
+            request, lambda: self.router.db_for_read(Book))
+        self.assertEqual(database, 'default')
+
+    def test_use_primary(self):
+        def view():
+            with use_primary():
+                inside = self.router.db_for_read(Book)
+            return inside, self.router.db_for_read(Book)
+
+        response, databases = self.handle(
+            self.factory.get('/catalog/books/'), view)
+        self.assertEqual(databases, ('default', 'replica1'))
@@ -0,0 +1,84 @@
+from django.core.management import call_command
+from django.core.urlresolvers import reverse
+from django.test import TestCase
+from django.utils.six import StringIO
+
+from catalog.models import Author, Book, BookSearchTerm, Genre
+from catalog.search import search_books, tokenize
+
+
+class TokenizeTest(TestCase):
+
+    def test_lowercases_and_drops_stop_words(self):
+        self.assertEqual(tokenize('The Art of Computer Programming'),
+                         ['art', 'computer', 'programming'])
+
+    def test_empty_text(self):
+        self.assertEqual(tokenize(None), [])
+
+
+class BookSearchTest(TestCase):
+
+    def setUp(self):
+        self.author = Author.objects.create(first_name='Guido',
+                                            last_name='Rossum')
+        self.genre = Genre.objects.create(name='Programming')
+        self.python_book = Book.objects.create(
+            title='Learning Python', summary='A gentle introduction.',
+            isbn='1', author=self.author)
+        self.python_book.genre.add(self.genre)
+        self.snake_book = Book.objects.create(
+            title='Snakes of the world',
+            summary='Includes the python and the cobra.', isbn='2')
+
+    def titles(self, query):
+        return [book.title for book in search_books(query)[:10]]
+
+    def test_title_matches_rank_above_summary_matches(self):
+        self.assertEqual(self.titles('python'),
+                         ['Learning Python', 'Snakes of the world'])
+
+    def test_all_terms_must_match(self):
+        self.assertEqual(self.titles('python cobra'), ['Snakes of the world'])
+        self.assertEqual(self.titles('python haskell'), [])
+
+    def test_author_and_genre_names_are_indexed(self):
+        self.assertEqual(self.titles('rossum'), ['Learning Python'])
+        self.assertEqual(self.titles('programming'), ['Learning Python'])
+
+    def test_index_follows_changes(self):
+        self.python_book.title = 'Learning Haskell'
+        self.python_book.save()
+        self.assertEqual(self.titles('haskell'), ['Learning Haskell'])
+
+        self.genre.name = 'Functional'
+        self.genre.save()
+        self.assertEqual(self.titles('functional'), ['Learning Haskell'])
+
+        self.python_book.genre.clear()
+        self.assertEqual(self.titles('functional'), [])
+
+        self.author.delete()
+        self.assertEqual(self.titles('rossum'), [])
+
+    def test_deleted_books_leave_the_index(self):
+        self.snake_book.delete()
+        self.assertEqual(self.titles('cobra'), [])
+
+    def test_rebuild_command(self):
+        BookSearchTerm.objects.all().delete()
+        call_command('rebuild_search_index', stdout=StringIO())
+        self.assertEqual(self.titles('python'),
+                         ['Learning Python', 'Snakes of the world'])
+
+    def test_search_view(self):
+        resp = self.client.get(reverse('book-search'), {'q': 'Python'})
+        self.assertEqual(resp.status_code, 200)
+        self.assertTemplateUsed(resp, 'catalog/book_search.html')
+        self.assertEqual(list(resp.context['book_list']),
+                         [self.python_book, self.snake_book])
+
+    def test_search_view_without_query(self):
+        resp = self.client.get(reverse('book-search'))
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(list(resp.context['book_list']), [])
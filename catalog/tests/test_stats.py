@@ -0,0 +1,156 @@
+from django.core.management import call_command
+from django.core.urlresolvers import reverse
+from django.test import TestCase
+from django.utils.six import StringIO
+
+from catalog.models import (Author, Book, BookInstance, CatalogStatistic,
+                            Genre, Language)
+from catalog.stats import (BOOK_COUNTERS, count_book_copies, count_catalog,
+                           get_catalog_stats)
+
+
+class CatalogStatsTest(TestCase):
+
+    def setUp(self):
+        self.author = Author.objects.create(first_name='John',
+                                            last_name='Smith')
+        self.genre = Genre.objects.create(name='Fantasy')
+        self.language = Language.objects.create(name='English')
+        self.book = Book.objects.create(
+            title='Learning Python', summary='My book summary',
+            isbn='ABCDEFG', author=self.author)
+        for status in ('a', 'a', 'o'):
+            BookInstance.objects.create(
+                book=self.book, imprint='Unlikely Imprint, 2016',
+                status=status, language=self.language)
+        # Build the table now so the checks below exercise the signals
+        get_catalog_stats()
+
+    def assertStatsMatchCatalog(self):
+        self.assertEqual(get_catalog_stats(), count_catalog())
+
+    def test_stats_built_on_first_read(self):
+        CatalogStatistic.objects.all().delete()
+        stats = get_catalog_stats()
+        self.assertEqual(stats['num_books'], 1)
+        self.assertEqual(stats['num_instances'], 3)
+        self.assertEqual(stats['num_instances_available'], 2)
+        self.assertEqual(stats['num_python'], 1)
+
+    def test_stats_read_is_one_query(self):
+        with self.assertNumQueries(1):
+            get_catalog_stats()
+
+    def test_stats_follow_creates_and_deletes(self):
+        Author.objects.create(first_name='Jane', last_name='Doe')
+        Genre.objects.create(name='Poetry')
+        Book.objects.create(title='Poems', summary='Summary', isbn='123',
+                            author=self.author)
+        self.assertStatsMatchCatalog()
+
+        self.book.delete()
+        self.genre.delete()
+        self.assertStatsMatchCatalog()
+
+    def test_stats_follow_status_changes(self):
+        for copy in BookInstance.objects.all():
+            copy.status = 'o'
+            copy.save()
+        self.assertStatsMatchCatalog()
+
+        copy = BookInstance.objects.create(
+            book=self.book, imprint='Imprint', status='o',
+            language=self.language)
+        copy.status = 'a'
+        copy.save()
+        self.assertStatsMatchCatalog()
+
+    def test_stats_follow_title_changes(self):
+        self.book.title = 'Learning Ruby'
+        self.book.save()
+        self.assertStatsMatchCatalog()
+
+    def test_rebuild_command_fixes_drift(self):
+        CatalogStatistic.objects.filter(name='num_books').update(value=42)
+        call_command('rebuild_catalog_stats', stdout=StringIO())
+        self.assertStatsMatchCatalog()
+
+    def test_index_uses_stats(self):
+        resp = self.client.get(reverse('index'))
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(resp.context['num_books'], 1)
+        self.assertEqual(resp.context['num_instances_available'], 2)
+        self.assertEqual(resp.context['num_python'], 1)
+
+
+class BookCountersTest(TestCase):
+
+    def setUp(self):
+        self.book = Book.objects.create(title='Book', summary='Summary',
+                                        isbn='ABCDEFG')
+        self.other = Book.objects.create(title='Other', summary='Summary',
+                                         isbn='1234567')
+        for status in ('a', 'a', 'o', 'm'):
+            BookInstance.objects.create(book=self.book, imprint='Imprint',
+                                        status=status)
+
+    def assertCountersMatchCopies(self):
+        counted = count_book_copies()
+        zero = dict.fromkeys(BOOK_COUNTERS, 0)
+        for book in Book.objects.values('pk', *BOOK_COUNTERS):
+            self.assertEqual(dict((name, book[name]) for name in BOOK_COUNTERS),
+                             counted.get(book['pk'], zero))
+
+    def test_counters_follow_creates(self):
+        book = Book.objects.get(pk=self.book.pk)
+        self.assertEqual(book.copies_total, 4)
+        self.assertEqual(book.copies_available, 2)
+        self.assertEqual(book.copies_on_loan, 1)
+        self.assertEqual(book.copies_maintenance, 0)
+        self.assertCountersMatchCopies()
+
+    def test_counters_follow_status_changes_and_moves(self):
+        for copy in BookInstance.objects.filter(status='a'):
+            copy.status = 'r'
+            copy.save()
+        self.assertCountersMatchCopies()
+
+        copy = BookInstance.objects.filter(status='o').get()
+        copy.book = self.other
+        copy.status = 'd'
+        copy.save()
+        self.assertCountersMatchCopies()
+
+    def test_counters_follow_deletes(self):
+        BookInstance.objects.filter(status='a')[0].delete()
+        self.assertCountersMatchCopies()
+
+    def test_saving_book_keeps_counters(self):
+        # A stale copy of the book must not overwrite the counters
+        stale = Book.objects.get(pk=self.book.pk)
+        BookInstance.objects.create(book=self.book, imprint='Imprint',
+                                    status='a')
+        stale.title = 'New title'
+        stale.save()
+        self.assertEqual(Book.objects.get(pk=self.book.pk).copies_total, 5)
+
+    def test_reconcile_command_fixes_drift(self):
+        Book.objects.filter(pk=self.book.pk).update(copies_available=42)
+        Book.objects.filter(pk=self.other.pk).update(copies_total=3)
+        out = StringIO()
+        call_command('reconcile_book_counters', stdout=out)
+        self.assertIn('2 books fixed', out.getvalue())
+        self.assertCountersMatchCopies()
+
+    def test_drift_below_zero_reconciled(self):
+        # bulk_create skips the counters; the save then takes the copy
+        # off a counter it was never added to
+        BookInstance.objects.bulk_create([BookInstance(
+            book=self.other, imprint='Imprint', status='o')])
+        copy = BookInstance.objects.get(book=self.other)
+        copy.status = 'a'
+        copy.save()
+        self.assertEqual(Book.objects.get(pk=self.other.pk).copies_on_loan,
+                         -1)
+        call_command('reconcile_book_counters', stdout=StringIO())
+        self.assertCountersMatchCopies()
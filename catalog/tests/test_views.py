@@ -1,11 +1,21 @@
+import csv
 import datetime
+import json
+from unittest import mock
 
 from django.contrib.auth.models import Permission, User
+from django.core.cache import cache
 from django.core.urlresolvers import reverse
+from django.db import connection
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
 from django.utils import timezone
 
+from catalog.dimensions import genres, languages
+from catalog.loans import LoanError, place_hold
 from catalog.models import Author, BookInstance, Book, Genre, Language
+from catalog.pagination import KeysetPaginator
+from catalog.tests.utils import QueryBudgetMixin
 
 
 class AuthorListviewTest(TestCase):
@@ -18,6 +28,10 @@ class AuthorListviewTest(TestCase):
             Author.objects.create(first_name='Christian %s',
                                   last_name='Surname %s' % author_num)
 
+    def setUp(self):
+        # Render every page rather than serve it from an earlier test
+        cache.clear()
+
     def test_view_url_exists_at_desired_location(self):
         resp = self.client.get('/catalog/authors/')
         self.assertEqual(resp.status_code, 200)
@@ -301,3 +315,303 @@ class RenewBookInstancesViews(TestCase):
             'form',
             'renewal_date',
             'Invalid date - renewal more than 4 weeks')
+
+
+class CatalogViewQueryBudgetTest(QueryBudgetMixin, TestCase):
+    """
+    Each page must cost the same number of queries however many rows
+    it shows (no N+1 queries).
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.librarian = User.objects.create_user(
+            username='librarian', password='12345')
+        cls.librarian.user_permissions.add(
+            Permission.objects.get(name="Set book as returned"),
+            Permission.objects.get(name="Can change book instance"))
+
+        genres = [Genre.objects.create(name='Genre %s' % n) for n in range(3)]
+        language = Language.objects.create(name='English')
+        due_back = datetime.date.today() + datetime.timedelta(days=5)
+        for author_num in range(2):
+            author = Author.objects.create(
+                first_name='First %s' % author_num,
+                last_name='Last %s' % author_num)
+            for book_num in range(5):
+                book = Book.objects.create(
+                    title='Book %s-%s' % (author_num, book_num),
+                    summary='Summary', isbn='ISBN', author=author)
+                book.genre = genres
+                for copy_num in range(3):
+                    BookInstance.objects.create(
+                        book=book, imprint='Imprint', language=language,
+                        due_back=due_back, status='o',
+                        borrower=cls.librarian)
+        cls.author = author
+        cls.book = book
+
+    def setUp(self):
+        # Measure rendering, not pages cached by an earlier test
+        cache.clear()
+        # ... with the genre and language names loaded, as they are once
+        # per process (see catalog.dimensions)
+        genres.choices()
+        languages.choices()
+
+    def test_book_list_budget(self):
+        with self.assertQueryBudget(2):
+            resp = self.client.get(reverse('books'))
+        self.assertEqual(resp.status_code, 200)
+
+    def test_book_detail_budget(self):
+        with self.assertQueryBudget(3):
+            resp = self.client.get(self.book.get_absolute_url())
+        self.assertContains(resp, 'English', count=3)
+
+    def test_author_list_budget(self):
+        with self.assertQueryBudget(2):
+            resp = self.client.get(reverse('authors'))
+        self.assertEqual(resp.status_code, 200)
+
+    def test_author_detail_budget(self):
+        with self.assertQueryBudget(2):
+            resp = self.client.get(self.author.get_absolute_url())
+        self.assertContains(resp, '(3)', count=5)
+
+    def test_my_borrowed_budget(self):
+        self.client.login(username='librarian', password='12345')
+        # Session, user, the sidebar's two permission queries and the list
+        # (keyset pagination needs no count)
+        with self.assertQueryBudget(5):
+            resp = self.client.get(reverse('my-borrowed'))
+        self.assertEqual(len(resp.context['bookinstance_list']), 10)
+
+    def test_all_borrowed_budget(self):
+        self.client.login(username='librarian', password='12345')
+        with self.assertQueryBudget(5):
+            resp = self.client.get(reverse('all-borrowed'))
+        self.assertEqual(len(resp.context['bookinstance_list']), 10)
+
+
+class KeysetPaginationTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.librarian = User.objects.create_user(
+            username='librarian', password='12345')
+        cls.librarian.user_permissions.add(
+            Permission.objects.get(name="Set book as returned"),
+            Permission.objects.get(name="Can change book instance"))
+        book = Book.objects.create(title='Book', summary='Summary',
+                                   isbn='ISBN')
+        # Repeated due dates and a few missing ones, so the cursor has to
+        # fall back on the id and place NULLs correctly
+        for copy_num in range(25):
+            if copy_num % 7 == 0:
+                due_back = None
+            else:
+                due_back = datetime.date.today() + datetime.timedelta(
+                    days=copy_num % 4)
+            BookInstance.objects.create(
+                book=book, imprint='Imprint', due_back=due_back,
+                status='o', borrower=cls.librarian)
+
+    def test_pages_cover_every_row_once_in_order(self):
+        queryset = BookInstance.objects.all()
+        expected = list(queryset.order_by('due_back', 'id'))
+        paginator = KeysetPaginator(queryset, 10, ('due_back', 'id'))
+
+        pages = [paginator.page()]
+        while pages[-1].has_next():
+            pages.append(paginator.page(pages[-1].next_cursor))
+        self.assertEqual([len(page) for page in pages], [10, 10, 5])
+        self.assertEqual([obj for page in pages for obj in page], expected)
+        self.assertFalse(pages[0].has_previous())
+
+        # And back again from the last page
+        page = pages[-1]
+        for expected_page in reversed(pages[:-1]):
+            page = paginator.page(page.previous_cursor)
+            self.assertEqual(page.object_list, expected_page.object_list)
+        self.assertFalse(page.has_previous())
+
+    def test_view_links_pages_with_cursors(self):
+        self.client.login(username='librarian', password='12345')
+        resp = self.client.get(reverse('all-borrowed'))
+        self.assertEqual(resp.status_code, 200)
+        self.assertTrue(resp.context['is_paginated'])
+        page = resp.context['page_obj']
+        self.assertContains(resp, '?cursor=')
+
+        resp = self.client.get(reverse('all-borrowed'),
+                               {'cursor': page.next_cursor})
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(len(resp.context['bookinstance_list']), 10)
+        self.assertTrue(resp.context['page_obj'].has_previous())
+
+    def test_tampered_cursor_is_404(self):
+        self.client.login(username='librarian', password='12345')
+        resp = self.client.get(reverse('all-borrowed'), {'cursor': 'bogus'})
+        self.assertEqual(resp.status_code, 404)
+
+
+class CatalogExportViewTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.librarian = User.objects.create_user(
+            username='librarian', password='12345')
+        cls.librarian.user_permissions.add(
+            Permission.objects.get(name="Set book as returned"))
+        User.objects.create_user(username='member', password='12345')
+        author = Author.objects.create(first_name='John', last_name='Smith')
+        language = Language.objects.create(name='English')
+        book = Book.objects.create(title='Book Title', summary='Summary',
+                                   isbn='ISBN', author=author)
+        for copy_num in range(5):
+            BookInstance.objects.create(
+                book=book, imprint='Imprint', language=language,
+                status='o', borrower=cls.librarian,
+                due_back=datetime.date(2030, 1, 1 + copy_num))
+
+    def test_redirect_without_permission(self):
+        self.client.login(username='member', password='12345')
+        resp = self.client.get(reverse('catalog-export', args=['csv']))
+        self.assertEqual(resp.status_code, 302)
+
+    def test_csv_export(self):
+        self.client.login(username='librarian', password='12345')
+        resp = self.client.get(reverse('catalog-export', args=['csv']))
+        self.assertEqual(resp.status_code, 200)
+        self.assertTrue(resp.streaming)
+        self.assertEqual(resp['Content-Type'], 'text/csv')
+        lines = b''.join(resp.streaming_content).decode().splitlines()
+        self.assertEqual(lines[0], 'id,title,author,language,imprint,'
+                                   'status,borrower,due_back')
+        self.assertEqual(len(lines), 6)
+        row = next(csv.reader(lines[1:]))
+        self.assertEqual(row[1:7], ['Book Title', 'Smith, John', 'English',
+                                    'Imprint', 'o', 'librarian'])
+
+    def test_jsonl_export(self):
+        self.client.login(username='librarian', password='12345')
+        resp = self.client.get(reverse('catalog-export', args=['jsonl']))
+        rows = [json.loads(line) for line in
+                b''.join(resp.streaming_content).decode().splitlines()]
+        self.assertEqual(len(rows), 5)
+        self.assertEqual(rows[0]['author'], 'Smith, John')
+
+
+class BulkLoansViewTest(TestCase):
+
+    def setUp(self):
+        self.borrower = User.objects.create_user(
+            username='borrower', password='12345')
+        User.objects.create_user(
+            username='librarian', password='12345', is_staff=True,
+            is_superuser=True)
+        self.client.login(username='librarian', password='12345')
+        self.book = Book.objects.create(title='Book', summary='Summary',
+                                        isbn='ABCDEFG')
+        self.loans = [self.lend() for _ in range(3)]
+        self.available = BookInstance.objects.create(
+            book=self.book, imprint='Imprint', status='a')
+
+    def lend(self):
+        return BookInstance.objects.create(
+            book=self.book, imprint='Imprint', status='o',
+            borrower=self.borrower,
+            due_back=datetime.date.today() + datetime.timedelta(days=2)).pk
+
+    def post(self, copies, **data):
+        data['copies'] = [str(pk) for pk in copies]
+        return self.client.post(reverse('bulk-loans'), data)
+
+    def test_redirect_without_permission(self):
+        self.client.login(username='borrower', password='12345')
+        resp = self.client.get(reverse('bulk-loans'))
+        self.assertEqual(resp.status_code, 302)
+
+    def test_bulk_renewal(self):
+        renewal_date = datetime.date.today() + datetime.timedelta(weeks=2)
+        resp = self.post(self.loans, action='renew',
+                         renewal_date=renewal_date)
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(resp.context['result']['done'], 3)
+        self.assertEqual(
+            BookInstance.objects.filter(due_back=renewal_date).count(), 3)
+
+    def test_bulk_renewal_checks_the_date_once(self):
+        resp = self.post(self.loans, action='renew',
+                         renewal_date=datetime.date.today() -
+                         datetime.timedelta(days=1))
+        self.assertFormError(resp, 'form', 'renewal_date',
+                             'Invalid date - renewal in past')
+        resp = self.post(self.loans, action='renew')
+        self.assertFormError(resp, 'form', 'renewal_date',
+                             'A renewal date is required to renew.')
+
+    def test_bulk_return_reports_failures(self):
+        resp = self.client.post(reverse('bulk-loans'), {
+            'action': 'return',
+            'copies': [str(self.loans[0]), str(self.available.pk)],
+            'copy_ids': '%s\nnot-a-copy' % self.loans[1],
+        })
+        self.assertEqual(resp.context['result']['done'], 2)
+        self.assertEqual(sorted(resp.context['result']['failed']),
+                         sorted([str(self.available.pk), 'not-a-copy']))
+        self.assertEqual(
+            BookInstance.objects.filter(status__exact='o').count(), 1)
+        self.assertEqual(Book.objects.get(pk=self.book.pk).copies_on_loan, 1)
+
+    def test_queries_do_not_grow_with_the_batch(self):
+        def count_queries(copies):
+            with CaptureQueriesContext(connection) as queries:
+                self.post(copies, action='return')
+            return len(queries)
+
+        few = count_queries(self.loans[:2])
+        many = [self.lend() for _ in range(40)]
+        self.assertEqual(count_queries(many), few)
+
+    def test_admin_actions(self):
+        changelist = reverse('admin:catalog_bookinstance_changelist')
+        resp = self.client.post(changelist, {
+            'action': 'renew_selected',
+            '_selected_action': [str(pk) for pk in self.loans[:2]],
+        })
+        self.assertEqual(resp.status_code, 302)
+        self.assertEqual(
+            BookInstance.objects.filter(
+                due_back=datetime.date.today() +
+                datetime.timedelta(weeks=3)).count(), 2)
+
+        self.client.post(changelist, {
+            'action': 'return_selected',
+            '_selected_action': [str(pk) for pk in self.loans] +
+                                [str(self.available.pk)],
+        })
+        self.assertFalse(
+            BookInstance.objects.filter(status__exact='o').exists())
+
+    def test_admin_actions_report_concurrent_changes(self):
+        def changed(*args):
+            raise LoanError('Copies changed during the operation.')
+
+        changelist = reverse('admin:catalog_bookinstance_changelist')
+        with mock.patch('catalog.admin.return_copies', changed):
+            resp = self.client.post(changelist, {
+                'action': 'return_selected',
+                '_selected_action': [str(pk) for pk in self.loans],
+            }, follow=True)
+        self.assertContains(resp, 'changed in the meantime')
+
+        hold = place_hold(self.book.pk, self.borrower)
+        with mock.patch('catalog.admin.cancel_hold', changed):
+            resp = self.client.post(
+                reverse('admin:catalog_hold_changelist'), {
+                    'action': 'cancel_selected',
+                    '_selected_action': [str(hold.pk)],
+                }, follow=True)
+        self.assertContains(resp, '1 holds changed in the meantime')
@@ -0,0 +1,50 @@
+from django.core.cache import cache
+from django.core.management import call_command
+from django.core.urlresolvers import reverse
+from django.test import TestCase, override_settings
+from django.utils.six import StringIO
+
+from catalog.models import CatalogStatistic
+from catalog.visits import SITE_VISITS, VISITS_COOKIE, record_visit
+
+
+def stored_visits():
+    return CatalogStatistic.objects.filter(name=SITE_VISITS).values_list(
+        'value', flat=True).first()
+
+
+class VisitCountingTest(TestCase):
+
+    def setUp(self):
+        cache.clear()
+
+    def test_index_counts_visits_without_a_session(self):
+        for visits in range(3):
+            resp = self.client.get(reverse('index'))
+            self.assertEqual(resp.context['num_visits'], visits)
+            self.assertIn(VISITS_COOKIE, resp.cookies)
+            self.assertNotIn('sessionid', resp.cookies)
+        self.assertEqual(resp.context['num_site_visits'], 3)
+
+    def test_tampered_cookie_counts_as_first_visit(self):
+        self.client.cookies[VISITS_COOKIE] = '99:forged'
+        resp = self.client.get(reverse('index'))
+        self.assertEqual(resp.context['num_visits'], 0)
+
+    @override_settings(CATALOG_VISIT_FLUSH_EVERY=3)
+    def test_visits_are_saved_in_batches(self):
+        with self.assertNumQueries(0):
+            record_visit()
+            record_visit()
+        self.assertIsNone(stored_visits())
+        record_visit()
+        self.assertEqual(stored_visits(), 3)
+        for _ in range(4):
+            record_visit()
+        self.assertEqual(stored_visits(), 6)
+
+        call_command('flush_visits', stdout=StringIO())
+        self.assertEqual(stored_visits(), 7)
+        resp = self.client.get(reverse('index'))
+        # Including this visit
+        self.assertEqual(resp.context['num_site_visits'], 8)
@@ -0,0 +1,24 @@
+from contextlib import contextmanager
+
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+
+class QueryBudgetMixin(object):
+    """
+    TestCase mixin for catching N+1 query regressions.
+
+    Wrap a request in assertQueryBudget(n); the test fails, listing the
+    SQL that ran, if it issued more than n queries.
+    """
+
+    @contextmanager
+    def assertQueryBudget(self, budget):
+        with CaptureQueriesContext(connection) as context:
+            yield context
+        executed = len(context)
+        if executed > budget:
+            self.fail('%d queries executed, the budget is %d:\n%s' % (
+                executed, budget,
+                '\n'.join('%d. %s' % (n, query['sql'])
+                          for n, query in enumerate(context, start=1))))
@@ -8,6 +8,9 @@ urlpatterns = [
     url(r'^book/(?P<pk>\d+)$', views.BookDetailView.as_view(),
         name='book-detail'),
 
+    url(r'^search/$', views.BookSearchView.as_view(), name='book-search'),
+    url(r'^browse/$', views.BookBrowseView.as_view(), name='book-browse'),
+
     url(r'^authors/$', views.AuthorListView.as_view(), name='authors'),
     url(r'^author/(?P<pk>\d+)$', views.AuthorDetailView.as_view(),
         name='author-detail'),
@@ -21,6 +24,18 @@ urlpatterns = [
     url(r'^book/(?P<pk>[-\w]+)/renew/$', views.renew_book_librarian,
         name='renew-book-librarian'),
 
+    url(r'^borrowed/bulk/$', views.bulk_loans, name='bulk-loans'),
+
+    url(r'^export\.(?P<file_format>csv|jsonl)$', views.export_catalog,
+        name='catalog-export'),
+
+    url(r'^metrics$', views.metrics, name='catalog-metrics'),
+
+    url(r'^api/(?P<resource>books|authors|copies|genres|languages)/$',
+        views.api, name='api-list'),
+    url(r'^api/(?P<resource>books|authors|copies|genres|languages)/'
+        r'(?P<pk>[-\w]+)$', views.api, name='api-detail'),
+
     url(r'^author/create/$', views.AuthorCreate.as_view(),
         name='author-create'),
 
@@ -1,17 +1,39 @@
 import datetime
+import hashlib
+import json
 
+from django.conf import settings
 from django.contrib.auth.decorators import permission_required
 from django.contrib.auth.mixins import (LoginRequiredMixin,
                                         PermissionRequiredMixin)
+from django.core.exceptions import PermissionDenied
 from django.core.urlresolvers import reverse
-from django.http import HttpResponseRedirect
+from django.http import (HttpResponse, HttpResponseNotAllowed,
+                         HttpResponseRedirect, JsonResponse,
+                         StreamingHttpResponse)
 from django.shortcuts import render, get_object_or_404
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, quote_etag
 from django.views import generic
 from django.views.generic.edit import CreateView, UpdateView, DeleteView
 from django.urls import reverse_lazy
 
-from .forms import RenewBookForm
-from .models import Book, Author, BookInstance, Genre
+from .api import (RESOURCES, ApiError, Query, delete_object, read_list,
+                  read_object, write_object)
+from .caching import CachedResponseMixin, get_versions
+from .export import CONTENT_TYPES, export_lines
+from .facets import (FACETS, facet_choices, filter_books, filter_query,
+                     parse_filters)
+from .forms import BookForm, BookSearchForm, BulkLoanForm, RenewBookForm
+from .instrumentation import metrics as request_metrics
+from .loans import (LOAN_PERIOD, LoanError, renew, renew_copies,
+                    return_copies)
+from .models import Book, Author, BookInstance
+from .pagination import KeysetPaginationMixin
+from .routers import use_primary
+from .search import search_books
+from .stats import get_catalog_stats
+from .visits import get_site_visits, get_visits, record_visit, set_visits
 
 # Create your views here.
 
@@ -20,74 +42,172 @@ def index(request):
     """
     view function for home page of site.
     """
-    # Generate counts of some of the main objects
-    num_books = Book.objects.all().count()
-    # Number of all available copies of all books
-    num_instances = BookInstance.objects.all().count()
+    # Counts of the main objects, kept current by signal handlers
+    # (see catalog.stats) so this is one query however big the catalog is
+    stats = get_catalog_stats()
 
-    # Available books i.e. books with status available
-    num_instances_available = BookInstance.objects.filter(status__exact='a').count()
-
-    # The all() is implmeneted by default.
-    num_authors = Author.objects.count()
-
-    # Genre count
-    num_genre = Genre.objects.count()
-
-    # Book titles that contain the word 'python'
-    num_python = Book.objects.filter(title__icontains='python').count()
-
-    # How many times the site has been visited
-    # Each time we receive a request we increament the value
-    # store it back in the session
-    num_visits = request.session.get('num_visits', 0)
-    request.session['num_visits'] = num_visits + 1
+    # How many times this visitor has been here, kept in a signed cookie
+    # rather than the session so counting needs no database write
+    # (see catalog.visits)
+    num_visits = get_visits(request)
+    record_visit()
 
     # Render the HTML template index.html with the data in the context variable
-    return render(
+    response = render(
         request,
         'index.html',
-        context={'num_books': num_books, 'num_instances': num_instances,
-                 'num_instances_available': num_instances_available,
-                 'num_authors': num_authors,
-                 'num_genre': num_genre,
-                 'num_python': num_python,
-                 'num_visits': num_visits
+        context={'num_books': stats['num_books'],
+                 'num_instances': stats['num_instances'],
+                 'num_instances_available': stats['num_instances_available'],
+                 'num_authors': stats['num_authors'],
+                 'num_genre': stats['num_genre'],
+                 'num_python': stats['num_python'],
+                 'num_visits': num_visits,
+                 'num_site_visits': get_site_visits(stats),
                  }
     )
+    set_visits(response, num_visits + 1)
+    return response
+
+
+class EagerLoadingMixin(object):
+    """
+    Mixin for generic views declaring up front which related objects
+    their templates use, so walking a relation does not cost a query per row.
 
+    select_related -- foreign keys joined into the main query
+    prefetch_related -- relations (or Prefetch objects) loaded in one extra
+                        query each
+    annotations -- aggregates (e.g. counts) computed by the main query
+    """
+    select_related = ()
+    prefetch_related = ()
+    annotations = {}
 
-class BookListView(generic.ListView):
+    def get_queryset(self):
+        queryset = super(EagerLoadingMixin, self).get_queryset()
+        if self.select_related:
+            queryset = queryset.select_related(*self.select_related)
+        if self.prefetch_related:
+            queryset = queryset.prefetch_related(*self.prefetch_related)
+        if self.annotations:
+            queryset = queryset.annotate(**self.annotations)
+        return queryset
+
+
+class BookListView(CachedResponseMixin, KeysetPaginationMixin,
+                   EagerLoadingMixin, generic.ListView):
     model = Book
     paginate_by = 3
+    cache_models = ('book', 'author')
+    cache_params = ('page',)
+    keyset_ordering = ('title', 'id')
+    select_related = ('author',)
 
 
-class BookDetailView(generic.DetailView):
+class BookDetailView(CachedResponseMixin, EagerLoadingMixin,
+                     generic.DetailView):
     model = Book
+    # Author, genre and language names appear on the page too
+    cache_models = ('author', 'genre', 'language')
+    select_related = ('author',)
+    # The genre and language names come from catalog.dimensions; the
+    # copies are loaded by the template (Book.copies) only when its
+    # cached fragment is stale
+
+    def get_cache_objects(self):
+        return ['book:%s' % self.kwargs['pk']]
+
+
+class BookBrowseView(CachedResponseMixin, KeysetPaginationMixin,
+                     EagerLoadingMixin, generic.ListView):
+    """
+    Generic class-based view listing the books having every selected
+    genre, language, author and availability, with the number of books
+    each further filter would leave (see catalog.facets).
+    """
+    model = Book
+    template_name = 'catalog/book_browse.html'
+    paginate_by = 10
+    cache_models = ('book', 'author', 'genre', 'language', 'facets')
+    cache_params = tuple(FACETS.values()) + ('cursor',)
+    keyset_pagination = True
+    keyset_ordering = ('title', 'id')
+    select_related = ('author',)
+
+    def get_queryset(self):
+        self.filters = parse_filters(self.request.GET)
+        return filter_books(super(BookBrowseView, self).get_queryset(),
+                            self.filters)
+
+    def get_context_data(self, **kwargs):
+        context = super(BookBrowseView, self).get_context_data(**kwargs)
+        context['facets'] = facet_choices(self.filters)
+        context['filter_query'] = filter_query(self.filters)
+        return context
+
+
+class BookSearchView(generic.ListView):
+    """
+    Generic class-based view listing the books matching a search,
+    best match first.
+    """
+    template_name = 'catalog/book_search.html'
+    paginate_by = 10
+
+    def get_queryset(self):
+        self.form = BookSearchForm(self.request.GET)
+        query = ''
+        if self.form.is_valid():
+            query = self.form.cleaned_data['q']
+        return search_books(query)
+
+    def get_context_data(self, **kwargs):
+        context = super(BookSearchView, self).get_context_data(**kwargs)
+        context['form'] = self.form
+        return context
 
 
-class AuthorListView(generic.ListView):
+class AuthorListView(CachedResponseMixin, KeysetPaginationMixin,
+                     EagerLoadingMixin, generic.ListView):
     model = Author
     paginate_by = 3
+    cache_models = ('author',)
+    cache_params = ('page',)
+    keyset_ordering = ('last_name', 'first_name', 'id')
 
 
-class AuthorDetailView(generic.DetailView):
+class AuthorDetailView(CachedResponseMixin, EagerLoadingMixin,
+                       generic.DetailView):
     model = Author
+    # The template lists each book with its (denormalized) number of
+    # copies, in a fragment cached on the 'author:<pk>' version
+    def get_cache_objects(self):
+        return ['author:%s' % self.kwargs['pk']]
 
 
-class LoanedBookByUserListView(LoginRequiredMixin, generic.ListView):
+class LoanedBookByUserListView(LoginRequiredMixin, KeysetPaginationMixin,
+                               EagerLoadingMixin, generic.ListView):
     """
     Generic class-based view listing books on loan to current user.
     """
     model = BookInstance
     template_name = 'catalog/bookinstance_list_borrowed_user.html'
     paginate_by = 10
+    keyset_pagination = True
+    keyset_ordering = ('due_back', 'id')
+    select_related = ('book',)
 
     def get_queryset(self):
-        return BookInstance.objects.filter(borrower=self.request.user).filter(status__exact='o').order_by('due_back')
+        # The template highlights overdue loans
+        return super(LoanedBookByUserListView, self).get_queryset().filter(
+            borrower=self.request.user).filter(
+            status__exact='o').with_overdue().order_by('due_back')
 
 
-class LoadBooksByAllUsersListView(PermissionRequiredMixin, generic.ListView):
+class LoadBooksByAllUsersListView(PermissionRequiredMixin,
+                                  KeysetPaginationMixin, EagerLoadingMixin,
+                                  generic.ListView):
     model = BookInstance
     permission_required = (
         'catalog.can_mark_returned',
@@ -95,9 +215,14 @@ class LoadBooksByAllUsersListView(PermissionRequiredMixin, generic.ListView):
 
     template_name = 'catalog/bookinstance_list_all_borrowed.html'
     paginate_by = 10
+    # Tens of thousands of loans: page with cursors rather than offsets
+    keyset_pagination = True
+    keyset_ordering = ('due_back', 'id')
+    select_related = ('book', 'borrower')
 
     def get_queryset(self):
-        return BookInstance.objects.filter(status__exact='o').order_by('due_back')
+        return super(LoadBooksByAllUsersListView, self).get_queryset().filter(
+            status__exact='o').with_overdue().order_by('due_back')
 
 
 @permission_required('catalog.can_mark_returned')
@@ -117,12 +242,15 @@ def renew_book_librarian(request, pk):
         # Check if form is valid
         if form.is_valid():
             # Process the data in form.cleaned as required
-            # (here just write it to the model due_back field)
-            book_inst.due_back = form.cleaned_data['renewal_date']
-            book_inst.save()
-
-            # redirect to a new URL
-            return HttpResponseRedirect(reverse('all-borrowed'))
+            # (here move the due date, unless the copy was returned
+            # in the meantime)
+            try:
+                renew(book_inst.pk, form.cleaned_data['renewal_date'])
+            except LoanError:
+                form.add_error(None, 'This copy is no longer on loan.')
+            else:
+                # redirect to a new URL
+                return HttpResponseRedirect(reverse('all-borrowed'))
     # If this a GET (or any other method) create the defauld form
     else:
         proposed_renewal_date = datetime.date.today() + datetime.timedelta(weeks=3)
@@ -134,6 +262,55 @@ def renew_book_librarian(request, pk):
                   )
 
 
+@permission_required('catalog.can_mark_returned')
+def bulk_loans(request):
+    """
+    View function renewing or returning many copies at once (e.g. those
+    ticked on the All borrowed page), one batched UPDATE for all of them
+    """
+    result = None
+    if request.method == 'POST':
+        form = BulkLoanForm(request.POST)
+        if form.is_valid():
+            action = form.cleaned_data['action']
+            copy_ids = (request.POST.getlist('copies') +
+                        form.cleaned_data['copy_ids'])
+            try:
+                if action == 'renew':
+                    done, failed = renew_copies(
+                        copy_ids, form.cleaned_data['renewal_date'])
+                else:
+                    done, failed = return_copies(copy_ids)
+            except LoanError:
+                form.add_error(None, 'Some of the copies changed in the '
+                                     'meantime, nothing was done. '
+                                     'Please try again.')
+            else:
+                result = {'action': action, 'done': len(done),
+                          'failed': [str(pk) for pk in failed]}
+    else:
+        form = BulkLoanForm(initial={
+            'action': 'renew',
+            'renewal_date': datetime.date.today() + LOAN_PERIOD,
+        })
+
+    return render(request, 'catalog/bookinstance_bulk.html',
+                  {'form': form, 'result': result})
+
+
+@permission_required('catalog.can_mark_returned')
+def export_catalog(request, file_format):
+    """
+    View function streaming every book copy (with book, author, language,
+    borrower and due date) as CSV or JSON Lines
+    """
+    response = StreamingHttpResponse(export_lines(file_format),
+                                     content_type=CONTENT_TYPES[file_format])
+    response['Content-Disposition'] = (
+        'attachment; filename="catalog.%s"' % file_format)
+    return response
+
+
 class AuthorCreate(PermissionRequiredMixin, CreateView):
     model = Author
     fields = '__all__'
@@ -155,14 +332,103 @@ class AuthorDelete(PermissionRequiredMixin, DeleteView):
 
 class BookCreate(CreateView):
     model = Book
-    fields = '__all__'
+    form_class = BookForm
 
 
 class BookUpdate(UpdateView):
     model = Book
-    fields = '__all__'
+    form_class = BookForm
 
 
 class BookDelete(DeleteView):
     model = Book
     success_url = reverse_lazy('books')
+
+
+def metrics(request):
+    """
+    Request metrics of this process in the Prometheus text format,
+    for staff and the INTERNAL_IPS (e.g. a local Prometheus).
+    """
+    if not (request.user.is_staff or
+            request.META.get('REMOTE_ADDR') in settings.INTERNAL_IPS):
+        raise PermissionDenied
+    return HttpResponse(request_metrics.render(),
+                        content_type='text/plain; version=0.0.4; '
+                                     'charset=utf-8')
+
+
+def page_link(request, cursor):
+    if cursor is None:
+        return None
+    params = request.GET.copy()
+    params['cursor'] = cursor
+    return '%s?%s' % (request.path, params.urlencode())
+
+
+def api(request, resource, pk=None):
+    """
+    View function serving the JSON API (see catalog.api): a listing
+    without pk, one object with it.
+    """
+    resource = RESOURCES[resource]
+    allowed = (['GET', 'HEAD', 'POST'] if pk is None else
+               ['GET', 'HEAD', 'PUT', 'PATCH', 'DELETE'])
+    if request.method not in allowed:
+        return HttpResponseNotAllowed(allowed)
+    try:
+        if request.method in ('GET', 'HEAD'):
+            return api_read(request, resource, pk)
+        if request.method == 'DELETE':
+            delete_object(resource, request.user, pk)
+            return HttpResponse(status=204)
+        try:
+            data = json.loads(request.body.decode('utf-8'))
+        except ValueError:
+            raise ApiError({'data': 'Send a JSON object.'})
+        saved = write_object(resource, request.user, data, pk,
+                             partial=request.method == 'PATCH')
+        obj, included = read_object(Query(resource, {}), saved)
+        response = JsonResponse({'data': obj},
+                                status=201 if pk is None else 200)
+        if pk is None:
+            response['Location'] = reverse('api-detail',
+                                           args=[resource.name, saved])
+        return response
+    except ApiError as error:
+        return JsonResponse({'errors': error.errors}, status=error.status)
+
+
+def api_read(request, resource, pk):
+    query = Query(resource, request.GET)
+    # Like the cached pages, the response only changes when one of the
+    # versions does, so conditional GETs need no database query
+    versions, last_modified = get_versions(
+        ['catalog'] + query.version_names())
+    etag = hashlib.md5(('api|%s|%s' % (
+        request.get_full_path(), sorted(versions.items()),
+    )).encode('utf-8')).hexdigest()
+    last_modified = int(last_modified)
+
+    response = get_conditional_response(
+        request, etag=etag, last_modified=last_modified)
+    if response is None:
+        # Read from the primary: a lagging replica would send old data
+        # under the new ETag
+        with use_primary():
+            if pk is None:
+                objects, included, next_cursor, previous_cursor = read_list(
+                    query, request.GET)
+                content = {'data': objects, 'links': {
+                    'next': page_link(request, next_cursor),
+                    'previous': page_link(request, previous_cursor),
+                }}
+            else:
+                content, included = read_object(query, pk)
+                content = {'data': content}
+        if query.include:
+            content['included'] = included
+        response = JsonResponse(content)
+    response['ETag'] = quote_etag(etag)
+    response['Last-Modified'] = http_date(last_modified)
+    return response
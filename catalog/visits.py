@@ -0,0 +1,100 @@
+"""
+Visit counting for the home page, without touching the session.
+
+Each visitor's own count lives in a signed cookie, so counting a visit
+needs no session row write (and no session at all for anonymous
+visitors). The site-wide total is buffered in the cache: every visit is
+one atomic cache increment, and the buffer is added to the 'site_visits'
+CatalogStatistic once every CATALOG_VISIT_FLUSH_EVERY visits, or by
+`manage.py flush_visits`. Visits still in the buffer when the cache is
+cleared or evicts it are lost, which is fine for a page counter.
+"""
+from django.conf import settings
+from django.core import signing
+from django.db.models import F
+
+from .caching import get_cache
+from .models import CatalogStatistic
+
+VISITS_COOKIE = 'catalog_visits'
+VISITS_SALT = 'catalog.visits'
+# Remember a visitor's count for a year
+VISITS_MAX_AGE = 60 * 60 * 24 * 365
+
+SITE_VISITS = 'site_visits'
+PENDING_KEY = 'catalog:visits:pending'
+DEFAULT_FLUSH_EVERY = 100
+
+
+def get_visits(request):
+    """
+    How many times this visitor saw the page before, from their cookie.
+    A missing or tampered with cookie counts as no visit.
+    """
+    try:
+        return max(0, int(request.get_signed_cookie(
+            VISITS_COOKIE, 0, salt=VISITS_SALT, max_age=VISITS_MAX_AGE)))
+    except (signing.BadSignature, ValueError):
+        return 0
+
+
+def set_visits(response, visits):
+    response.set_signed_cookie(VISITS_COOKIE, str(visits), salt=VISITS_SALT,
+                               max_age=VISITS_MAX_AGE, httponly=True)
+
+
+def flush_every():
+    return getattr(settings, 'CATALOG_VISIT_FLUSH_EVERY', DEFAULT_FLUSH_EVERY)
+
+
+def add_site_visits(count):
+    """
+    Add count visits to the stored total, creating it on first use.
+    """
+    if count and not CatalogStatistic.objects.filter(
+            name=SITE_VISITS).update(value=F('value') + count):
+        statistic, created = CatalogStatistic.objects.get_or_create(
+            name=SITE_VISITS, defaults={'value': count})
+        if not created:
+            add_site_visits(count)
+
+
+def record_visit():
+    """
+    Count one visit in the buffer, flushing it to the database when full.
+    """
+    cache = get_cache()
+    try:
+        pending = cache.incr(PENDING_KEY)
+    except ValueError:
+        if cache.add(PENDING_KEY, 1, None):
+            pending = 1
+        else:
+            pending = cache.incr(PENDING_KEY)
+    # Only the one visit reaching the threshold flushes: increments are
+    # atomic, so no two of them see the same value
+    if pending == flush_every():
+        cache.decr(PENDING_KEY, pending)
+        add_site_visits(pending)
+
+
+def flush_visits():
+    """
+    Move the buffered visits to the database. Returns how many moved.
+    """
+    cache = get_cache()
+    pending = cache.get(PENDING_KEY) or 0
+    if pending > 0:
+        cache.decr(PENDING_KEY, pending)
+        add_site_visits(pending)
+    return pending
+
+
+def get_site_visits(stats):
+    """
+    The total visits to the site, including the buffered ones.
+    stats -- the statistics from catalog.stats.get_catalog_stats(), which
+             include the stored total
+    """
+    pending = get_cache().get(PENDING_KEY) or 0
+    return stats.get(SITE_VISITS, 0) + max(0, pending)
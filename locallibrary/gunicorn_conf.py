@@ -0,0 +1,30 @@
+"""
+Gunicorn settings for the locallibrary project (see the Procfile).
+
+Django 1.10 cannot serve async views over ASGI, so each worker runs
+several threads instead: a request waiting on the database then blocks
+its own thread rather than the whole worker. The threads of a worker
+share a pool of $DATABASE_POOL_SIZE database connections (see
+catalog/dbbackends), so the database must accept workers * that many.
+`python -m benchmarks.concurrency` compares this with sync workers.
+
+The page cache versions must be shared by the workers (see
+catalog/caching.py), so with several workers and no DJANGO_CACHE_BACKEND
+the cache defaults to files under $DJANGO_CACHE_LOCATION rather than the
+per-process LocMemCache; the workers inherit the setting.
+"""
+import multiprocessing
+import os
+import tempfile
+
+# $WEB_CONCURRENCY is set by Heroku for the dyno size
+workers = int(os.environ.get('WEB_CONCURRENCY',
+                             multiprocessing.cpu_count() * 2 + 1))
+worker_class = 'gthread'
+threads = int(os.environ.get('GUNICORN_THREADS', 8))
+
+if workers > 1 and 'DJANGO_CACHE_BACKEND' not in os.environ:
+    os.environ['DJANGO_CACHE_BACKEND'] = (
+        'django.core.cache.backends.filebased.FileBasedCache')
+    os.environ.setdefault('DJANGO_CACHE_LOCATION', os.path.join(
+        tempfile.gettempdir(), 'locallibrary-cache'))
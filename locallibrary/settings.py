@@ -30,6 +30,9 @@ DEBUG = bool(os.environ.get('DJANGO_DEBUG', True))
 
 ALLOWED_HOSTS = ['mozila-local-library.herokuapp.com', '127.0.0.1']
 
+# Addresses allowed to scrape /catalog/metrics without logging in
+INTERNAL_IPS = ['127.0.0.1']
+
 
 # Application definition
 
@@ -44,6 +47,10 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    # First, so its timings include the rest of the stack
+    'catalog.instrumentation.InstrumentationMiddleware',
+    # Lets safe requests read from the replicas (catalog/routers.py)
+    'catalog.routers.ReplicaStickinessMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -57,7 +64,8 @@ ROOT_URLCONF = 'locallibrary.urls'
 
 TEMPLATES = [
     {
-        'BACKEND': 'django.template.backends.django.DjangoTemplates',
+        # The Django backend, timing template rendering for the metrics
+        'BACKEND': 'catalog.instrumentation.InstrumentedDjangoTemplates',
         'DIRS': ['./templates'],
         'APP_DIRS': True,
         'OPTIONS': {
@@ -71,6 +79,16 @@ TEMPLATES = [
     },
 ]
 
+if not DEBUG:
+    # Parse each template once per process instead of on every render
+    TEMPLATES[0]['APP_DIRS'] = False
+    TEMPLATES[0]['OPTIONS']['loaders'] = [
+        ('django.template.loaders.cached.Loader', [
+            'django.template.loaders.filesystem.Loader',
+            'django.template.loaders.app_directories.Loader',
+        ]),
+    ]
+
 WSGI_APPLICATION = 'locallibrary.wsgi.application'
 
 
@@ -85,6 +103,27 @@ DATABASES = {
 }
 
 
+# Cache
+# https://docs.djangoproject.com/en/1.10/topics/cache/
+# Catalog pages and the version numbers invalidating them live here
+# (see catalog/caching.py). Use a shared backend (file based, memcached,
+# Redis) when running several worker processes; gunicorn_conf.py switches
+# to a file based one for them when DJANGO_CACHE_BACKEND is not set.
+
+CACHES = {
+    'default': {
+        'BACKEND': os.environ.get(
+            'DJANGO_CACHE_BACKEND',
+            'django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': os.environ.get('DJANGO_CACHE_LOCATION', 'locallibrary'),
+    }
+}
+
+
+# Keeps each user's permission set in the cache (catalog/backends.py)
+AUTHENTICATION_BACKENDS = ['catalog.backends.CachedPermissionsBackend']
+
+
 # Password validation
 # https://docs.djangoproject.com/en/1.10/ref/settings/#auth-password-validators
 
@@ -131,11 +170,89 @@ STATIC_ROOT = os.path.join(BASE_DIR, 'staticfiles')
 # Reduces the size of the static files when they are being served
 STATICFILES_STORAGE = 'whitenoise.django.GzipManifestStaticFilesStorage'
 
+# Static copies of the anonymous catalog pages, written by
+# `manage.py prerender_catalog` and served by
+# catalog.prerender.PrerenderedPages
+CATALOG_PRERENDER_ROOT = os.path.join(BASE_DIR, 'prerendered')
+
 # Redirect to home URL after login (Default redirects to /account/profile)
 LOGIN_REDIRECT_URL = '/'
 
 EMAIL_BACKEND = 'django.core.mail.backends.console.EmailBackend'
 
+# Request instrumentation (see catalog/instrumentation.py): requests
+# taking longer than this are logged with their slowest SQL statements
+CATALOG_SLOW_REQUEST_MS = int(os.environ.get('CATALOG_SLOW_REQUEST_MS', 500))
+CATALOG_SLOW_REQUEST_SQL = 5
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {
+            'class': 'logging.StreamHandler',
+        },
+    },
+    'loggers': {
+        'catalog.slow_requests': {
+            'handlers': ['console'],
+            'level': 'WARNING',
+            'propagate': False,
+        },
+    },
+}
+
 # Heroku: Update database configuration from $DATABASE_URL
-db_from_env = dj_database_url.config(conn_max_age=500)
+db_from_env = dj_database_url.config()
 DATABASES['default'].update(db_from_env)
+
+# Connection management (see catalog/dbbackends): the stock PostgreSQL
+# and SQLite backends, with a pool of connections in each worker process
+# shared by its threads, and SQLite tuned with PRAGMAs. The database must
+# accept workers * DATABASE_POOL_SIZE connections.
+POOLED_ENGINES = {
+    'django.db.backends.postgresql': 'catalog.dbbackends.postgresql',
+    'django.db.backends.postgresql_psycopg2': 'catalog.dbbackends.postgresql',
+    'django.db.backends.sqlite3': 'catalog.dbbackends.sqlite3',
+}
+DATABASE_POOL = {
+    'MAX_SIZE': int(os.environ.get('DATABASE_POOL_SIZE', 4)),
+    'TIMEOUT': 10,
+    'CHECK_AFTER': 30,
+    'MAX_AGE': 1800,
+}
+
+
+def use_pool(database):
+    if database['ENGINE'] in POOLED_ENGINES:
+        database['ENGINE'] = POOLED_ENGINES[database['ENGINE']]
+        database['POOL'] = dict(DATABASE_POOL)
+        # Requests give their connection back to the pool when they end
+        database['CONN_MAX_AGE'] = 0
+    return database
+
+
+use_pool(DATABASES['default'])
+
+# Read replicas, from $DATABASE_REPLICA_URLS (space separated URLs like
+# $DATABASE_URL). Catalog reads in GET requests go to them, everything else
+# to 'default' (see catalog/routers.py). To try it locally with SQLite:
+#   DATABASE_URL=sqlite:////tmp/primary.sqlite3 \
+#   DATABASE_REPLICA_URLS=sqlite:////tmp/replica.sqlite3 \
+#   python manage.py sync_sqlite_replicas
+CATALOG_REPLICAS = []
+for number, replica_url in enumerate(
+        os.environ.get('DATABASE_REPLICA_URLS', '').split(), start=1):
+    alias = 'replica%d' % number
+    DATABASES[alias] = use_pool(dj_database_url.parse(replica_url))
+    # Tests run against the primary's test database
+    DATABASES[alias]['TEST'] = {'MIRROR': 'default'}
+    CATALOG_REPLICAS.append(alias)
+
+DATABASE_ROUTERS = ['catalog.routers.PrimaryReplicaRouter']
+
+# How long a user reads from the primary after writing to the catalog
+CATALOG_REPLICA_STICKY_SECONDS = 15
+
+# Home page visits buffered in the cache before being saved (catalog/visits.py)
+CATALOG_VISIT_FLUSH_EVERY = 100
@@ -15,4 +15,9 @@ from whitenoise.django import DjangoWhiteNoise
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "locallibrary.settings")
 
 application = get_wsgi_application()
-application = DjangoWhiteNoise(application)
+
+# Imported once Django is set up
+from catalog.prerender import PrerenderedPages  # noqa
+
+# Static files, then the prerendered catalog pages, then Django
+application = DjangoWhiteNoise(PrerenderedPages(application))